@@ -45,6 +45,23 @@ target_db = current_app.extensions['migrate'].db
 # ... etc.
 
 
+# Objetos del índice de búsqueda (src/api/search.py) que no están en los modelos:
+# autogenerate no debe proponer borrarlos
+UNMANAGED_TABLE_PREFIXES = ('product_fts',)
+UNMANAGED_COLUMNS = {('product', 'search_vector')}
+UNMANAGED_INDEXES = {'ix_product_search_vector'}
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if type_ == 'table' and name.startswith(UNMANAGED_TABLE_PREFIXES):
+        return False
+    if type_ == 'column' and (object.table.name, name) in UNMANAGED_COLUMNS:
+        return False
+    if type_ == 'index' and name in UNMANAGED_INDEXES:
+        return False
+    return True
+
+
 def get_metadata():
     if hasattr(target_db, 'metadatas'):
         return target_db.metadatas[None]
@@ -93,6 +110,8 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    if conf_args.get("include_object") is None:
+        conf_args["include_object"] = include_object
 
     connectable = get_engine()
 
@@ -0,0 +1,48 @@
+"""add stripe events
+
+Revision ID: 0a6d3e5f9c72
+Revises: f2c7a9d84b16
+Create Date: 2026-10-18 16:04:52.113870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a6d3e5f9c72'
+down_revision = 'f2c7a9d84b16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('stripe_event',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_id', sa.String(length=255), nullable=False),
+    sa.Column('type', sa.String(length=100), nullable=False),
+    sa.Column('payload', sa.Text(), nullable=False),
+    sa.Column('received_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('stripe_event', schema=None) as batch_op:
+        batch_op.create_index('ix_stripe_event_event_id', ['event_id'], unique=True)
+
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('stripe_session_id', sa.String(length=255), nullable=True))
+        batch_op.add_column(sa.Column('stripe_payment_intent', sa.String(length=255), nullable=True))
+        batch_op.create_index('ix_order_stripe_session_id', ['stripe_session_id'], unique=True)
+        batch_op.create_index('ix_order_stripe_payment_intent', ['stripe_payment_intent'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.drop_index('ix_order_stripe_payment_intent')
+        batch_op.drop_index('ix_order_stripe_session_id')
+        batch_op.drop_column('stripe_payment_intent')
+        batch_op.drop_column('stripe_session_id')
+
+    with op.batch_alter_table('stripe_event', schema=None) as batch_op:
+        batch_op.drop_index('ix_stripe_event_event_id')
+
+    op.drop_table('stripe_event')
@@ -0,0 +1,34 @@
+"""add product updated_at
+
+Revision ID: 3f2a9c1d7e45
+Revises: 0b87b54b6683
+Create Date: 2026-10-18 10:12:41.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7e45'
+down_revision = '0b87b54b6683'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+
+    # Las filas existentes toman su fecha de creación como versión inicial
+    op.execute("UPDATE product SET updated_at = created_at")
+
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.alter_column('updated_at',
+               existing_type=sa.DateTime(timezone=True),
+               nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
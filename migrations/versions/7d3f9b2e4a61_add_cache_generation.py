@@ -0,0 +1,28 @@
+"""add cache generation
+
+Revision ID: 7d3f9b2e4a61
+Revises: b5e1d7c3a920
+Create Date: 2026-10-18 21:04:37.512906
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3f9b2e4a61'
+down_revision = 'b5e1d7c3a920'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('cache_generation',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('value', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('cache_generation')
@@ -0,0 +1,66 @@
+"""add lookup indexes
+
+Revision ID: a7c4e2b91f03
+Revises: 3f2a9c1d7e45
+Create Date: 2026-10-18 11:03:27.540912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c4e2b91f03'
+down_revision = '3f2a9c1d7e45'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Antes del índice único: fusionamos líneas de carrito duplicadas (mismo usuario y producto)
+    op.execute("""
+        UPDATE cart_item SET quantity = (
+            SELECT SUM(c2.quantity) FROM cart_item c2
+            WHERE c2.user_id = cart_item.user_id AND c2.product_id = cart_item.product_id
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM cart_item GROUP BY user_id, product_id HAVING COUNT(*) > 1
+        )
+    """)
+    op.execute("""
+        DELETE FROM cart_item WHERE id NOT IN (
+            SELECT MIN(id) FROM cart_item GROUP BY user_id, product_id
+        )
+    """)
+
+    with op.batch_alter_table('cart_item', schema=None) as batch_op:
+        batch_op.create_index('ix_cart_item_user_id_product_id', ['user_id', 'product_id'], unique=True)
+        batch_op.create_index(batch_op.f('ix_cart_item_product_id'), ['product_id'], unique=False)
+
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_order_user_id'), ['user_id'], unique=False)
+
+    with op.batch_alter_table('order_item', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_order_item_order_id'), ['order_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_order_item_product_id'), ['product_id'], unique=False)
+
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.create_index('ix_product_created_at_id', ['created_at', 'id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_product_updated_at'), ['updated_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_product_updated_at'))
+        batch_op.drop_index('ix_product_created_at_id')
+
+    with op.batch_alter_table('order_item', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_order_item_product_id'))
+        batch_op.drop_index(batch_op.f('ix_order_item_order_id'))
+
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_order_user_id'))
+
+    with op.batch_alter_table('cart_item', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_cart_item_product_id'))
+        batch_op.drop_index('ix_cart_item_user_id_product_id')
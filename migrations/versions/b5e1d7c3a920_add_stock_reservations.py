@@ -0,0 +1,59 @@
+"""add stock and reservations
+
+Revision ID: b5e1d7c3a920
+Revises: 0a6d3e5f9c72
+Create Date: 2026-10-18 17:22:09.418305
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e1d7c3a920'
+down_revision = '0a6d3e5f9c72'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('stock', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('stock_buckets', sa.Integer(), server_default='0', nullable=False))
+
+    op.create_table('product_stock_bucket',
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('bucket', sa.Integer(), nullable=False),
+    sa.Column('stock', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['product_id'], ['product.id'], ),
+    sa.PrimaryKeyConstraint('product_id', 'bucket')
+    )
+    op.create_table('stock_reservation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('bucket', sa.Integer(), nullable=True),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['order_id'], ['order.id'], ),
+    sa.ForeignKeyConstraint(['product_id'], ['product.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('stock_reservation', schema=None) as batch_op:
+        batch_op.create_index('ix_stock_reservation_order_id', ['order_id'], unique=False)
+        batch_op.create_index('ix_stock_reservation_status_expires_at', ['status', 'expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('stock_reservation', schema=None) as batch_op:
+        batch_op.drop_index('ix_stock_reservation_status_expires_at')
+        batch_op.drop_index('ix_stock_reservation_order_id')
+
+    op.drop_table('stock_reservation')
+    op.drop_table('product_stock_bucket')
+
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_column('stock_buckets')
+        batch_op.drop_column('stock')
@@ -0,0 +1,32 @@
+"""add product external id
+
+Revision ID: c91d5f0a2b68
+Revises: a7c4e2b91f03
+Create Date: 2026-10-18 11:48:09.362715
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c91d5f0a2b68'
+down_revision = 'a7c4e2b91f03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('external_source', sa.String(length=50), nullable=True))
+        batch_op.add_column(sa.Column('external_id', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=40), nullable=True))
+        batch_op.create_index('ix_product_external_source_external_id', ['external_source', 'external_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_index('ix_product_external_source_external_id')
+        batch_op.drop_column('content_hash')
+        batch_op.drop_column('external_id')
+        batch_op.drop_column('external_source')
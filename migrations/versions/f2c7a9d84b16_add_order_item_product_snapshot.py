@@ -0,0 +1,56 @@
+"""add order item product snapshot
+
+Revision ID: f2c7a9d84b16
+Revises: e83f1a6b5c40
+Create Date: 2026-10-18 15:21:37.508114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c7a9d84b16'
+down_revision = 'e83f1a6b5c40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('order_item', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('product_title', sa.String(length=200), nullable=True))
+        batch_op.add_column(sa.Column('product_image_url', sa.String(length=500), nullable=True))
+
+    # Los pedidos existentes copian el producto tal y como está ahora
+    op.execute(
+        "UPDATE order_item SET "
+        "product_title = (SELECT title FROM product WHERE product.id = order_item.product_id), "
+        "product_image_url = (SELECT image_url FROM product WHERE product.id = order_item.product_id)"
+    )
+    op.execute("UPDATE order_item SET product_title = '' WHERE product_title IS NULL")
+
+    with op.batch_alter_table('order_item', schema=None) as batch_op:
+        batch_op.alter_column('product_title',
+               existing_type=sa.String(length=200),
+               nullable=False)
+        batch_op.alter_column('product_id',
+               existing_type=sa.Integer(),
+               nullable=True)
+
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.drop_index('ix_order_user_id')
+        batch_op.create_index('ix_order_user_id_id', ['user_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.drop_index('ix_order_user_id_id')
+        batch_op.create_index('ix_order_user_id', ['user_id'], unique=False)
+
+    op.execute("DELETE FROM order_item WHERE product_id IS NULL")
+    with op.batch_alter_table('order_item', schema=None) as batch_op:
+        batch_op.alter_column('product_id',
+               existing_type=sa.Integer(),
+               nullable=False)
+        batch_op.drop_column('product_image_url')
+        batch_op.drop_column('product_title')
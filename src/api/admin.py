@@ -3,10 +3,23 @@ import inspect
 from flask_admin import Admin
 from . import models
 from .models import db
+from .cache import bump_catalog_generation
+from . import search
 from flask_admin.contrib.sqla import ModelView
 from flask_admin.theme import Bootstrap4Theme
 
 
+class ProductModelView(ModelView):
+    # Las ediciones desde el admin también invalidan la caché del catálogo
+    def after_model_change(self, form, model, is_created):
+        bump_catalog_generation()
+        search.index_product(model)
+
+    def after_model_delete(self, model):
+        bump_catalog_generation()
+        search.unindex_product(model.id)
+
+
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     admin = Admin(app, name='4Geeks Admin', theme=Bootstrap4Theme(swatch='cerulean'))
@@ -15,4 +28,5 @@ def setup_admin(app):
     for name, obj in inspect.getmembers(models):
         # Verify that the object is a SQLAlchemy model before adding it to the admin. 
         if inspect.isclass(obj) and issubclass(obj, db.Model):
-            admin.add_view(ModelView(obj, db.session))
\ No newline at end of file
+            view_class = ProductModelView if obj is models.Product else ModelView
+            admin.add_view(view_class(obj, db.session))
\ No newline at end of file
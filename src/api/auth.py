@@ -0,0 +1,148 @@
+"""
+Identidad del usuario en las rutas con JWT sin ir a la tabla user en cada petición.
+
+- Caché de identidades por worker (LRU + TTL): user_id -> User.serialize() y la
+  fecha de alta. flask_jwt_extended la consulta en cada @jwt_required() a través
+  de user_lookup_loader, así que un usuario borrado ya no pasa ni por el carrito.
+- Lista de revocación compacta: dos arrays ordenados (user_id, "tokens emitidos
+  antes de") en vez de un set de jti. delete_me revoca todos los tokens del usuario.
+
+Invalidación entre workers: update_me/delete_me incrementan un contador en la
+caché compartida (cache.py); cada worker lo compara en cada petición y, si
+cambió, vacía su caché de identidades. Con CACHE_BACKEND=memory el contador es
+local y los demás workers se enteran al caducar el TTL (AUTH_CACHE_TTL).
+"""
+import os
+import math
+import time
+import bisect
+import threading
+from array import array
+from flask import jsonify
+from src.api.models import db, User
+from src.api.cache import cache, MemoryCache
+from src.api.utils import as_utc
+
+AUTH_GENERATION = "auth:generation"
+
+identities = MemoryCache(
+    max_entries=int(os.getenv("AUTH_CACHE_MAX_ENTRIES", 10000)),
+    max_bytes=int(os.getenv("AUTH_CACHE_MAX_BYTES", 8 * 1024 * 1024)),
+    ttl=int(os.getenv("AUTH_CACHE_TTL", 60)),
+)
+_seen_generation = None
+
+
+class RevocationList:
+    """Tokens revocados por usuario: válidos solo los emitidos a partir de `since`."""
+
+    def __init__(self, max_age=None):
+        self.max_age = max_age  # segundos; pasado ese tiempo los tokens ya han caducado solos
+        self._user_ids = array("I")
+        self._since = array("d")
+        self._lock = threading.Lock()
+
+    def revoke(self, user_id, since=None):
+        # redondeo hacia arriba: iat tiene resolución de segundos
+        since = math.ceil(since if since is not None else time.time())
+        with self._lock:
+            self._prune(since)
+            i = bisect.bisect_left(self._user_ids, user_id)
+            if i < len(self._user_ids) and self._user_ids[i] == user_id:
+                self._since[i] = max(self._since[i], since)
+            else:
+                self._user_ids.insert(i, user_id)
+                self._since.insert(i, since)
+
+    def is_revoked(self, user_id, issued_at):
+        with self._lock:
+            i = bisect.bisect_left(self._user_ids, user_id)
+            if i < len(self._user_ids) and self._user_ids[i] == user_id:
+                return issued_at < self._since[i]
+            return False
+
+    def _prune(self, now):
+        if self.max_age is None:
+            return
+        keep = [i for i, since in enumerate(self._since) if since > now - self.max_age]
+        if len(keep) < len(self._since):
+            self._user_ids = array("I", (self._user_ids[i] for i in keep))
+            self._since = array("d", (self._since[i] for i in keep))
+
+    def __len__(self):
+        return len(self._user_ids)
+
+    def clear(self):
+        with self._lock:
+            self._user_ids = array("I")
+            self._since = array("d")
+
+
+revocations = RevocationList()
+
+
+def _identity_key(user_id):
+    return f"user:{user_id}"
+
+
+def _sync_generation():
+    global _seen_generation
+    generation = cache.counter(AUTH_GENERATION)
+    if generation != _seen_generation:
+        identities.clear()
+        _seen_generation = generation
+
+
+def load_identity(user_id):
+    """Dict con "user" (User.serialize()) y "created_at" (epoch), o None si no existe."""
+    _sync_generation()
+    key = _identity_key(user_id)
+    identity = identities.get(key)
+    if identity is not None:
+        return identity
+
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    return remember_user(user)
+
+
+def remember_user(user):
+    """Guarda la identidad en la caché (login la precarga: la primera petición ya no consulta user)."""
+    identity = {"user": user.serialize(), "created_at": as_utc(user.created_at).timestamp()}
+    identities.set(_identity_key(user.id), identity)
+    return identity
+
+
+def invalidate_user(user_id, revoke=False):
+    """Tras modificar o borrar un usuario. Con revoke=True invalida también sus tokens emitidos."""
+    if revoke:
+        revocations.revoke(user_id)
+    identities.delete(_identity_key(user_id))
+    cache.incr(AUTH_GENERATION)
+
+
+def setup_auth(jwt, app):
+    expires = app.config.get("JWT_ACCESS_TOKEN_EXPIRES")
+    if expires:
+        revocations.max_age = expires.total_seconds()
+
+    @jwt.token_in_blocklist_loader
+    def token_revoked(jwt_header, jwt_payload):
+        return revocations.is_revoked(int(jwt_payload["sub"]), jwt_payload.get("iat", 0))
+
+    @jwt.user_lookup_loader
+    def lookup_user(jwt_header, jwt_payload):
+        identity = load_identity(int(jwt_payload["sub"]))
+        # un id reutilizado (SQLite) no debe heredar los tokens del usuario borrado
+        if identity is None or jwt_payload.get("iat", 0) < math.floor(identity["created_at"]):
+            return None
+        return identity
+
+    @jwt.revoked_token_loader
+    def revoked_token(jwt_header, jwt_payload):
+        return jsonify({"error": "Token revocado"}), 401
+
+    @jwt.user_lookup_error_loader
+    def user_not_found(jwt_header, jwt_payload):
+        return jsonify({"error": "Usuario no encontrado"}), 401
@@ -0,0 +1,586 @@
+"""
+Benchmarks del backend. Se lanzan con los comandos `flask bench-*` (ver commands.py).
+
+OJO: trabajan sobre una base de datos desechable (por defecto un SQLite en /tmp):
+borran y recrean todas las tablas del modelo.
+"""
+import os
+import json
+import time
+import random
+import statistics
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import create_engine, event, text, select, insert, func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+from src.api.models import db, User, Product, Order, ProductStockBucket, StockReservation
+from src.api import search, passwords, inventory, serialization
+
+DEFAULT_BENCH_URL = "sqlite:////tmp/marketly-bench.db"
+
+# Índices añadidos en las migraciones a7c4e2b91f03 y f2c7a9d84b16 (los que se comparan antes/después)
+LOOKUP_INDEXES = (
+    "ix_cart_item_user_id_product_id",
+    "ix_cart_item_product_id",
+    "ix_order_user_id_id",
+    "ix_order_item_order_id",
+    "ix_order_item_product_id",
+    "ix_product_created_at_id",
+    "ix_product_updated_at",
+)
+
+BASE_DATE = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def make_engine(url=None):
+    url = (url or DEFAULT_BENCH_URL).replace("postgres://", "postgresql://")
+    return create_engine(url)
+
+
+def reset_schema(engine):
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            conn.execute(text("DROP TABLE IF EXISTS product_fts"))
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+
+
+def _insert_chunks(conn, table, rows, chunk_size=10000):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            conn.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        conn.execute(table.insert(), chunk)
+
+
+def seed(engine, cart_rows, products=None, users=None, orders=None):
+    """
+    Rellena las tablas con datos sintéticos. Tamaños por defecto proporcionales a cart_rows:
+    users = cart_rows/100, products = cart_rows/10, orders = cart_rows/10, order_items = cart_rows.
+    """
+    users = users or max(1, cart_rows // 100)
+    products = products or max(1, cart_rows // 10)
+    orders = orders or max(1, cart_rows // 10)
+    per_user = max(1, min(products, cart_rows // users))
+    t = db.metadata.tables
+
+    with engine.begin() as conn:
+        _insert_chunks(conn, t["user"], ({
+            "id": u, "email": f"user{u}@bench.test", "password": "x", "is_active": True,
+            "created_at": BASE_DATE,
+        } for u in range(1, users + 1)))
+
+        _insert_chunks(conn, t["product"], ({
+            "id": p, "title": f"Producto {p}", "description": "Descripción de prueba " * 10,
+            "price_cents": 100 + (p * 37) % 10000, "image_url": "",
+            "created_at": BASE_DATE + timedelta(seconds=p), "updated_at": BASE_DATE + timedelta(seconds=p),
+        } for p in range(1, products + 1)))
+
+        # productos distintos por usuario para respetar el índice único (user_id, product_id)
+        _insert_chunks(conn, t["cart_item"], ({
+            "user_id": u, "product_id": (u * 7919 + k) % products + 1, "quantity": 1,
+            "created_at": BASE_DATE,
+        } for u in range(1, users + 1) for k in range(per_user)))
+
+        _insert_chunks(conn, t["order"], ({
+            "id": o, "user_id": o % users + 1, "total_cents": 1000, "status": "paid",
+            "created_at": BASE_DATE,
+        } for o in range(1, orders + 1)))
+
+        _insert_chunks(conn, t["order_item"], ({
+            "order_id": i % orders + 1, "product_id": (i * 31) % products + 1,
+            "quantity": 1, "unit_price_cents": 100,
+        } for i in range(cart_rows)))
+
+    return {"users": users, "products": products, "cart_items": users * per_user,
+            "orders": orders, "order_items": cart_rows}
+
+
+def analyze(engine):
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+
+def _set_lookup_indexes(engine, present):
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            if index.name in LOOKUP_INDEXES:
+                if present:
+                    index.create(engine, checkfirst=True)
+                else:
+                    index.drop(engine, checkfirst=True)
+
+
+def explain(conn, sql, params):
+    if conn.dialect.name == "sqlite":
+        rows = conn.execute(text("EXPLAIN QUERY PLAN " + sql), params).fetchall()
+        return [r[-1] for r in rows]
+    rows = conn.execute(text("EXPLAIN " + sql), params).fetchall()
+    return [r[0] for r in rows]
+
+
+def time_query(conn, sql, make_params, runs):
+    timings = []
+    for _ in range(runs):
+        params = make_params()
+        start = time.perf_counter()
+        conn.execute(text(sql), params).fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "p50_ms": round(statistics.median(timings), 3),
+        "max_ms": round(timings[-1], 3),
+    }
+
+
+def lookup_queries(sizes, rng):
+    users, products, orders = sizes["users"], sizes["products"], sizes["orders"]
+    return {
+        "cart_by_user": (
+            "SELECT id, product_id, quantity FROM cart_item WHERE user_id = :user_id",
+            lambda: {"user_id": rng.randint(1, users)},
+        ),
+        "cart_line": (
+            "SELECT id, quantity FROM cart_item WHERE user_id = :user_id AND product_id = :product_id",
+            lambda: {"user_id": rng.randint(1, users), "product_id": rng.randint(1, products)},
+        ),
+        "orders_by_user": (
+            'SELECT id, total_cents FROM "order" WHERE user_id = :user_id',
+            lambda: {"user_id": rng.randint(1, users)},
+        ),
+        "order_items_by_order": (
+            "SELECT id, product_id, quantity FROM order_item WHERE order_id = :order_id",
+            lambda: {"order_id": rng.randint(1, orders)},
+        ),
+        "order_items_by_product": (
+            "SELECT id FROM order_item WHERE product_id = :product_id",
+            lambda: {"product_id": rng.randint(1, products)},
+        ),
+        "products_keyset_page": (
+            "SELECT id, title, price_cents FROM product "
+            "WHERE created_at > :created_at OR (created_at = :created_at AND id > :id) "
+            "ORDER BY created_at, id LIMIT 20",
+            lambda: _keyset_params(rng.randint(1, products)),
+        ),
+        "user_by_email": (
+            'SELECT id FROM "user" WHERE email = :email',
+            lambda: {"email": f"user{rng.randint(1, users)}@bench.test"},
+        ),
+    }
+
+
+def _keyset_params(product_id):
+    return {"created_at": BASE_DATE + timedelta(seconds=product_id), "id": product_id}
+
+
+def run_queries(engine, queries, runs):
+    results = {}
+    with engine.connect() as conn:
+        for name, (sql, make_params) in queries.items():
+            results[name] = {
+                "plan": explain(conn, sql, make_params()),
+                **time_query(conn, sql, make_params, runs),
+            }
+    return results
+
+
+def bench_indexes(url=None, rows=1_000_000, runs=50, echo=print):
+    """Planes de consulta y latencias de las búsquedas por FK con y sin los índices nuevos."""
+    engine = make_engine(url)
+    rng = random.Random(42)
+
+    echo(f"Creando esquema en {engine.url.render_as_string(hide_password=True)} ...")
+    reset_schema(engine)
+    _set_lookup_indexes(engine, present=False)
+
+    echo(f"Sembrando {rows} filas de cart_item/order_item ...")
+    start = time.perf_counter()
+    sizes = seed(engine, rows)
+    echo(f"  {sizes} en {time.perf_counter() - start:.1f}s")
+    analyze(engine)
+
+    queries = lookup_queries(sizes, rng)
+    before = run_queries(engine, queries, runs)
+
+    echo("Creando índices ...")
+    _set_lookup_indexes(engine, present=True)
+    analyze(engine)
+    after = run_queries(engine, queries, runs)
+
+    return {
+        "benchmark": "indexes",
+        "dialect": engine.dialect.name,
+        "sizes": sizes,
+        "runs": runs,
+        "before": before,
+        "after": after,
+    }
+
+
+def format_before_after(result):
+    lines = [f"{'query':<24} {'before p50 ms':>14} {'after p50 ms':>14}"]
+    for name, before in result["before"].items():
+        after = result["after"][name]
+        lines.append(f"{name:<24} {before['p50_ms']:>14} {after['p50_ms']:>14}")
+        lines.append(f"    before: {' | '.join(before['plan'])}")
+        lines.append(f"    after:  {' | '.join(after['plan'])}")
+    return "\n".join(lines)
+
+
+def save_result(result, path):
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2, default=str)
+
+
+# ---------------------------
+# Búsqueda
+# ---------------------------
+SEARCH_VOCABULARY = (
+    "camiseta", "pantalón", "zapatillas", "chaqueta", "vestido", "reloj", "gafas", "bolso",
+    "mochila", "cartera", "perfume", "crema", "champú", "lámpara", "mesa", "silla", "sofá",
+    "cojín", "taza", "sartén", "cuchillo", "portátil", "teléfono", "auriculares", "altavoz",
+    "cargador", "cable", "teclado", "ratón", "monitor", "shirt", "shoes", "watch", "phone",
+    "laptop", "lamp", "table", "chair", "kitchen", "leather", "cotton", "wireless", "smart",
+    "roja", "azul", "negro", "blanco", "verde", "grande", "pequeño", "premium", "clásico",
+)
+
+SEARCH_QUERIES = ("cami", "zapat", "reloj", "portátil negro", "wireless", "lamp", "sof", "premium azul",
+                  "leather shoes", "crema", "altavoz smart", "ch")
+
+
+def seed_search_products(engine, products, rng):
+    def words(n):
+        return " ".join(rng.choice(SEARCH_VOCABULARY) for _ in range(n))
+
+    with engine.begin() as conn:
+        _insert_chunks(conn, db.metadata.tables["product"], ({
+            "id": p, "title": words(3).capitalize(), "description": words(25),
+            "price_cents": 100 + (p * 37) % 10000, "image_url": "",
+            "created_at": BASE_DATE + timedelta(seconds=p), "updated_at": BASE_DATE + timedelta(seconds=p),
+        } for p in range(1, products + 1)))
+
+
+def bench_search(url=None, sizes=(100_000, 1_000_000), runs=200, limit=20, engines=("db",), echo=print):
+    """
+    Latencia p50/p99 de search.search_products() por motor: "db" (índice nativo de la BD)
+    y/o "memory" (índice invertido; incluye tiempo de construcción y memoria ocupada).
+    """
+    engine = make_engine(url)
+    results = []
+    for size in sizes:
+        rng = random.Random(42)
+        echo(f"Sembrando {size} productos ...")
+        reset_schema(engine)
+        start = time.perf_counter()
+        seed_search_products(engine, size, rng)
+        with engine.begin() as conn:
+            search.ensure_search_index(conn)
+        echo(f"  sembrado + índice en {time.perf_counter() - start:.1f}s")
+        analyze(engine)
+
+        for name in engines:
+            extra = {}
+            with Session(engine) as session:
+                if name == "memory":
+                    search.reset_memory_search()
+                    memory = search.memory_search(session)
+                    stats = memory.stats()
+                    extra = {"build_s": stats["build_seconds"], "memory_bytes": stats["memory_bytes"],
+                             "terms": stats["terms"]}
+
+                timings = []
+                for n in range(runs):
+                    q = SEARCH_QUERIES[n % len(SEARCH_QUERIES)]
+                    t0 = time.perf_counter()
+                    search.search_products(q, limit, session=session, engine=name)
+                    timings.append((time.perf_counter() - t0) * 1000)
+            results.append({"products": size, "engine": name, **percentiles(timings), **extra})
+            echo(f"  {results[-1]}")
+        search.reset_memory_search()
+
+    return {"benchmark": "search", "dialect": engine.dialect.name, "runs": runs, "limit": limit,
+            "results": results}
+
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return {
+        "p50_ms": round(timings[len(timings) // 2], 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "p99_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))], 3),
+    }
+
+
+# ---------------------------
+# Login
+# ---------------------------
+def login_configs(base=None):
+    """Configuraciones a comparar: la actual en línea y con pool, y pbkdf2 con pool."""
+    base = base or passwords.config
+    workers = base.workers or min(4, os.cpu_count() or 1)
+    return {
+        f"{base.method} inline": _clone_config(base, workers=0),
+        f"{base.method} pool x{workers}": _clone_config(base, workers=workers),
+        f"pbkdf2 pool x{workers}": _clone_config(base, method="pbkdf2", workers=workers),
+    }
+
+
+def _clone_config(base, **changes):
+    params = {
+        "method": base.method, "scrypt_n": base.scrypt_n, "scrypt_r": base.scrypt_r,
+        "scrypt_p": base.scrypt_p, "pbkdf2_iterations": base.pbkdf2_iterations,
+        "workers": base.workers, "timeout": base.timeout,
+    }
+    params.update(changes)
+    return passwords.HashConfig(**params)
+
+
+def bench_login(app, requests=100, concurrency=8, configs=None, echo=print):
+    """
+    Logins/s contra POST /api/login (cliente de pruebas de Flask en `concurrency` hilos)
+    con cada configuración de hash. Usa la BD de la app: crea un usuario temporal y lo borra.
+    """
+    from src.api.models import User
+
+    configs = configs or login_configs()
+    original = passwords.config
+    email = f"bench-login-{uuid.uuid4().hex[:8]}@bench.test"
+    password = "bench-password"
+    results = []
+    try:
+        for label, config in configs.items():
+            passwords.configure(config)
+            with app.app_context():
+                user = User.query.filter_by(email=email).first() or User(email=email, is_active=True)
+                user.password = passwords.hash_password(password)
+                db.session.add(user)
+                db.session.commit()
+
+            def login(_):
+                client = app.test_client()
+                t0 = time.perf_counter()
+                r = client.post("/api/login", json={"email": email, "password": password})
+                return r.status_code, (time.perf_counter() - t0) * 1000
+
+            login(0)  # arranca el pool antes de medir
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                outcomes = list(executor.map(login, range(requests)))
+            elapsed = time.perf_counter() - start
+
+            ok = [ms for status, ms in outcomes if status == 200]
+            results.append({
+                "config": label,
+                "method": config.method_string,
+                "workers": config.workers,
+                "ok": len(ok),
+                "busy": sum(1 for status, _ in outcomes if status == 503),
+                "logins_per_sec": round(len(ok) / elapsed, 1),
+                **(percentiles(ok) if ok else {}),
+            })
+            echo(f"  {results[-1]}")
+    finally:
+        passwords.configure(original)
+        with app.app_context():
+            User.query.filter_by(email=email).delete()
+            db.session.commit()
+
+    return {"benchmark": "login", "requests": requests, "concurrency": concurrency,
+            "cpus": os.cpu_count(), "results": results}
+
+
+# ---------------------------
+# Stock
+# ---------------------------
+def _concurrent_engine(url=None):
+    """Engine para muchos hilos escribiendo a la vez. En SQLite: espera al lock y BEGIN IMMEDIATE."""
+    url = (url or DEFAULT_BENCH_URL).replace("postgres://", "postgresql://")
+    if not url.startswith("sqlite"):
+        return create_engine(url, pool_size=32, max_overflow=0)
+
+    engine = create_engine(url, connect_args={"timeout": 30, "check_same_thread": False})
+
+    # transacciones explícitas (pysqlite abre las suyas tarde) para que los SAVEPOINT funcionen
+    # y el lock de escritura se coja al empezar, no al pasar de lectura a escritura
+    @event.listens_for(engine, "connect")
+    def _autocommit_driver(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def _begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    return engine
+
+
+def _check_stock(session, product_id, initial):
+    """Invariantes tras la carga: nada negativo y disponible + reservado == inicial."""
+    available, _ = inventory.available(product_id, session=session)
+    reserved = session.scalar(
+        select(func.coalesce(func.sum(StockReservation.quantity), 0))
+        .where(StockReservation.product_id == product_id, StockReservation.status == "active")
+    )
+    negative_buckets = session.scalar(
+        select(func.count()).select_from(ProductStockBucket)
+        .where(ProductStockBucket.product_id == product_id, ProductStockBucket.stock < 0)
+    )
+    return {
+        "available": available,
+        "reserved": reserved,
+        "oversold": max(0, reserved - initial),
+        "consistent": available >= 0 and not negative_buckets and available + reserved == initial,
+    }
+
+
+def bench_stock(url=None, stock=100, threads=16, attempts=50, quantity=1, buckets=(0, 8), echo=print):
+    """
+    Muchos hilos reservando a la vez el mismo producto (un pedido por intento),
+    con el stock en una sola fila y repartido en buckets. Comprueba que no se vende
+    de más, que el stock cuadra y que al liberar todo vuelve al valor inicial.
+    """
+    engine = _concurrent_engine(url)
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    results = []
+
+    for n_buckets in buckets:
+        reset_schema(engine)
+        with Session(engine) as session:
+            user = User(email="bench-stock@bench.test", password="x", is_active=True)
+            product = Product(title="Flash sale", description="", price_cents=999, image_url="")
+            session.add_all([user, product])
+            session.flush()
+            inventory.set_stock(product.id, stock, buckets=n_buckets, session=session)
+            session.execute(insert(Order), [
+                {"user_id": user.id, "total_cents": 999 * quantity, "status": "pending"}
+                for _ in range(threads * attempts)
+            ])
+            session.commit()
+            product_id = product.id
+            order_ids = session.scalars(select(Order.id).order_by(Order.id)).all()
+
+        def hammer(worker):
+            rng = random.Random(worker)
+            counts = {"ok": 0, "out_of_stock": 0, "errors": 0}
+            timings = []
+            with Session(engine) as session:
+                for order_id in order_ids[worker * attempts:(worker + 1) * attempts]:
+                    t0 = time.perf_counter()
+                    try:
+                        inventory.reserve(order_id, [(product_id, quantity)], expires_at, session=session, rng=rng)
+                        session.commit()
+                        counts["ok"] += 1
+                    except inventory.OutOfStock:
+                        session.rollback()
+                        counts["out_of_stock"] += 1
+                    except OperationalError:
+                        # lock timeout / deadlock: se cuenta, no se reintenta
+                        session.rollback()
+                        counts["errors"] += 1
+                    timings.append((time.perf_counter() - t0) * 1000)
+            return counts, timings
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            outcomes = list(executor.map(hammer, range(threads)))
+        elapsed = time.perf_counter() - start
+
+        totals = {key: sum(counts[key] for counts, _ in outcomes) for key in ("ok", "out_of_stock", "errors")}
+        timings = [ms for _, worker_timings in outcomes for ms in worker_timings]
+        with Session(engine) as session:
+            after_load = _check_stock(session, product_id, stock)
+            inventory.release(order_ids, session=session)
+            session.commit()
+            after_release = _check_stock(session, product_id, stock)
+
+        results.append({
+            "buckets": n_buckets,
+            **totals,
+            "reserved_units": after_load["reserved"],
+            "oversold": after_load["oversold"],
+            "consistent": after_load["consistent"] and totals["ok"] * quantity == after_load["reserved"],
+            "restored": after_release["available"] == stock and after_release["consistent"],
+            "reservations_per_sec": round(len(timings) / elapsed, 1),
+            **percentiles(timings),
+        })
+        echo(f"  {results[-1]}")
+
+    engine.dispose()
+    return {"benchmark": "stock", "dialect": engine.dialect.name, "stock": stock, "threads": threads,
+            "attempts": attempts, "quantity": quantity, "results": results}
+
+
+# ---------------------------
+# Serialización
+# ---------------------------
+def _serialize_orm(session):
+    """El camino de antes: entidades ORM + Product.serialize() + json (como jsonify)."""
+    products = session.scalars(select(Product).order_by(Product.created_at, Product.id)).all()
+    yield json.dumps([p.serialize() for p in products], sort_keys=True, separators=(",", ":")).encode()
+
+
+def _serialize_core(encode):
+    columns = [getattr(Product, name) for name in Product.SERIALIZABLE_FIELDS]
+
+    def run(session):
+        rows = session.execute(
+            select(*columns).order_by(Product.created_at, Product.id)
+            .execution_options(yield_per=serialization.STREAM_CHUNK_ROWS)
+        )
+        yield from serialization.stream_array(rows, serialization.column_keys(columns), encode)
+    return run
+
+
+def bench_serialization(url=None, rows=10_000, runs=20, echo=print):
+    """
+    Listado completo de productos a bytes JSON: ORM + serialize() + json frente a
+    tuplas de Core en streaming con json y (si está instalado) orjson. Mide consulta
+    + serialización; first_chunk_ms es lo que tarda en salir el primer bloque de filas.
+    """
+    engine = make_engine(url)
+    reset_schema(engine)
+    echo(f"Sembrando {rows} productos ...")
+    seed_search_products(engine, rows, random.Random(42))
+    analyze(engine)
+
+    variants = {"orm + serialize + json": _serialize_orm}
+    for name in ("json", "orjson"):
+        try:
+            variants[f"core + stream + {name}"] = _serialize_core(serialization.choose_encoder(name)[1])
+        except ValueError:
+            echo(f"  {name} no disponible, se omite")
+
+    results, reference = [], None
+    for name, variant in variants.items():
+        timings, first_chunk = [], []
+        for _ in range(runs):
+            with Session(engine) as session:
+                t0 = time.perf_counter()
+                chunks = []
+                for chunk in variant(session):
+                    # el "[" suelto del streaming no cuenta: se mide el primer bloque con filas
+                    if len(chunk) > 1 and not any(len(c) > 1 for c in chunks):
+                        first_chunk.append((time.perf_counter() - t0) * 1000)
+                    chunks.append(chunk)
+                body = b"".join(chunks)
+                timings.append((time.perf_counter() - t0) * 1000)
+        parsed = json.loads(body)
+        reference = parsed if reference is None else reference
+        stats = percentiles(timings)
+        results.append({
+            "variant": name,
+            **stats,
+            "rows_per_sec": round(rows / (stats["p50_ms"] / 1000)),
+            "first_chunk_ms": round(statistics.median(first_chunk), 3),
+            "bytes": len(body),
+            "same_output": parsed == reference,
+        })
+        echo(f"  {results[-1]}")
+
+    engine.dispose()
+    return {"benchmark": "serialization", "dialect": engine.dialect.name, "rows": rows, "runs": runs,
+            "default_encoder": serialization.ENCODER, "results": results}
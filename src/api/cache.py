@@ -0,0 +1,322 @@
+"""
+Caché del catálogo y del carrito con backend intercambiable.
+
+- MemoryCache: LRU + TTL en memoria del proceso (un solo worker / tests).
+- SQLiteCache: fichero SQLite compartido por todos los workers de gunicorn de la máquina.
+
+La invalidación es por versión: cada clave lleva el número de generación del
+catálogo (y del carrito del usuario). Una escritura solo incrementa el contador,
+así que ningún worker vuelve a leer las entradas viejas aunque no reciba ningún
+aviso; éstas caducan solas por TTL/LRU.
+
+La generación del catálogo no está en el backend sino en la BD (tabla
+cache_generation): la cambia también el worker de tareas (importaciones), que
+puede correr en otra máquina con su propio /tmp. Cuesta una lectura por clave
+primaria en cada petición que la usa. Las del carrito solo las cambia la web y
+siguen en el backend.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from sqlalchemy import select, update, insert
+from sqlalchemy.exc import IntegrityError
+from src.api.models import db, CacheGeneration
+
+
+class CacheBackend:
+    """Interfaz común de los backends de caché."""
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """Guarda `value` (serializable a JSON); ttl en segundos, por defecto el del backend."""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def incr(self, key):
+        """Incrementa un contador persistente (sin TTL) y devuelve el nuevo valor."""
+        raise NotImplementedError
+
+    def counter(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    def __init__(self, max_entries=1024, max_bytes=8 * 1024 * 1024, ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, size, value)
+        self._counters = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, value = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + (ttl or self.ttl), size, value)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._counters.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "memory",
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Caché en un fichero SQLite (modo WAL) compartido entre procesos de la misma máquina.
+    Cada hilo abre su propia conexión. Los contadores de aciertos son por proceso.
+    """
+
+    def __init__(self, path, max_entries=20000, ttl=300):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entry ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entry_expires_at ON cache_entry (expires_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_counter (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value FROM cache_entry WHERE key = ? AND expires_at >= ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_entry (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, default=str), time.time() + (ttl or self.ttl)),
+        )
+        self._writes += 1
+        # limpieza periódica: caducadas y, si sobra, las que antes caducan
+        if self._writes % 200 == 0:
+            conn.execute("DELETE FROM cache_entry WHERE expires_at < ?", (time.time(),))
+            conn.execute(
+                "DELETE FROM cache_entry WHERE key IN ("
+                "SELECT key FROM cache_entry ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM cache_entry WHERE key = ?", (key,))
+
+    def incr(self, key):
+        row = self._conn().execute(
+            "INSERT INTO cache_counter (key, value) VALUES (?, 1) "
+            "ON CONFLICT(key) DO UPDATE SET value = value + 1 RETURNING value",
+            (key,),
+        ).fetchone()
+        return row[0]
+
+    def counter(self, key):
+        row = self._conn().execute("SELECT value FROM cache_counter WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM cache_entry")
+        conn.execute("DELETE FROM cache_counter")
+
+    def stats(self):
+        entries = self._conn().execute("SELECT COUNT(*) FROM cache_entry").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+def make_cache_backend():
+    backend = os.getenv("CACHE_BACKEND", "sqlite").lower()
+    ttl = int(os.getenv("CATALOG_CACHE_TTL", 300))
+    if backend == "memory":
+        return MemoryCache(
+            max_entries=int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", 1024)),
+            max_bytes=int(os.getenv("CATALOG_CACHE_MAX_BYTES", 8 * 1024 * 1024)),
+            ttl=ttl,
+        )
+    if backend == "sqlite":
+        return SQLiteCache(
+            os.getenv("CACHE_SQLITE_PATH", "/tmp/marketly-cache.db"),
+            max_entries=int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", 20000)),
+            ttl=ttl,
+        )
+    raise ValueError(f"CACHE_BACKEND desconocido: {backend}")
+
+
+cache = make_cache_backend()
+
+CATALOG_GENERATION = "catalog"
+
+
+# ---------------------------
+# Catálogo
+# ---------------------------
+def catalog_generation(session=None):
+    session = session or db.session
+    return session.scalar(
+        select(CacheGeneration.value).where(CacheGeneration.name == CATALOG_GENERATION)
+    ) or 0
+
+
+def _incr_generation(conn, name):
+    bump = update(CacheGeneration).where(CacheGeneration.name == name).values(value=CacheGeneration.value + 1)
+    if not conn.execute(bump).rowcount:
+        try:
+            with conn.begin_nested():
+                conn.execute(insert(CacheGeneration).values(name=name, value=1))
+        except IntegrityError:
+            # otro proceso creó la fila a la vez
+            conn.execute(bump)
+    return conn.scalar(select(CacheGeneration.value).where(CacheGeneration.name == name))
+
+
+def bump_catalog_generation():
+    """
+    Llamar tras cualquier escritura de productos (después del commit): invalida
+    todo el catálogo en todos los workers y servicios. Va en su propia conexión
+    y transacción, así que no depende del estado de la sesión.
+    """
+    with db.engine.begin() as conn:
+        return _incr_generation(conn, CATALOG_GENERATION)
+
+
+def catalog_key(name, generation=None):
+    if generation is None:
+        generation = catalog_generation()
+    return f"catalog:{generation}:{name}"
+
+
+def product_key(product_id, generation=None):
+    if generation is None:
+        generation = catalog_generation()
+    return f"catalog:{generation}:product:{product_id}"
+
+
+def product_list_key(args, generation=None):
+    if generation is None:
+        generation = catalog_generation()
+    # mismos parámetros en distinto orden -> misma entrada
+    query = "&".join(f"{k}={v}" for k, v in sorted(args.items(multi=True)))
+    return f"catalog:{generation}:products:{query}"
+
+
+# ---------------------------
+# Carrito
+# ---------------------------
+def _cart_generation_key(user_id):
+    return f"cart:{user_id}:generation"
+
+
+def bump_cart_generation(user_id):
+    """Llamar tras cualquier cambio en el carrito del usuario."""
+    return cache.incr(_cart_generation_key(user_id))
+
+
+def cart_key(user_id):
+    # el carrito incluye datos de producto, así que también depende del catálogo
+    return f"cart:{user_id}:{cache.counter(_cart_generation_key(user_id))}:{catalog_generation()}"
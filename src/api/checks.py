@@ -0,0 +1,228 @@
+"""
+Comprobaciones de regresión que se ejecutan contra la app real en una BD desechable.
+
+    flask stripe-check
+    flask check-queries
+
+Como en loadtest.py, un proceso hijo importa la app con DATABASE_URL apuntando
+a una BD recién creada (por defecto un SQLite en /tmp; se borran sus tablas) y
+le habla con el cliente de pruebas de Flask. El padre solo compara: cada
+comprobación devuelve filas {"name", "ok", "expected", "got"} y el comando
+termina con error si alguna no cuadra.
+
+stripe-check reproduce los eventos grabados de fixtures/stripe por el webhook
+(firmados, con su tarea procesada por jobs.work) sobre un pedido con stock
+reservado, y comprueba el estado final del pedido y del stock. Los escenarios
+incluyen reenvíos (mismo id de evento) y eventos desordenados; todos los
+fixtures deben aparecer en alguno.
+
+check-queries siembra usuarios con carritos y pedidos de varias líneas (los
+datos de loadtest.py) y cuenta con utils.assert_max_queries las sentencias SQL
+de cada listado frente a su presupuesto (QUERY_BUDGETS). El usuario ya ha hecho
+login y la caché de respuestas está vacía: se mide el camino frío. Un N+1 hace
+que el recuento crezca con las filas y se pase del presupuesto.
+"""
+import sys
+import json
+import subprocess
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, func
+from src.api.models import db, User, Product, Order, StockReservation
+from src.api import benchmarks, loadtest, stripe_events, inventory, jobs
+from src.api.cache import cache
+from src.api.utils import assert_max_queries
+
+DEFAULT_CHECK_URL = "sqlite:////tmp/marketly-check.db"
+CHECK_SECRET = "whsec_check"
+
+CHECK_STOCK = 10
+CHECK_QUANTITY = 3
+PAID = CHECK_STOCK - CHECK_QUANTITY
+
+# escenario -> (eventos en orden como (fixture, nº de evento), estado final, stock disponible al final).
+# Repetir el nº de evento es un reenvío de Stripe: mismo id, el webhook lo descarta.
+STRIPE_SCENARIOS = {
+    "pagado": ([("checkout_session_completed", 1)], "paid", PAID),
+    "pagado reenviado": ([("checkout_session_completed", 1), ("checkout_session_completed", 1)], "paid", PAID),
+    "pago asíncrono": ([("checkout_session_completed_async", 1),
+                        ("checkout_session_async_payment_succeeded", 2)], "paid", PAID),
+    "pago asíncrono fallido": ([("checkout_session_completed_async", 1),
+                                ("checkout_session_async_payment_failed", 2)], "failed", CHECK_STOCK),
+    "éxito antes que completed": ([("checkout_session_async_payment_succeeded", 1),
+                                   ("checkout_session_completed_async", 2)], "paid", PAID),
+    "caducado": ([("checkout_session_expired", 1)], "expired", CHECK_STOCK),
+    "caducado reenviado": ([("checkout_session_expired", 1), ("checkout_session_expired", 1)], "expired",
+                           CHECK_STOCK),
+    "caducado tras pagar": ([("checkout_session_completed", 1), ("checkout_session_expired", 2)], "paid", PAID),
+    "fallido tras pagar": ([("checkout_session_completed", 1),
+                            ("checkout_session_async_payment_failed", 2)], "paid", PAID),
+    "pagado tras caducar": ([("checkout_session_expired", 1), ("checkout_session_completed", 2)], "expired",
+                            CHECK_STOCK),
+    "reembolsado": ([("checkout_session_completed", 1), ("charge_refunded", 2)], "refunded", PAID),
+    "reembolso antes del pago": ([("charge_refunded", 1), ("checkout_session_completed", 2)], "paid", PAID),
+}
+
+# datos de check-queries: cada usuario con QUERY_SIZES["cart_items"] / users líneas de carrito
+# y pedidos de 3 líneas (loadtest.seed_app_data)
+QUERY_SIZES = {"users": 2, "products": 200, "cart_items": 40, "orders": 40}
+
+# endpoint -> (ruta, con login, máximo de sentencias SQL)
+QUERY_BUDGETS = {
+    "GET /api/products": ("/api/products?limit=20", False, 3),
+    "GET /api/products/<int:product_id>": ("/api/products/1", False, 2),
+    "GET /api/products/search": ("/api/products/search?q=cami&limit=20", False, 3),
+    "GET /api/cart-items": ("/api/cart-items", True, 3),
+    "GET /api/cart/summary": ("/api/cart/summary", True, 2),
+    "GET /api/orders": ("/api/orders?limit=20", True, 1),
+    "GET /api/orders/<int:order_id>": ("/api/orders/2", True, 2),
+}
+
+
+# ---------------------------
+# Proceso padre
+# ---------------------------
+def _run_child(url, check, seed=None):
+    """
+    Ejecuta `check` en un proceso hijo con la app apuntando a `url`. Devuelve sus filas.
+    La BD se deja vacía o, con `seed`, la llena seed(engine).
+    """
+    engine = benchmarks.make_engine(url)
+    if seed is None:
+        benchmarks.reset_schema(engine)
+    else:
+        seed(engine)
+    engine.dispose()
+    env = loadtest.target_env(url, "http://127.0.0.1:9", {
+        "CACHE_SQLITE_PATH": "/tmp/marketly-check-cache.db",
+        "STRIPE_WEBHOOK_SECRET": CHECK_SECRET,
+    })
+    loadtest._reset_cache_file(env)
+    out = subprocess.run([sys.executable, "-m", "src.api.checks", check], capture_output=True, text=True,
+                         env=env, cwd=loadtest.ROOT)
+    if out.returncode != 0:
+        raise RuntimeError(f"la comprobación {check} falló:\n{out.stderr[-4000:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def format_row(row):
+    if row["ok"]:
+        return f"  ok    {row['name']}: {row['got']}"
+    return f"  FALLA {row['name']}: esperado {row['expected']}, obtenido {row['got']}"
+
+
+def stripe_fixtures(url=None, echo=print):
+    url = (url or DEFAULT_CHECK_URL).replace("postgres://", "postgresql://")
+    rows = _run_child(url, "stripe")
+    for row in rows:
+        echo(format_row(row))
+    return rows
+
+
+def query_budgets(url=None, echo=print):
+    url = (url or DEFAULT_CHECK_URL).replace("postgres://", "postgresql://")
+    rows = _run_child(url, "queries", seed=lambda engine: loadtest.seed_app_data(engine, **QUERY_SIZES))
+    for row in rows:
+        echo(format_row(row))
+    return rows
+
+
+# ---------------------------
+# Proceso hijo
+# ---------------------------
+def _post_event(client, event):
+    payload = json.dumps(event).encode()
+    response = client.post("/api/stripe/webhook", data=payload, headers={
+        "Content-Type": "application/json",
+        "Stripe-Signature": stripe_events.sign(payload, CHECK_SECRET),
+    })
+    if response.status_code != 200:
+        raise RuntimeError(f"el webhook respondió {response.status_code}: {response.get_json()}")
+    return response.get_json()["duplicate"]
+
+
+def _stripe_scenario(client, user_id, index, events):
+    """Pedido pendiente con CHECK_QUANTITY unidades reservadas; le llegan `events`. Devuelve lo observado."""
+    product = Product(title=f"Stripe check {index}", description="", price_cents=1000, image_url="")
+    db.session.add(product)
+    db.session.flush()
+    inventory.set_stock(product.id, CHECK_STOCK)
+    order = Order(user_id=user_id, total_cents=1000 * CHECK_QUANTITY, status="pending",
+                  stripe_session_id=f"cs_check_{index}")
+    db.session.add(order)
+    db.session.flush()
+    inventory.reserve(order.id, [(product.id, CHECK_QUANTITY)], datetime.now(timezone.utc) + timedelta(hours=1))
+    db.session.commit()
+    order_id, product_id = order.id, product.id
+
+    duplicates = 0
+    for fixture, number in events:
+        event = stripe_events.load_fixture(fixture, order_id=order_id, session_id=f"cs_check_{index}",
+                                           payment_intent=f"pi_check_{index}",
+                                           event_id=f"evt_check_{index}_{number}")
+        duplicates += _post_event(client, event)
+        jobs.work(once=True, echo=lambda message: None)
+
+    db.session.expire_all()
+    return {
+        "status": db.session.get(Order, order_id).status,
+        "available": inventory.available(product_id)[0],
+        "active_reservations": db.session.scalar(
+            select(func.count()).select_from(StockReservation)
+            .where(StockReservation.order_id == order_id, StockReservation.status == "active")
+        ),
+        "duplicates": duplicates,
+    }
+
+
+def _check_stripe(app):
+    client = app.test_client()
+    rows = []
+    with app.app_context():
+        user = User(email="stripe-check@check.test", password="x", is_active=True)
+        db.session.add(user)
+        db.session.commit()
+
+        replayed = set()
+        for index, (name, (events, status, available)) in enumerate(STRIPE_SCENARIOS.items(), 1):
+            replayed.update(fixture for fixture, _ in events)
+            expected = {"status": status, "available": available, "active_reservations": 0,
+                        "duplicates": len(events) - len({number for _, number in events})}
+            got = _stripe_scenario(client, user.id, index, events)
+            rows.append({"name": name, "ok": got == expected, "expected": expected, "got": got})
+
+    missing = sorted(set(stripe_events.fixture_names()) - replayed)
+    rows.append({"name": "todos los fixtures tienen escenario", "ok": not missing, "expected": [], "got": missing})
+    return rows
+
+
+def _check_queries(app):
+    client = app.test_client()
+    rows = []
+    with app.app_context():
+        response = client.post("/api/login", json={"email": "load1@bench.test",
+                                                   "password": loadtest.LOADTEST_PASSWORD})
+        headers = {"Authorization": f"Bearer {response.get_json()['access_token']}"}
+        for name, (path, auth, budget) in QUERY_BUDGETS.items():
+            cache.clear()
+            try:
+                with assert_max_queries(budget) as statements:
+                    response = client.get(path, headers=headers if auth else None)
+                ok = response.status_code == 200
+            except AssertionError:
+                ok = False
+            rows.append({"name": name, "ok": ok, "expected": f"200, <= {budget} sentencias",
+                         "got": f"{response.status_code}, {len(statements)} sentencias"})
+    return rows
+
+
+CHECKS = {"stripe": _check_stripe, "queries": _check_queries}
+
+
+def _child():
+    from src.app import app
+
+    print(json.dumps(CHECKS[sys.argv[1]](app)))
+
+
+if __name__ == "__main__":
+    _child()
@@ -1,6 +1,11 @@
+import os
+import json
+import time
 import click
 from flask.cli import with_appcontext
 from src.api.models import db, User
+from src.api import benchmarks, importer, jobs, search, passwords, stripe_events, fake_stripe, inventory, loadtest, checks
+from src.api.cache import bump_catalog_generation
 
 def setup_commands(app):
 
@@ -14,7 +19,7 @@ def setup_commands(app):
 
         test_user = User(
             email="test@test.com",
-            password="123456",
+            password=passwords.hash_password("123456"),
             is_active=True,
             name="Test",
             lastname="User",
@@ -25,3 +30,233 @@ def setup_commands(app):
         db.session.commit()
 
         click.echo("Test user inserted ")
+
+    @app.cli.command("bench-indexes")
+    @click.option("--rows", default=1_000_000, show_default=True, help="Filas de cart_item / order_item.")
+    @click.option("--runs", default=50, show_default=True, help="Repeticiones por consulta.")
+    @click.option("--database-url", default=None, help="BD desechable (por defecto SQLite en /tmp). Se borran sus tablas.")
+    @click.option("--output", default=None, help="Guarda el resultado en JSON.")
+    def bench_indexes(rows, runs, database_url, output):
+        """Compara planes y latencias de consultas por FK antes/después de los índices."""
+        result = benchmarks.bench_indexes(database_url, rows=rows, runs=runs, echo=click.echo)
+        click.echo(benchmarks.format_before_after(result))
+        if output:
+            benchmarks.save_result(result, output)
+            click.echo(f"Resultado guardado en {output}")
+
+    @app.cli.command("import-products")
+    @click.option("--file", "path", default=None, help="Fichero local .json/.jsonl en vez de DummyJSON.")
+    @click.option("--url", default=importer.DUMMYJSON_URL, show_default=True, help="Endpoint paginado estilo DummyJSON.")
+    @click.option("--limit", default=None, type=int, help="Máximo de productos a importar.")
+    @click.option("--page-size", default=importer.DEFAULT_PAGE_SIZE, show_default=True)
+    @click.option("--chunk-size", default=importer.DEFAULT_CHUNK_SIZE, show_default=True)
+    @click.option("--upsert", is_flag=True, help="Sincroniza por external_id (solo inserta/actualiza lo que cambió).")
+    def import_products(path, url, limit, page_size, chunk_size, upsert):
+        """Importa productos en streaming con INSERT masivos por bloques."""
+        if path:
+            source = importer.FileSource(path, max_items=limit)
+        else:
+            source = importer.DummyJSONSource(url, page_size=page_size, max_items=limit)
+
+        def progress(stats):
+            if stats.chunks % 10 == 0:
+                click.echo(f"  {stats.inserted} productos ({stats.to_dict()['rows_per_sec']} filas/s)")
+
+        try:
+            stats = importer.import_products(source, chunk_size=chunk_size, on_progress=progress, upsert=upsert)
+        finally:
+            bump_catalog_generation()
+        click.echo(f"Importación terminada: {stats.to_dict()}")
+
+    @app.cli.command("jobs-worker")
+    @click.option("--poll-interval", default=1.0, show_default=True, help="Segundos entre consultas a la cola.")
+    @click.option("--once", is_flag=True, help="Procesa lo que haya en cola y termina.")
+    def jobs_worker(poll_interval, once):
+        """Worker de tareas en segundo plano (importaciones, etc.)."""
+        click.echo("Worker de tareas arrancado")
+        jobs.work(poll_interval=poll_interval, once=once, echo=click.echo)
+
+    @app.cli.command("bench-search")
+    @click.option("--sizes", default="100000,1000000", show_default=True, help="Tamaños del catálogo, separados por comas.")
+    @click.option("--runs", default=200, show_default=True, help="Búsquedas por tamaño.")
+    @click.option("--database-url", default=None, help="BD desechable (por defecto SQLite en /tmp). Se borran sus tablas.")
+    @click.option("--engine", "engines", type=click.Choice(["db", "memory", "all"]), default="db",
+                  show_default=True, help="Índice a medir: el de la BD, el de memoria o ambos.")
+    @click.option("--output", default=None, help="Guarda el resultado en JSON.")
+    def bench_search(sizes, runs, database_url, engines, output):
+        """Latencia p50/p99 de /api/products/search con el índice de la BD y/o el de memoria."""
+        sizes = [int(x) for x in sizes.split(",") if x.strip()]
+        engines = search.ENGINES if engines == "all" else (engines,)
+        result = benchmarks.bench_search(database_url, sizes=sizes, runs=runs, engines=engines,
+                                         echo=click.echo)
+        if output:
+            benchmarks.save_result(result, output)
+            click.echo(f"Resultado guardado en {output}")
+
+    @app.cli.command("search-reindex")
+    def search_reindex():
+        """Crea (si falta) y reconstruye el índice de búsqueda de productos."""
+        with db.engine.begin() as conn:
+            search.ensure_search_index(conn)
+            search.rebuild_search_index(conn)
+        click.echo("Índice de búsqueda reconstruido")
+
+    @app.cli.command("bench-login")
+    @click.option("--requests", "n_requests", default=100, show_default=True, help="Logins por configuración.")
+    @click.option("--concurrency", default=8, show_default=True, help="Hilos cliente en paralelo.")
+    @click.option("--output", default=None, help="Guarda el resultado en JSON.")
+    def bench_login(n_requests, concurrency, output):
+        """Logins/s con hash en línea frente a pool de procesos (crea y borra un usuario temporal)."""
+        result = benchmarks.bench_login(app, requests=n_requests, concurrency=concurrency, echo=click.echo)
+        if output:
+            benchmarks.save_result(result, output)
+            click.echo(f"Resultado guardado en {output}")
+
+    @app.cli.command("stripe-replay")
+    @click.argument("fixture", type=click.Choice(stripe_events.fixture_names()))
+    @click.option("--order-id", type=int, default=None, help="Pedido al que apuntar el evento.")
+    @click.option("--session-id", default=None, help="Id de la sesión de Checkout.")
+    @click.option("--payment-intent", default=None, help="Id del PaymentIntent (charge.refunded).")
+    @click.option("--event-id", default=None, help="Id del evento (por defecto el grabado: se deduplica).")
+    def stripe_replay(fixture, order_id, session_id, payment_intent, event_id):
+        """Firma un evento grabado de Stripe y lo envía al webhook local (sin red)."""
+        secret = os.getenv("STRIPE_WEBHOOK_SECRET")
+        if not secret:
+            raise click.ClickException("Falta STRIPE_WEBHOOK_SECRET")
+        event = stripe_events.load_fixture(fixture, order_id=order_id, session_id=session_id,
+                                           payment_intent=payment_intent, event_id=event_id)
+        payload = json.dumps(event).encode()
+        response = app.test_client().post("/api/stripe/webhook", data=payload, headers={
+            "Content-Type": "application/json",
+            "Stripe-Signature": stripe_events.sign(payload, secret),
+        })
+        click.echo(f"{response.status_code} {response.get_json()}")
+
+    @app.cli.command("stripe-check")
+    @click.option("--database-url", default=None, help="BD desechable (por defecto SQLite en /tmp). Se borran sus tablas.")
+    def stripe_check(database_url):
+        """Reproduce los eventos grabados de Stripe por el webhook y comprueba pedido y stock (ver checks.py)."""
+        rows = checks.stripe_fixtures(database_url, echo=click.echo)
+        failed = [row["name"] for row in rows if not row["ok"]]
+        if failed:
+            raise click.ClickException(f"{len(failed)} escenario(s) no cuadran: {', '.join(failed)}")
+        click.echo(f"{len(rows)} comprobaciones correctas")
+
+    @app.cli.command("check-queries")
+    @click.option("--database-url", default=None, help="BD desechable (por defecto SQLite en /tmp). Se borran sus tablas.")
+    def check_queries(database_url):
+        """Cuenta las sentencias SQL de los listados frente a su presupuesto (ver checks.QUERY_BUDGETS)."""
+        rows = checks.query_budgets(database_url, echo=click.echo)
+        failed = [row["name"] for row in rows if not row["ok"]]
+        if failed:
+            raise click.ClickException(f"{len(failed)} endpoint(s) fuera de presupuesto: {', '.join(failed)}")
+        click.echo(f"{len(rows)} endpoints dentro de presupuesto")
+
+    @app.cli.command("stock-sweep")
+    def stock_sweep():
+        """Devuelve al stock las reservas de pedidos pendientes ya caducados (también lo hace jobs-worker)."""
+        total = {"orders": 0, "units": 0}
+        while True:
+            swept = inventory.release_expired()
+            if not swept["orders"]:
+                break
+            total = {key: total[key] + swept[key] for key in total}
+        click.echo(f"{total['orders']} pedido(s) caducados, {total['units']} unidad(es) devueltas al stock")
+
+    @app.cli.command("bench-stock")
+    @click.option("--stock", default=100, show_default=True, help="Stock inicial del producto.")
+    @click.option("--threads", default=16, show_default=True, help="Hilos reservando a la vez.")
+    @click.option("--attempts", default=50, show_default=True, help="Reservas por hilo.")
+    @click.option("--quantity", default=1, show_default=True, help="Unidades por reserva.")
+    @click.option("--buckets", default="0,8", show_default=True, help="Repartos a probar (0 = una sola fila).")
+    @click.option("--database-url", default=None, help="BD desechable (por defecto SQLite en /tmp). Se borran sus tablas.")
+    @click.option("--output", default=None, help="Guarda el resultado en JSON.")
+    def bench_stock(stock, threads, attempts, quantity, buckets, database_url, output):
+        """Carga concurrente sobre un mismo producto: comprueba que no se vende de más."""
+        buckets = [int(x) for x in buckets.split(",") if x.strip()]
+        result = benchmarks.bench_stock(database_url, stock=stock, threads=threads, attempts=attempts,
+                                        quantity=quantity, buckets=buckets, echo=click.echo)
+        if output:
+            benchmarks.save_result(result, output)
+            click.echo(f"Resultado guardado en {output}")
+        if any(r["oversold"] or not r["consistent"] or not r["restored"] for r in result["results"]):
+            raise click.ClickException("El stock no cuadra tras la carga")
+
+    @app.cli.command("bench-serialize")
+    @click.option("--rows", default=10000, show_default=True, help="Productos en el listado.")
+    @click.option("--runs", default=20, show_default=True, help="Repeticiones por variante.")
+    @click.option("--database-url", default=None, help="BD desechable (por defecto SQLite en /tmp). Se borran sus tablas.")
+    @click.option("--output", default=None, help="Guarda el resultado en JSON.")
+    def bench_serialize(rows, runs, database_url, output):
+        """Listado completo de productos: ORM + serialize() frente a tuplas de Core en streaming (json/orjson)."""
+        result = benchmarks.bench_serialization(database_url, rows=rows, runs=runs, echo=click.echo)
+        if output:
+            benchmarks.save_result(result, output)
+            click.echo(f"Resultado guardado en {output}")
+        if not all(r["same_output"] for r in result["results"]):
+            raise click.ClickException("Las variantes no devuelven el mismo JSON")
+
+    @app.cli.command("loadtest")
+    @click.option("--mix", default="browse", show_default=True,
+                  help=f"Mezclas separadas por comas ({', '.join(loadtest.MIXES)}) o all.")
+    @click.option("--mode", type=click.Choice(["wsgi", "gunicorn"]), default="wsgi", show_default=True,
+                  help="wsgi: cliente de pruebas de Flask en proceso; gunicorn: HTTP contra gunicorn en localhost.")
+    @click.option("--requests", "n_requests", default=1000, show_default=True, help="Acciones por mezcla.")
+    @click.option("--concurrency", default=8, show_default=True, help="Hilos cliente (cada uno con su usuario).")
+    @click.option("--workers", default=2, show_default=True, help="Workers de gunicorn.")
+    @click.option("--threads", default=1, show_default=True, help="Hilos por worker de gunicorn.")
+    @click.option("--users", default=loadtest.DEFAULT_SIZES["users"], show_default=True)
+    @click.option("--products", default=loadtest.DEFAULT_SIZES["products"], show_default=True)
+    @click.option("--cart-items", default=loadtest.DEFAULT_SIZES["cart_items"], show_default=True)
+    @click.option("--orders", default=loadtest.DEFAULT_SIZES["orders"], show_default=True)
+    @click.option("--seed", default=42, show_default=True, help="Semilla de datos y de la secuencia de acciones.")
+    @click.option("--stripe-latency-ms", default=0, show_default=True, help="Retardo del Stripe falso.")
+    @click.option("--database-url", default=None, help="BD desechable (por defecto SQLite en /tmp). Se borran sus tablas.")
+    @click.option("--output", default=None, help="Guarda el resultado en JSON (para loadtest-compare).")
+    def run_loadtest(mix, mode, n_requests, concurrency, workers, threads, users, products, cart_items, orders,
+                     seed, stripe_latency_ms, database_url, output):
+        """Carga reproducible contra la API real: req/s, p50/p95/p99 y SQL por endpoint."""
+        mixes = list(loadtest.MIXES) if mix == "all" else [m.strip() for m in mix.split(",") if m.strip()]
+        unknown = [m for m in mixes if m not in loadtest.MIXES]
+        if unknown:
+            raise click.BadParameter(f"mezcla desconocida: {', '.join(unknown)}", param_hint="--mix")
+        if concurrency > users:
+            raise click.BadParameter("no puede haber más hilos que usuarios", param_hint="--concurrency")
+        sizes = {"users": users, "products": products, "cart_items": cart_items, "orders": orders}
+        result = loadtest.run(mixes, mode=mode, requests=n_requests, concurrency=concurrency, sizes=sizes,
+                              url=database_url, seed=seed, workers=workers, threads=threads,
+                              stripe_latency_ms=stripe_latency_ms, echo=click.echo)
+        for mix_result in result["results"]:
+            click.echo(f"\n[{mix_result['mix']}]")
+            for e in mix_result["endpoints"]:
+                click.echo(f"  {e['endpoint']:<38} {e['requests']:>6} req {e['req_per_sec']:>8} req/s  "
+                           f"p50 {e['p50_ms']:>8} p95 {e['p95_ms']:>8} p99 {e['p99_ms']:>8} ms  "
+                           f"sql {e['sql_avg']} (máx {e['sql_max']})  5xx {e['errors']}")
+        if output:
+            benchmarks.save_result(result, output)
+            click.echo(f"Resultado guardado en {output}")
+
+    @app.cli.command("loadtest-compare")
+    @click.argument("base", type=click.File())
+    @click.argument("new", type=click.File())
+    def loadtest_compare(base, new):
+        """Compara dos resultados de `flask loadtest` por mezcla y endpoint."""
+        base, new = json.load(base), json.load(new)
+        for key in ("mode", "sizes", "requests", "concurrency", "seed"):
+            if base.get(key) != new.get(key):
+                click.echo(f"Aviso: {key} distinto ({base.get(key)} / {new.get(key)})")
+        click.echo(loadtest.format_comparison(loadtest.compare(base, new)))
+
+    @app.cli.command("fake-stripe")
+    @click.option("--host", default="127.0.0.1", show_default=True)
+    @click.option("--port", default=12111, show_default=True)
+    @click.option("--latency-ms", default=0, show_default=True, help="Retardo artificial por petición.")
+    def run_fake_stripe(host, port, latency_ms):
+        """Servidor falso de la API de Stripe (usar con STRIPE_API_BASE=http://host:port)."""
+        server, fake = fake_stripe.serve(host, port, latency_ms)
+        click.echo(f"Stripe falso en http://{host}:{port} (Ctrl+C para parar)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server.shutdown()
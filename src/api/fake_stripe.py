@@ -0,0 +1,107 @@
+"""
+Servidor falso de la API de Stripe (solo lo que usa la app), para desarrollo y benchmarks sin red.
+
+    flask fake-stripe --port 12111 --latency-ms 150
+    STRIPE_API_BASE=http://127.0.0.1:12111 STRIPE_SECRET_KEY=sk_test_fake flask run
+
+Implementa:
+- POST /v1/checkout/sessions          crea una sesión (cuerpo form-encoded como el de Stripe)
+- GET  /v1/checkout/sessions/<id>     la devuelve
+- POST /v1/checkout/sessions/<id>/expire
+"""
+import re
+import json
+import time
+import itertools
+import threading
+from urllib.parse import parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_SESSION_PATH = re.compile(r"^/v1/checkout/sessions/([\w-]+)(/expire)?$")
+
+
+class FakeStripe:
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+        self.sessions = {}
+        self.requests = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def create_session(self, form, base_url):
+        with self._lock:
+            session_id = f"cs_test_fake{next(self._ids):08d}"
+        amount = 0
+        for key, value in form.items():
+            m = re.match(r"line_items\[(\d+)\]\[quantity\]$", key)
+            if m:
+                unit = form.get(f"line_items[{m.group(1)}][price_data][unit_amount]", 0)
+                amount += int(value) * int(unit)
+        metadata = {k[len("metadata["):-1]: v for k, v in form.items() if k.startswith("metadata[")}
+        session = {
+            "id": session_id,
+            "object": "checkout.session",
+            "amount_total": amount,
+            "currency": "eur",
+            "client_reference_id": form.get("client_reference_id"),
+            "metadata": metadata,
+            "mode": form.get("mode", "payment"),
+            "payment_status": "unpaid",
+            "status": "open",
+            "expires_at": int(form.get("expires_at") or time.time() + 86400),
+            "success_url": form.get("success_url"),
+            "url": f"{base_url}/pay/{session_id}",
+            "livemode": False,
+        }
+        self.sessions[session_id] = session
+        return session
+
+    def handle(self, method, path, form, base_url):
+        """Devuelve (status, cuerpo)."""
+        self.requests += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        if method == "POST" and path == "/v1/checkout/sessions":
+            return 200, self.create_session(form, base_url)
+        m = _SESSION_PATH.match(path)
+        if m and m.group(1) in self.sessions:
+            session = self.sessions[m.group(1)]
+            if method == "POST" and m.group(2):
+                session["status"] = "expired"
+            return 200, session
+        return 404, {"error": {"type": "invalid_request_error", "message": f"No such resource: {path}"}}
+
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, como la API real
+
+        def _respond(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length).decode() if length else ""
+            form = dict(parse_qsl(body, keep_blank_values=True))
+            base_url = f"http://{self.headers.get('Host', 'localhost')}"
+            status, payload = fake.handle(self.command, self.path.split("?")[0], form, base_url)
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = _respond
+        do_POST = _respond
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+def serve(host="127.0.0.1", port=12111, latency_ms=0):
+    """Arranca el servidor en un hilo. Devuelve (server, fake); server.shutdown() lo para."""
+    fake = FakeStripe(latency_ms=latency_ms)
+    server = ThreadingHTTPServer((host, port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake
@@ -0,0 +1,355 @@
+"""
+Importador de productos por streaming.
+
+La fuente (DummyJSON por HTTP, o un fichero local .json / .jsonl) se recorre
+como un generador de dicts y se escribe en la BD con INSERT masivos
+(executemany) por bloques, así que la memoria no crece con el tamaño del feed.
+
+En modo upsert cada fila se identifica por (external_source, external_id) y lleva
+un hash de su contenido: solo se insertan las nuevas y se actualizan las que cambiaron.
+En modo insert las filas cuyo (external_source, external_id) ya existe se saltan,
+así que importar dos veces la misma fuente no se queda a medias por el índice único.
+"""
+import os
+import json
+import time
+import hashlib
+from datetime import datetime, timezone
+import requests
+from sqlalchemy import insert, update, select, delete
+from sqlalchemy.dialects import postgresql, sqlite
+from src.api.models import db, Product, CartItem, OrderItem, StockReservation, ProductStockBucket
+from src.api import outbound
+
+DUMMYJSON_URL = "https://dummyjson.com/products"
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_CHUNK_SIZE = 1000
+REQUEST_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Marketly Importer)",
+    "Accept": "application/json",
+}
+
+_decoder = json.JSONDecoder()
+
+
+def iter_json_array(chunks, key=None):
+    """
+    Parser incremental: recibe trozos de texto y va devolviendo los elementos de un
+    array JSON (el documento entero si es un array, o el array bajo `key`)
+    sin cargar el documento completo en memoria.
+    """
+    chunks = iter(chunks)
+    buf = ""
+    pos = 0
+
+    def fill():
+        nonlocal buf, pos
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    # buscar el "[" de inicio del array
+    marker = f'"{key}"' if key else None
+    while True:
+        if marker:
+            at = buf.find(marker, pos)
+            start = buf.find("[", at + len(marker)) if at != -1 else -1
+        else:
+            start = buf.find("[", pos)
+        if start != -1:
+            pos = start + 1
+            break
+        if marker and at != -1:
+            pos = at  # marcador encontrado, falta el "[": se conserva desde el marcador
+        elif marker:
+            # conservamos la cola por si el marcador queda partido entre dos trozos
+            pos = max(pos, len(buf) - len(marker))
+        else:
+            pos = len(buf)
+        if not fill():
+            return
+
+    while True:
+        # saltar espacios y comas
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf):
+                break
+            if not fill():
+                return
+        if buf[pos] == "]":
+            return
+        try:
+            item, end = _decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if not fill():
+                raise
+            continue
+        # si el objeto acaba justo al final del buffer podría estar truncado (números)
+        if end == len(buf) and fill():
+            continue
+        pos = end
+        yield item
+
+
+class DummyJSONSource:
+    """Pagina DummyJSON (limit/skip) y parsea cada página en streaming."""
+
+    name = "dummyjson"
+
+    def __init__(self, url=DUMMYJSON_URL, page_size=DEFAULT_PAGE_SIZE, max_items=None,
+                 session=None, timeout=20):
+        self.url = url
+        self.page_size = page_size
+        self.max_items = max_items
+        self.session = session or requests.Session()
+        self.timeout = timeout
+
+    def __iter__(self):
+        skip = 0
+        while self.max_items is None or skip < self.max_items:
+            limit = self.page_size
+            if self.max_items is not None:
+                limit = min(limit, self.max_items - skip)
+            # hasta tener las cabeceras (el cuerpo se lee en streaming mientras se inserta)
+            with outbound.timed("dummyjson.products"):
+                r = self.session.get(self.url, params={"limit": limit, "skip": skip}, timeout=self.timeout,
+                                     stream=True, headers=REQUEST_HEADERS)
+                r.raise_for_status()
+            r.encoding = r.encoding or "utf-8"
+            received = 0
+            with r:
+                for item in iter_json_array(r.iter_content(chunk_size=64 * 1024, decode_unicode=True), "products"):
+                    received += 1
+                    yield item
+            skip += received
+            if received < limit:
+                return
+
+
+class FileSource:
+    """Fichero local: .jsonl (un producto por línea) o JSON ({"products": [...]} o [...])."""
+
+    def __init__(self, path, max_items=None, name="file"):
+        self.path = path
+        self.max_items = max_items
+        self.name = name
+
+    def __iter__(self):
+        with open(self.path, encoding="utf-8") as f:
+            if self.path.endswith(".jsonl"):
+                items = (json.loads(line) for line in f if line.strip())
+            else:
+                head = f.read(1024)
+                key = None if head.lstrip().startswith("[") else "products"
+                items = iter_json_array(_chain_reads(head, f), key)
+            for n, item in enumerate(items):
+                if self.max_items is not None and n >= self.max_items:
+                    return
+                yield item
+
+
+def _chain_reads(head, f, size=64 * 1024):
+    yield head
+    while True:
+        chunk = f.read(size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def make_source(max_items=None, page_size=DEFAULT_PAGE_SIZE):
+    """Fuente según el entorno: PRODUCT_IMPORT_FILE o PRODUCT_IMPORT_URL (DummyJSON por defecto)."""
+    path = os.getenv("PRODUCT_IMPORT_FILE")
+    if path:
+        return FileSource(path, max_items=max_items)
+    return DummyJSONSource(os.getenv("PRODUCT_IMPORT_URL", DUMMYJSON_URL), page_size=page_size,
+                           max_items=max_items)
+
+
+def product_row(p, now, source_name=None):
+    price = p.get("price", 0) or 0
+    try:
+        price_cents = int(round(float(price) * 100))
+    except Exception:
+        price_cents = 0
+
+    row = {
+        "title": (p.get("title") or "Producto sin título")[:200],
+        "description": (p.get("description") or "")[:2000],
+        "price_cents": price_cents,
+        "image_url": p.get("thumbnail", "") or "",
+    }
+    external_id = p.get("id")
+    row.update({
+        "external_source": source_name if external_id is not None else None,
+        "external_id": str(external_id)[:100] if external_id is not None else None,
+        "content_hash": content_hash(row),
+        "created_at": now,
+        "updated_at": now,
+    })
+    return row
+
+
+def content_hash(row):
+    raw = "\x1f".join(str(row[k]) for k in ("title", "description", "price_cents", "image_url"))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+class ImportStats:
+    def __init__(self):
+        self.read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.chunks = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def to_dict(self):
+        elapsed = self.elapsed
+        return {
+            "read": self.read,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "skipped": self.skipped,
+            "chunks": self.chunks,
+            "elapsed_s": round(elapsed, 3),
+            "rows_per_sec": round(self.read / elapsed, 1) if elapsed > 0 else None,
+        }
+
+
+def _upsert_chunk(chunk, source_name, stats):
+    # dentro del bloque, la última aparición de cada id gana
+    by_external_id = {}
+    for row in chunk:
+        if row["external_id"] is None:
+            by_external_id[id(row)] = row
+        else:
+            by_external_id[row["external_id"]] = row
+
+    external_ids = [row["external_id"] for row in by_external_id.values() if row["external_id"] is not None]
+    existing = {}
+    if external_ids:
+        existing = {
+            external_id: (product_id, digest)
+            for product_id, external_id, digest in db.session.execute(
+                select(Product.id, Product.external_id, Product.content_hash).where(
+                    Product.external_source == source_name,
+                    Product.external_id.in_(external_ids),
+                )
+            )
+        }
+
+    to_insert, to_update = [], []
+    for row in by_external_id.values():
+        match = existing.get(row["external_id"])
+        if match is None:
+            to_insert.append(row)
+        elif match[1] != row["content_hash"]:
+            changes = {k: v for k, v in row.items() if k not in ("created_at", "external_source", "external_id")}
+            to_update.append({"id": match[0], **changes})
+        else:
+            stats.unchanged += 1
+
+    if to_insert:
+        db.session.execute(insert(Product), to_insert)
+    if to_update:
+        # UPDATE masivo por clave primaria (executemany)
+        db.session.execute(update(Product), to_update)
+    stats.inserted += len(to_insert)
+    stats.updated += len(to_update)
+
+
+INSERT_IGNORE_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _insert_chunk(chunk, source_name, stats):
+    """
+    Modo insert: INSERT masivo saltando los (external_source, external_id) que ya
+    existen. En PostgreSQL/SQLite con ON CONFLICT DO NOTHING; en otros motores se
+    filtran antes contra la BD (y los repetidos dentro del bloque).
+    """
+    dialect_insert = INSERT_IGNORE_DIALECTS.get(db.session.get_bind().dialect.name)
+    if dialect_insert is not None:
+        stmt = (
+            dialect_insert(Product)
+            .on_conflict_do_nothing(index_elements=["external_source", "external_id"])
+            .returning(Product.id)
+        )
+        inserted = len(db.session.execute(stmt, chunk).all())
+    else:
+        external_ids = [row["external_id"] for row in chunk if row["external_id"] is not None]
+        seen = set(db.session.scalars(
+            select(Product.external_id).where(
+                Product.external_source == source_name,
+                Product.external_id.in_(external_ids),
+            )
+        )) if external_ids else set()
+        rows = []
+        for row in chunk:
+            if row["external_id"] is not None:
+                if row["external_id"] in seen:
+                    continue
+                seen.add(row["external_id"])
+            rows.append(row)
+        if rows:
+            db.session.execute(insert(Product), rows)
+        inserted = len(rows)
+    stats.inserted += inserted
+    stats.skipped += len(chunk) - inserted
+
+
+def clear_products():
+    """
+    Borra todo el catálogo (importación con replace) con sentencias masivas, con el
+    mismo efecto que las cascadas de Product: las líneas de pedido conservan su
+    copia del producto y se quedan sin product_id; carritos, reservas y buckets de
+    stock se borran. Sin commit.
+    """
+    db.session.execute(
+        update(OrderItem).where(OrderItem.product_id.is_not(None)).values(product_id=None)
+        .execution_options(synchronize_session=False)
+    )
+    for model in (CartItem, StockReservation, ProductStockBucket, Product):
+        db.session.execute(delete(model).execution_options(synchronize_session=False))
+
+
+def import_products(source, chunk_size=DEFAULT_CHUNK_SIZE, on_progress=None, stats=None, upsert=False):
+    """
+    Inserta los productos de `source` en bloques de `chunk_size` (un commit por bloque).
+    Con upsert=True solo inserta los nuevos y actualiza los que cambiaron (por external_id).
+    `on_progress(stats)` se llama tras cada bloque.
+    """
+    stats = stats or ImportStats()
+    source_name = getattr(source, "name", None)
+    chunk = []
+
+    def flush():
+        if upsert:
+            _upsert_chunk(chunk, source_name, stats)
+        else:
+            _insert_chunk(chunk, source_name, stats)
+        db.session.commit()
+        stats.chunks += 1
+        chunk.clear()
+        if on_progress:
+            on_progress(stats)
+
+    for p in source:
+        stats.read += 1
+        chunk.append(product_row(p, datetime.now(timezone.utc), source_name))
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+    return stats
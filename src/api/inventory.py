@@ -0,0 +1,308 @@
+"""
+Stock de productos y reservas durante el pago.
+
+- Product.stock NULL = sin control de stock (nunca se agota). Es lo que tienen
+  todos los productos existentes y los importados.
+- Al crear la sesión de pago, reserve() descuenta todas las líneas del carrito
+  con un único UPDATE condicional:
+
+      UPDATE product SET stock = stock - CASE id WHEN :id1 THEN :q1 ... END
+      WHERE id IN (...) AND stock >= CASE id WHEN :id1 THEN :q1 ... END
+
+  Si alguna fila no se actualiza falta stock: se deshace el savepoint y se
+  lanza OutOfStock. La BD hace de árbitro; no hay lectura previa que pueda
+  quedarse vieja, así que no se vende de más aunque lleguen muchas a la vez.
+- Cada descuento queda apuntado en stock_reservation (activa hasta que el
+  pedido se paga o caduca). El webhook la confirma (paid) o la devuelve
+  (failed/expired); release_expired() devuelve las de pedidos que siguen
+  "pending" pasada su caducidad (lo llama el worker de jobs.py).
+- Productos muy demandados: set_stock(..., buckets=N) reparte el stock en N
+  filas de product_stock_bucket. Cada reserva prueba un bucket al azar, así que
+  las compras simultáneas se reparten entre N locks de fila en vez de uno.
+
+Ninguna función hace commit salvo release_expired(): la reserva va en la misma
+transacción que el pedido.
+"""
+import random
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, insert, update, delete, case, func
+from src.api.models import db, Order, Product, ProductStockBucket, StockReservation
+
+logger = logging.getLogger(__name__)
+
+# pedidos que libera release_expired() por pasada
+SWEEP_BATCH = 500
+# margen sobre la caducidad de la sesión de pago: el webhook de un pago hecho en
+# el último momento llega antes de que el barrendero devuelva el stock
+RESERVATION_GRACE = timedelta(minutes=5)
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f"Sin stock suficiente para: {', '.join(map(str, self.product_ids))}")
+
+
+class _Short(Exception):
+    """Uso interno: sale del savepoint para deshacerlo."""
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _by_id(column, quantities):
+    return case(quantities, value=column)
+
+
+# ---------------------------
+# Consulta y ajuste
+# ---------------------------
+def available(product_id, session=None):
+    """(unidades disponibles o None si no se controla, nº de buckets). None si el producto no existe."""
+    session = session or db.session
+    row = session.execute(
+        select(Product.stock, Product.stock_buckets).where(Product.id == product_id)
+    ).first()
+    if row is None:
+        return None
+    stock, buckets = row
+    if stock is None or not buckets:
+        return stock, buckets
+    in_buckets = session.scalar(
+        select(func.coalesce(func.sum(ProductStockBucket.stock), 0))
+        .where(ProductStockBucket.product_id == product_id)
+    )
+    return stock + in_buckets, buckets
+
+
+def set_stock(product_id, stock, buckets=None, session=None):
+    """
+    Fija el disponible total del producto (None = sin control de stock).
+    buckets=None conserva el reparto actual; buckets=N lo reparte en N filas
+    (0 = todo en product.stock). No toca las reservas activas.
+    """
+    session = session or db.session
+    current = session.execute(
+        select(Product.stock_buckets).where(Product.id == product_id).with_for_update()
+    ).scalar()
+    buckets = current if buckets is None else int(buckets)
+    if stock is None:
+        buckets = 0
+
+    session.execute(
+        delete(ProductStockBucket).where(ProductStockBucket.product_id == product_id)
+        .execution_options(synchronize_session=False)
+    )
+    if buckets:
+        share, extra = divmod(int(stock), buckets)
+        session.execute(insert(ProductStockBucket), [
+            {"product_id": product_id, "bucket": b, "stock": share + (1 if b < extra else 0)}
+            for b in range(buckets)
+        ])
+        stock = 0
+    # el stock no es parte de la versión del producto: updated_at (ETag) no cambia
+    session.execute(
+        update(Product).where(Product.id == product_id)
+        .values(stock=stock, stock_buckets=buckets, updated_at=Product.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+
+
+# ---------------------------
+# Reservas
+# ---------------------------
+def reserve(order_id, lines, expires_at, session=None, rng=random):
+    """
+    Reserva las líneas [(product_id, quantity), ...] para el pedido. Los productos
+    sin control de stock se ignoran. Devuelve las reservas creadas; lanza OutOfStock
+    (sin haber descontado nada) si alguna línea no cabe.
+    """
+    session = session or db.session
+    wanted = {}
+    for product_id, quantity in lines:
+        wanted[product_id] = wanted.get(product_id, 0) + int(quantity)
+    if not wanted:
+        return []
+
+    tracked = session.execute(
+        select(Product.id, Product.stock_buckets)
+        .where(Product.id.in_(wanted), Product.stock.is_not(None))
+    ).all()
+    plain = {pid: wanted[pid] for pid, buckets in tracked if not buckets}
+    sharded = {pid: buckets for pid, buckets in tracked if buckets}
+
+    rows, short = [], set()
+    try:
+        with session.begin_nested():
+            if plain:
+                if not _take_plain(session, plain):
+                    short.update(plain)
+                    raise _Short()
+                rows += [{"product_id": pid, "bucket": None, "quantity": q} for pid, q in plain.items()]
+            for pid, buckets in sorted(sharded.items()):
+                taken = _take_buckets(session, pid, wanted[pid], buckets, rng)
+                if taken is None:
+                    short.add(pid)
+                    raise _Short()
+                rows += [{"product_id": pid, "bucket": b, "quantity": q} for b, q in taken]
+            if rows:
+                session.execute(insert(StockReservation), [
+                    {**row, "order_id": order_id, "status": "active", "expires_at": expires_at} for row in rows
+                ])
+    except _Short:
+        raise OutOfStock(_short_products(session, plain, short))
+    return rows
+
+
+def _take_plain(session, quantities):
+    """UPDATE condicional de todas las líneas a la vez. True si se pudieron descontar todas."""
+    qty = _by_id(Product.id, quantities)
+    if len(quantities) > 1:
+        # bloquea en orden de id (PostgreSQL): dos carritos con los mismos productos no se interbloquean
+        session.execute(
+            select(Product.id).where(Product.id.in_(quantities)).order_by(Product.id).with_for_update()
+        ).all()
+    result = session.execute(
+        update(Product)
+        .where(Product.id.in_(quantities), Product.stock >= qty)
+        .values(stock=Product.stock - qty, updated_at=Product.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == len(quantities)
+
+
+def _take_bucket(session, product_id, bucket, quantity):
+    result = session.execute(
+        update(ProductStockBucket)
+        .where(ProductStockBucket.product_id == product_id, ProductStockBucket.bucket == bucket,
+               ProductStockBucket.stock >= quantity)
+        .values(stock=ProductStockBucket.stock - quantity)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def _take_buckets(session, product_id, quantity, buckets, rng):
+    """
+    Primero un bucket al azar con todo; si no llega, reparte entre los que tengan
+    unidades. Devuelve [(bucket, unidades)] o None si no hay bastante en total.
+    """
+    first = rng.randrange(buckets)
+    if _take_bucket(session, product_id, first, quantity):
+        return [(first, quantity)]
+
+    levels = session.execute(
+        select(ProductStockBucket.bucket, ProductStockBucket.stock)
+        .where(ProductStockBucket.product_id == product_id, ProductStockBucket.stock > 0)
+        .order_by(ProductStockBucket.bucket)
+    ).all()
+    taken, remaining = [], quantity
+    for bucket, stock in levels:
+        amount = min(stock, remaining)
+        # otro pedido pudo llevarse unidades entre la lectura y aquí: entonces se salta el bucket
+        if _take_bucket(session, product_id, bucket, amount):
+            taken.append((bucket, amount))
+            remaining -= amount
+        if not remaining:
+            return taken
+    return None
+
+
+def _short_products(session, plain, candidates):
+    """Qué productos no llegan (tras deshacer el savepoint, solo para el mensaje de error)."""
+    if not plain or not candidates.issuperset(plain):
+        return candidates
+    qty = _by_id(Product.id, plain)
+    short = session.execute(
+        select(Product.id).where(Product.id.in_(plain), Product.stock < qty)
+    ).scalars().all()
+    return set(short) or candidates
+
+
+def _claim_active(session, condition, status):
+    """Pasa a `status` las reservas activas que cumplen `condition` y devuelve (product_id, bucket, quantity)."""
+    stmt = (
+        update(StockReservation)
+        .where(condition, StockReservation.status == "active")
+        .values(status=status)
+        .execution_options(synchronize_session=False)
+    )
+    if session.get_bind().dialect.update_returning:
+        return session.execute(
+            stmt.returning(StockReservation.product_id, StockReservation.bucket, StockReservation.quantity)
+        ).all()
+    rows = session.execute(
+        select(StockReservation.product_id, StockReservation.bucket, StockReservation.quantity)
+        .where(condition, StockReservation.status == "active")
+        .with_for_update()
+    ).all()
+    session.execute(stmt)
+    return rows
+
+
+def release(order_ids, session=None):
+    """Devuelve al stock las reservas activas de los pedidos. Devuelve las unidades devueltas."""
+    session = session or db.session
+    rows = _claim_active(session, StockReservation.order_id.in_(order_ids), "released")
+    if not rows:
+        return 0
+
+    plain, buckets = {}, {}
+    for product_id, bucket, quantity in rows:
+        if bucket is None:
+            plain[product_id] = plain.get(product_id, 0) + quantity
+        else:
+            buckets[(product_id, bucket)] = buckets.get((product_id, bucket), 0) + quantity
+
+    if plain:
+        qty = _by_id(Product.id, plain)
+        session.execute(
+            update(Product)
+            .where(Product.id.in_(plain), Product.stock.is_not(None))
+            .values(stock=Product.stock + qty, updated_at=Product.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+    for (product_id, bucket), quantity in sorted(buckets.items()):
+        session.execute(
+            update(ProductStockBucket)
+            .where(ProductStockBucket.product_id == product_id, ProductStockBucket.bucket == bucket)
+            .values(stock=ProductStockBucket.stock + quantity)
+            .execution_options(synchronize_session=False)
+        )
+    return sum(quantity for _, _, quantity in rows)
+
+
+def commit(order_ids, session=None):
+    """Pedido pagado: las unidades ya no vuelven al stock."""
+    session = session or db.session
+    return len(_claim_active(session, StockReservation.order_id.in_(order_ids), "committed"))
+
+
+def release_expired(now=None, limit=SWEEP_BATCH, session=None):
+    """
+    Barrendero: pedidos aún "pending" con reservas caducadas pasan a "expired" y
+    su stock vuelve a estar disponible. Hace commit. Devuelve {"orders", "units"}.
+    """
+    session = session or db.session
+    order_ids = session.execute(
+        select(StockReservation.order_id)
+        .join(Order, Order.id == StockReservation.order_id)
+        .where(StockReservation.status == "active", StockReservation.expires_at < (now or _now()),
+               Order.status == "pending")
+        .distinct()
+        .limit(limit)
+    ).scalars().all()
+    if not order_ids:
+        return {"orders": 0, "units": 0}
+
+    session.execute(
+        update(Order).where(Order.id.in_(order_ids), Order.status == "pending").values(status="expired")
+        .execution_options(synchronize_session=False)
+    )
+    units = release(order_ids, session=session)
+    session.commit()
+    if units:
+        logger.info("Reservas caducadas: %d pedido(s), %d unidad(es) devueltas", len(order_ids), units)
+    return {"orders": len(order_ids), "units": units}
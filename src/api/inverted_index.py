@@ -0,0 +1,224 @@
+"""
+Índice invertido en memoria con ranking BM25 (sin dependencias externas).
+
+- Tokenizador con plegado de acentos ("Pantalón" -> "pantalon"), pensado para
+  un catálogo en español/inglés.
+- Listas de postings compactas: por término, un array('I') de documentos y un
+  array('H') de frecuencias, en vez de listas/dicts de objetos Python.
+- Actualizaciones incrementales: añadir/actualizar/borrar documentos sueltos.
+  Los borrados dejan una lápida y el índice se compacta cuando hay demasiadas.
+"""
+import re
+import sys
+import math
+import bisect
+import threading
+import unicodedata
+from array import array
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+STOPWORDS = frozenset((
+    "a", "al", "con", "de", "del", "el", "en", "la", "las", "lo", "los", "para", "por", "un", "una", "y",
+    "an", "and", "for", "in", "of", "on", "the", "to", "with",
+))
+
+# el título cuenta como si sus palabras aparecieran TITLE_BOOST veces
+TITLE_BOOST = 3
+# máximo de términos en que se expande un prefijo
+MAX_PREFIX_EXPANSION = 64
+
+
+def fold(text):
+    """Minúsculas y sin acentos: "Camión Ñandú" -> "camion nandu"."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text, keep_stopwords=False):
+    if not text:
+        return []
+    words = _WORD_RE.findall(fold(text))
+    if keep_stopwords:
+        return words
+    return [w for w in words if w not in STOPWORDS]
+
+
+class InvertedIndex:
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._terms = {}             # término -> term_id
+        self._sorted_terms = []      # términos ordenados (búsqueda por prefijo)
+        self._doc_ids = []           # term_id -> array('I') de documentos internos
+        self._tfs = []               # term_id -> array('H') de frecuencias
+        self._external = array("I")  # doc interno -> id de producto
+        self._lengths = array("I")   # doc interno -> longitud (tokens ponderados)
+        self._by_external = {}       # id de producto -> doc interno vivo
+        self._deleted = set()        # docs internos borrados (lápidas)
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._by_external)
+
+    def ids(self):
+        with self._lock:
+            return list(self._by_external)
+
+    # ---------------------------
+    # Escritura
+    # ---------------------------
+    def add(self, external_id, title, description=""):
+        """Añade o reemplaza un documento."""
+        counts = {}
+        for term in tokenize(title):
+            counts[term] = counts.get(term, 0) + TITLE_BOOST
+        for term in tokenize(description):
+            counts[term] = counts.get(term, 0) + 1
+
+        with self._lock:
+            self._remove(external_id)
+            doc = len(self._external)
+            self._external.append(external_id)
+            length = sum(counts.values())
+            self._lengths.append(length)
+            self._total_length += length
+            self._by_external[external_id] = doc
+
+            for term, tf in counts.items():
+                term_id = self._terms.get(term)
+                if term_id is None:
+                    term_id = len(self._doc_ids)
+                    self._terms[term] = term_id
+                    bisect.insort(self._sorted_terms, term)
+                    self._doc_ids.append(array("I"))
+                    self._tfs.append(array("H"))
+                self._doc_ids[term_id].append(doc)
+                self._tfs[term_id].append(min(tf, 65535))
+
+    def remove(self, external_id):
+        with self._lock:
+            self._remove(external_id)
+            if len(self._deleted) > 1000 and len(self._deleted) > len(self._by_external) // 4:
+                self._compact()
+
+    def _remove(self, external_id):
+        doc = self._by_external.pop(external_id, None)
+        if doc is not None:
+            self._deleted.add(doc)
+            self._total_length -= self._lengths[doc]
+
+    def _compact(self):
+        """Reescribe los postings sin los documentos borrados."""
+        remap = array("I", [0]) * len(self._external)
+        external, lengths = array("I"), array("I")
+        for doc in range(len(self._external)):
+            if doc in self._deleted:
+                continue
+            remap[doc] = len(external)
+            external.append(self._external[doc])
+            lengths.append(self._lengths[doc])
+
+        for term_id in range(len(self._doc_ids)):
+            docs, tfs = array("I"), array("H")
+            for doc, tf in zip(self._doc_ids[term_id], self._tfs[term_id]):
+                if doc not in self._deleted:
+                    docs.append(remap[doc])
+                    tfs.append(tf)
+            self._doc_ids[term_id], self._tfs[term_id] = docs, tfs
+
+        self._external, self._lengths = external, lengths
+        self._by_external = {ext: doc for doc, ext in enumerate(external)}
+        self._deleted = set()
+
+    # ---------------------------
+    # Búsqueda
+    # ---------------------------
+    def _expand(self, token):
+        """Términos del vocabulario que empiezan por token."""
+        start = bisect.bisect_left(self._sorted_terms, token)
+        terms = []
+        for term in self._sorted_terms[start:start + MAX_PREFIX_EXPANSION]:
+            if not term.startswith(token):
+                break
+            terms.append(term)
+        return terms
+
+    def search(self, query, limit=20, offset=0):
+        """
+        Devuelve ([(id_producto, score), ...], hay_más). Todas las palabras deben
+        aparecer (como prefijo); ordenado por BM25 descendente.
+        """
+        tokens = tokenize(query) or tokenize(query, keep_stopwords=True)
+        if not tokens:
+            return [], False
+
+        with self._lock:
+            n_docs = len(self._by_external)
+            if n_docs == 0:
+                return [], False
+            avgdl = self._total_length / n_docs
+
+            totals = None
+            for token in tokens:
+                scores = {}
+                for term in self._expand(token):
+                    term_id = self._terms[term]
+                    docs, tfs = self._doc_ids[term_id], self._tfs[term_id]
+                    df = len(docs) - sum(1 for d in docs if d in self._deleted) if self._deleted else len(docs)
+                    if df == 0:
+                        continue
+                    idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                    for doc, tf in zip(docs, tfs):
+                        if doc in self._deleted:
+                            continue
+                        norm = tf * (self.k1 + 1) / (
+                            tf + self.k1 * (1 - self.b + self.b * self._lengths[doc] / avgdl))
+                        # con varios términos del mismo prefijo nos quedamos con el mejor
+                        score = idf * norm
+                        if score > scores.get(doc, 0.0):
+                            scores[doc] = score
+
+                if totals is None:
+                    totals = scores
+                else:
+                    totals = {doc: s + scores[doc] for doc, s in totals.items() if doc in scores}
+                if not totals:
+                    return [], False
+
+            ranked = sorted(totals.items(), key=lambda item: (-item[1], self._external[item[0]]))
+            page = ranked[offset:offset + limit]
+            return [(self._external[doc], score) for doc, score in page], len(ranked) > offset + limit
+
+    # ---------------------------
+    # Estadísticas
+    # ---------------------------
+    def stats(self):
+        with self._lock:
+            postings = sum(len(d) for d in self._doc_ids)
+            array_bytes = sum((
+                sum(d.itemsize * len(d) for d in self._doc_ids),
+                sum(t.itemsize * len(t) for t in self._tfs),
+                self._external.itemsize * len(self._external),
+                self._lengths.itemsize * len(self._lengths),
+            ))
+            # aproximado: contenedores + cadenas del vocabulario
+            overhead = sum((
+                sys.getsizeof(self._terms),
+                sys.getsizeof(self._sorted_terms),
+                sum(sys.getsizeof(t) for t in self._sorted_terms),
+                sys.getsizeof(self._doc_ids),
+                sys.getsizeof(self._tfs),
+                len(self._doc_ids) * 2 * sys.getsizeof(array("I")),
+                sys.getsizeof(self._by_external),
+                sys.getsizeof(self._deleted),
+            ))
+            return {
+                "documents": len(self._by_external),
+                "deleted": len(self._deleted),
+                "terms": len(self._terms),
+                "postings": postings,
+                "memory_bytes": array_bytes + overhead,
+                "postings_bytes": array_bytes,
+            }
@@ -0,0 +1,164 @@
+"""
+Tareas en segundo plano sobre la propia BD (tabla job).
+
+Las rutas encolan con enqueue() y responden 202; un proceso aparte
+(`flask jobs-worker`, ver commands.py) reclama las tareas en cola una a una y
+va guardando el progreso en la fila para que GET /api/jobs/<id> lo muestre.
+El mismo bucle devuelve al stock las reservas de pedidos caducados (inventory.py).
+
+El worker es obligatorio en producción (Procfile `worker`, servicio `worker` de
+render.yaml): sin él las importaciones y los eventos de Stripe se quedan en cola.
+Donde no se pueda tener uno, JOBS_RUN_INLINE=1 ejecuta cada tarea dentro de la
+petición que la encola, y `flask stock-sweep` (p. ej. un cron) hace el barrido.
+"""
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, update
+from src.api.models import db, Job
+from src.api.cache import bump_catalog_generation
+from src.api import importer, stripe_events, inventory
+
+HANDLERS = {}
+
+# una tarea "running" sin latido en este tiempo se da por perdida (worker muerto)
+STALE_AFTER = timedelta(seconds=int(os.getenv("JOBS_STALE_AFTER", 600)))
+
+
+def handler(kind):
+    def register(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return register
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def enqueue(kind, payload):
+    if kind not in HANDLERS:
+        raise ValueError(f"tipo de tarea desconocido: {kind}")
+    job = Job(kind=kind, payload=payload, status="queued")
+    db.session.add(job)
+    db.session.commit()
+
+    # para desarrollo sin worker: ejecuta la tarea dentro de la petición
+    if os.getenv("JOBS_RUN_INLINE", "").lower() in ("1", "true", "yes"):
+        if _claim(job.id):
+            run_job(db.session.get(Job, job.id))
+    return job
+
+
+def _claim(job_id):
+    now = _now()
+    result = db.session.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == "queued")
+        .values(status="running", started_at=now, heartbeat_at=now)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def claim_next():
+    """Reclama la tarea en cola más antigua. El UPDATE condicional evita que dos workers cojan la misma."""
+    while True:
+        job_id = db.session.execute(
+            select(Job.id).where(Job.status == "queued").order_by(Job.id).limit(1)
+        ).scalar()
+        if job_id is None:
+            return None
+        if _claim(job_id):
+            return db.session.get(Job, job_id)
+
+
+def fail_stale_jobs():
+    result = db.session.execute(
+        update(Job)
+        .where(Job.status == "running", Job.heartbeat_at < _now() - STALE_AFTER)
+        .values(status="failed", error="El worker dejó de responder", finished_at=_now())
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def run_job(job):
+    job_id = job.id
+    fn = HANDLERS[job.kind]
+
+    def report(progress):
+        job.progress = progress
+        job.heartbeat_at = _now()
+        db.session.commit()
+
+    try:
+        result = fn(dict(job.payload or {}), report)
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(Job, job_id)
+        job.status = "failed"
+        job.error = f"{type(e).__name__}: {e}"
+    else:
+        job.status = "succeeded"
+        job.result = result
+    job.finished_at = _now()
+    db.session.commit()
+    return job
+
+
+def work(poll_interval=1.0, once=False, echo=print):
+    """Bucle del worker. Con once=True procesa lo que haya en cola y termina."""
+    while True:
+        stale = fail_stale_jobs()
+        if stale:
+            echo(f"{stale} tarea(s) abandonadas marcadas como failed")
+        expired = inventory.release_expired()
+        if expired["orders"]:
+            echo(f"{expired['orders']} pedido(s) caducados: {expired['units']} unidad(es) devueltas al stock")
+
+        job = claim_next()
+        if job is not None:
+            echo(f"Tarea {job.id} ({job.kind}) ...")
+            job = run_job(job)
+            echo(f"Tarea {job.id}: {job.status}")
+            continue
+
+        if once:
+            return
+        # no dejar la sesión con una transacción abierta mientras esperamos
+        db.session.remove()
+        time.sleep(poll_interval)
+
+
+# ---------------------------
+# Tareas
+# ---------------------------
+@handler("import_products")
+def run_import_products(payload, report):
+    if payload.get("replace"):
+        importer.clear_products()
+        db.session.commit()
+        bump_catalog_generation()
+
+    source = importer.make_source(
+        max_items=payload.get("limit"),
+        page_size=payload.get("page_size", importer.DEFAULT_PAGE_SIZE),
+    )
+    stats = importer.ImportStats()
+    try:
+        importer.import_products(
+            source,
+            chunk_size=payload.get("chunk_size", importer.DEFAULT_CHUNK_SIZE),
+            on_progress=lambda st: report(st.to_dict()),
+            stats=stats,
+            upsert=payload.get("mode") == "upsert",
+        )
+    finally:
+        bump_catalog_generation()
+    return stats.to_dict()
+
+
+@handler("stripe_event")
+def run_stripe_event(payload, report):
+    return stripe_events.process_event(payload["event_id"])
@@ -0,0 +1,462 @@
+"""
+Pruebas de carga reproducibles de la API (la app Flask real, no funciones sueltas).
+
+    flask loadtest --mix browse,cart --mode wsgi --requests 2000 --output base.json
+    flask loadtest --mix all --mode gunicorn --workers 4 --concurrency 16 --output new.json
+    flask loadtest-compare base.json new.json
+
+Cada mezcla se ejecuta sobre una BD desechable recién sembrada (por defecto un
+SQLite en /tmp; se borran sus tablas) con los tamaños pedidos y la misma semilla,
+así que dos ejecuciones con los mismos parámetros hacen exactamente las mismas
+peticiones. Modos:
+- wsgi: un proceso hijo importa la app y le habla con el cliente de pruebas de
+  Flask desde `concurrency` hilos (sin red; mide el coste de la aplicación).
+- gunicorn: arranca `gunicorn wsgi` en localhost con `workers` procesos y le
+  habla por HTTP con keep-alive.
+En ambos Stripe es el servidor falso de fake_stripe.py, y la app responde con
+la cabecera Server-Timing (METRICS_SERVER_TIMING=1): de ahí salen las sentencias
+SQL y el tiempo en BD de cada petición.
+
+Resultado: req/s global y, por endpoint, peticiones, errores, p50/p95/p99 y
+sentencias SQL (media y máximo), en un JSON que loadtest-compare enfrenta a otro.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import subprocess
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from src.api.models import db
+from src.api import benchmarks, search, passwords, fake_stripe
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+DEFAULT_LOADTEST_URL = "sqlite:////tmp/marketly-loadtest.db"
+LOADTEST_PASSWORD = "loadtest-password"
+
+DEFAULT_SIZES = {"users": 200, "products": 5000, "cart_items": 1000, "orders": 2000}
+
+# mezcla -> [(peso, acción)]
+MIXES = {
+    "browse": [(40, "list_products"), (30, "product_detail"), (20, "search"), (10, "cart_summary")],
+    "cart": [(30, "cart_add"), (25, "cart_patch"), (20, "cart_view"), (25, "cart_summary")],
+    "login": [(80, "login"), (20, "me")],
+    "checkout": [(60, "checkout"), (20, "orders"), (20, "cart_summary")],
+    "mixed": [(25, "list_products"), (20, "product_detail"), (15, "search"), (10, "cart_add"),
+              (5, "cart_patch"), (5, "cart_view"), (10, "cart_summary"), (3, "login"), (4, "checkout"),
+              (3, "orders")],
+}
+
+_SERVER_TIMING_SQL = re.compile(r'sql;dur=([\d.]+);desc="(\d+)"')
+
+
+# ---------------------------
+# Datos
+# ---------------------------
+def seed_app_data(engine, users, products, cart_items, orders, seed=42):
+    """Usuarios con contraseña real, catálogo con títulos buscables, carritos y pedidos pagados."""
+    rng = random.Random(seed)
+    benchmarks.reset_schema(engine)
+    benchmarks.seed_search_products(engine, products, rng)
+    # un solo hash para todos: sembrar miles de usuarios con scrypt llevaría minutos
+    password = passwords.hash_password(LOADTEST_PASSWORD)
+    per_user = max(0, min(products, cart_items // max(1, users)))
+    t = db.metadata.tables
+
+    with engine.begin() as conn:
+        benchmarks._insert_chunks(conn, t["user"], ({
+            "id": u, "email": f"load{u}@bench.test", "password": password, "is_active": True,
+            "created_at": benchmarks.BASE_DATE,
+        } for u in range(1, users + 1)))
+        benchmarks._insert_chunks(conn, t["cart_item"], ({
+            "user_id": u, "product_id": (u * 7919 + k) % products + 1, "quantity": 1 + k % 3,
+            "created_at": benchmarks.BASE_DATE,
+        } for u in range(1, users + 1) for k in range(per_user)))
+        benchmarks._insert_chunks(conn, t["order"], ({
+            "id": o, "user_id": o % users + 1, "total_cents": 3000, "status": "paid",
+            "created_at": benchmarks.BASE_DATE,
+        } for o in range(1, orders + 1)))
+        benchmarks._insert_chunks(conn, t["order_item"], ({
+            "order_id": o, "product_id": (o * 31 + k) % products + 1, "quantity": 1,
+            "unit_price_cents": 1000, "product_title": f"Producto {(o * 31 + k) % products + 1}",
+        } for o in range(1, orders + 1) for k in range(3)))
+        search.ensure_search_index(conn)
+        search.rebuild_search_index(conn)
+    if engine.dialect.name in ("sqlite", "postgresql"):
+        benchmarks.analyze(engine)
+    return {"users": users, "products": products, "cart_items": users * per_user, "orders": orders}
+
+
+# ---------------------------
+# Clientes
+# ---------------------------
+class Recorder:
+    """Peticiones de un hilo: (endpoint, status, ms, sentencias SQL, ms en SQL)."""
+
+    def __init__(self):
+        self.samples = []
+
+    def add(self, endpoint, status, ms, headers):
+        match = _SERVER_TIMING_SQL.search(headers.get("Server-Timing", ""))
+        sql_ms, sql = (float(match.group(1)), int(match.group(2))) if match else (None, None)
+        self.samples.append((endpoint, status, ms, sql, sql_ms))
+
+
+class WSGIClient:
+    """Cliente de pruebas de Flask: la petición pasa por toda la app, sin socket."""
+
+    def __init__(self, app, recorder):
+        self.client = app.test_client()
+        self.recorder = recorder
+
+    def call(self, endpoint, method, path, json=None, headers=None):
+        t0 = time.perf_counter()
+        response = self.client.open(path, method=method, json=json, headers=headers)
+        ms = (time.perf_counter() - t0) * 1000
+        self.recorder.add(endpoint, response.status_code, ms, response.headers)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HTTPClient:
+    def __init__(self, base_url, recorder):
+        import requests
+        self.session = requests.Session()
+        self.base_url = base_url
+        self.recorder = recorder
+
+    def call(self, endpoint, method, path, json=None, headers=None):
+        t0 = time.perf_counter()
+        response = self.session.request(method, self.base_url + path, json=json, headers=headers, timeout=60)
+        ms = (time.perf_counter() - t0) * 1000
+        self.recorder.add(endpoint, response.status_code, ms, response.headers)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+
+# ---------------------------
+# Acciones (una o varias peticiones)
+# ---------------------------
+class VirtualUser:
+    def __init__(self, client, user_id, sizes, rng):
+        self.client = client
+        self.user_id = user_id
+        self.email = f"load{user_id}@bench.test"
+        self.sizes = sizes
+        self.rng = rng
+        self.token = None
+
+    @property
+    def auth(self):
+        return {"Authorization": f"Bearer {self.token}"}
+
+    def random_product(self):
+        return self.rng.randint(1, self.sizes["products"])
+
+    def login(self):
+        status, body = self.client.call("POST /api/login", "POST", "/api/login",
+                                        json={"email": self.email, "password": LOADTEST_PASSWORD})
+        if status == 200:
+            self.token = body["access_token"]
+
+    def me(self):
+        self.client.call("GET /api/me", "GET", "/api/me", headers=self.auth)
+
+    def list_products(self):
+        status, body = self.client.call("GET /api/products", "GET", "/api/products?limit=20")
+        if status == 200 and body.get("next_cursor") and self.rng.random() < 0.3:
+            self.client.call("GET /api/products", "GET", f"/api/products?limit=20&cursor={body['next_cursor']}")
+
+    def product_detail(self):
+        self.client.call("GET /api/products/<int:product_id>", "GET", f"/api/products/{self.random_product()}")
+
+    def search(self):
+        q = self.rng.choice(benchmarks.SEARCH_QUERIES)
+        self.client.call("GET /api/products/search", "GET", f"/api/products/search?q={q}&limit=20")
+
+    def cart_add(self):
+        self.client.call("POST /api/cart-items", "POST", "/api/cart-items", headers=self.auth,
+                         json={"product_id": self.random_product(), "quantity": 1})
+
+    def cart_view(self):
+        self.client.call("GET /api/cart-items", "GET", "/api/cart-items", headers=self.auth)
+
+    def cart_summary(self):
+        self.client.call("GET /api/cart/summary", "GET", "/api/cart/summary", headers=self.auth)
+
+    def cart_patch(self):
+        status, lines = self.client.call("GET /api/cart-items", "GET", "/api/cart-items?view=compact",
+                                         headers=self.auth)
+        if status != 200 or not lines:
+            return self.cart_add()
+        line = self.rng.choice(lines)
+        op = ({"op": "remove", "id": line["id"]} if self.rng.random() < 0.3
+              else {"op": "set", "id": line["id"], "quantity": self.rng.randint(1, 3)})
+        self.client.call("PATCH /api/cart-items", "PATCH", "/api/cart-items", headers=self.auth,
+                         json={"operations": [op, {"op": "add", "product_id": self.random_product()}]})
+
+    def checkout(self):
+        self.cart_add()
+        status, body = self.client.call("POST /api/checkout-session", "POST", "/api/checkout-session",
+                                        headers=self.auth)
+        if status != 200:
+            return
+        session_id = body["url"].rsplit("/", 1)[1]
+        self.client.call("POST /api/checkout/success", "POST", "/api/checkout/success", headers=self.auth,
+                         json={"session_id": session_id})
+
+    def orders(self):
+        self.client.call("GET /api/orders", "GET", "/api/orders?limit=20", headers=self.auth)
+
+
+def drive(make_client, mix, requests, concurrency, sizes, seed=42, warmup=50):
+    """Lanza `requests` acciones de la mezcla repartidas en `concurrency` hilos. Devuelve las muestras."""
+    weights, actions = zip(*((w, a) for w, a in MIXES[mix]))
+    if concurrency > sizes["users"]:
+        raise ValueError("hacen falta al menos tantos usuarios como hilos (cada hilo usa el suyo)")
+
+    def worker(index, n, record=True):
+        recorder = Recorder()
+        rng = random.Random(seed * 1000 + index)
+        user = VirtualUser(make_client(recorder), index + 1, sizes, rng)
+        user.login()
+        recorder.samples.clear()
+        for _ in range(n):
+            getattr(user, rng.choices(actions, weights)[0])()
+        return recorder.samples if record else []
+
+    # calentamiento (cachés, pool de conexiones, índice en memoria...): no se mide
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda i: worker(i, max(1, warmup // concurrency), record=False), range(concurrency)))
+
+    share = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        per_worker = list(executor.map(lambda i: worker(i, share[i]), range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return [sample for samples in per_worker for sample in samples], elapsed
+
+
+def summarize(samples, elapsed):
+    by_endpoint = {}
+    for endpoint, status, ms, sql, sql_ms in samples:
+        by_endpoint.setdefault(endpoint, []).append((status, ms, sql, sql_ms))
+
+    endpoints = []
+    for endpoint, rows in sorted(by_endpoint.items()):
+        timings = [ms for _, ms, _, _ in rows]
+        sql = [n for _, _, n, _ in rows if n is not None]
+        sql_ms = [t for _, _, _, t in rows if t is not None]
+        endpoints.append({
+            "endpoint": endpoint,
+            "requests": len(rows),
+            "errors": sum(1 for status, _, _, _ in rows if status >= 500),
+            "client_errors": sum(1 for status, _, _, _ in rows if 400 <= status < 500),
+            "req_per_sec": round(len(rows) / elapsed, 1),
+            **benchmarks.percentiles(timings),
+            "sql_avg": round(sum(sql) / len(sql), 2) if sql else None,
+            "sql_max": max(sql) if sql else None,
+            "sql_ms_avg": round(sum(sql_ms) / len(sql_ms), 3) if sql_ms else None,
+        })
+    return {
+        "requests": len(samples),
+        "elapsed_s": round(elapsed, 3),
+        "req_per_sec": round(len(samples) / elapsed, 1) if elapsed else None,
+        "errors": sum(e["errors"] for e in endpoints),
+        **(benchmarks.percentiles([s[2] for s in samples]) if samples else {}),
+        "endpoints": endpoints,
+    }
+
+
+# ---------------------------
+# Modos
+# ---------------------------
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def target_env(url, stripe_base, extra=None):
+    """Entorno de la app bajo prueba: BD, caché y métricas propias, Stripe falso."""
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": url,
+        "CACHE_BACKEND": "sqlite",
+        "CACHE_SQLITE_PATH": "/tmp/marketly-loadtest-cache.db",
+        "METRICS_BACKEND": "memory",
+        "METRICS_SERVER_TIMING": "1",
+        "STRIPE_SECRET_KEY": "sk_test_fake",
+        "STRIPE_API_BASE": stripe_base,
+        "FRONTEND_URL": "http://localhost:3000",
+        "PYTHONPATH": ROOT,
+    })
+    env.pop("JOBS_RUN_INLINE", None)
+    env.update(extra or {})
+    return env
+
+
+def _reset_cache_file(env):
+    for suffix in ("", "-wal", "-shm"):
+        path = env["CACHE_SQLITE_PATH"] + suffix
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def run_wsgi(env, mix, requests, concurrency, sizes, seed):
+    """La carga se genera en un proceso hijo que importa la app con el entorno de prueba."""
+    job = json.dumps({"mix": mix, "requests": requests, "concurrency": concurrency, "sizes": sizes, "seed": seed})
+    out = subprocess.run([sys.executable, "-m", "src.api.loadtest"], input=job, capture_output=True,
+                         text=True, env=env, cwd=ROOT)
+    if out.returncode != 0:
+        raise RuntimeError(f"el proceso de carga falló:\n{out.stderr[-4000:]}")
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    return [tuple(sample) for sample in result["samples"]], result["elapsed"]
+
+
+def _wsgi_child():
+    job = json.loads(sys.stdin.read())
+    from src.app import app
+
+    samples, elapsed = drive(lambda recorder: WSGIClient(app, recorder), job["mix"], job["requests"],
+                             job["concurrency"], job["sizes"], seed=job["seed"])
+    print(json.dumps({"samples": samples, "elapsed": elapsed}))
+
+
+def run_gunicorn(env, mix, requests, concurrency, sizes, seed, workers=2, threads=1):
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        ["gunicorn", "wsgi", "--chdir", os.path.join(ROOT, "src"), "-b", f"127.0.0.1:{port}",
+         "-w", str(workers), "--threads", str(threads), "--log-level", "warning"],
+        env=env, cwd=ROOT,
+    )
+    try:
+        _wait_ready(base_url, server)
+        return drive(lambda recorder: HTTPClient(base_url, recorder), mix, requests, concurrency, sizes, seed=seed)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def _wait_ready(base_url, server, timeout=30):
+    import requests as http
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn terminó al arrancar")
+        try:
+            if http.get(f"{base_url}/api/hello", timeout=1).status_code == 200:
+                return
+        except http.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("gunicorn no respondió a tiempo")
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=ROOT, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(mixes=("browse",), mode="wsgi", requests=1000, concurrency=8, sizes=None, url=None, seed=42,
+        workers=2, threads=1, stripe_latency_ms=0, echo=print):
+    url = (url or DEFAULT_LOADTEST_URL).replace("postgres://", "postgresql://")
+    sizes = {**DEFAULT_SIZES, **(sizes or {})}
+    engine = benchmarks.make_engine(url)
+    stripe_server, _ = fake_stripe.serve(port=0, latency_ms=stripe_latency_ms)
+    env = target_env(url, f"http://127.0.0.1:{stripe_server.server_address[1]}")
+    results = []
+    try:
+        for mix in mixes:
+            echo(f"[{mix}] sembrando {sizes} ...")
+            seed_app_data(engine, seed=seed, **sizes)
+            engine.dispose()
+            _reset_cache_file(env)
+            echo(f"[{mix}] {requests} acciones, {concurrency} hilos, modo {mode} ...")
+            if mode == "gunicorn":
+                samples, elapsed = run_gunicorn(env, mix, requests, concurrency, sizes, seed, workers, threads)
+            else:
+                samples, elapsed = run_wsgi(env, mix, requests, concurrency, sizes, seed)
+            summary = summarize(samples, elapsed)
+            results.append({"mix": mix, **summary})
+            echo(f"  {summary['requests']} peticiones en {summary['elapsed_s']}s: "
+                 f"{summary['req_per_sec']} req/s, p50 {summary.get('p50_ms')} ms, p99 {summary.get('p99_ms')} ms, "
+                 f"{summary['errors']} errores 5xx")
+    finally:
+        stripe_server.shutdown()
+        engine.dispose()
+
+    return {
+        "benchmark": "loadtest",
+        "revision": _git_revision(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "mode": mode,
+        "workers": workers if mode == "gunicorn" else None,
+        "dialect": engine.dialect.name,
+        "sizes": sizes,
+        "requests": requests,
+        "concurrency": concurrency,
+        "seed": seed,
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+
+
+# ---------------------------
+# Comparación
+# ---------------------------
+def _change(before, after):
+    if not before or after is None:
+        return None
+    return round((after - before) / before * 100, 1)
+
+
+def compare(base, new):
+    """Por mezcla y endpoint: req/s, p50, p95 y SQL antes/después (y % de cambio)."""
+    rows = []
+    base_results = {r["mix"]: r for r in base["results"]}
+    for result in new["results"]:
+        old = base_results.get(result["mix"])
+        if old is None:
+            continue
+        old_endpoints = {e["endpoint"]: e for e in old["endpoints"]}
+        for endpoint in [{"endpoint": "(total)", **result}] + result["endpoints"]:
+            before = old_endpoints.get(endpoint["endpoint"]) if endpoint["endpoint"] != "(total)" else old
+            if before is None:
+                continue
+            rows.append({
+                "mix": result["mix"],
+                "endpoint": endpoint["endpoint"],
+                **{f"{key}_before": before.get(key) for key in ("req_per_sec", "p50_ms", "p95_ms", "sql_avg")},
+                **{f"{key}_after": endpoint.get(key) for key in ("req_per_sec", "p50_ms", "p95_ms", "sql_avg")},
+                "req_per_sec_change_pct": _change(before.get("req_per_sec"), endpoint.get("req_per_sec")),
+                "p95_change_pct": _change(before.get("p95_ms"), endpoint.get("p95_ms")),
+            })
+    return rows
+
+
+def format_comparison(rows):
+    lines = [f"{'mezcla':<9} {'endpoint':<38} {'req/s':>17} {'p50 ms':>17} {'p95 ms':>17} {'sql':>11}"]
+    for r in rows:
+        def pair(key, fmt="{:.1f}"):
+            before, after = r[f"{key}_before"], r[f"{key}_after"]
+
+            def show(v):
+                return "-" if v is None else fmt.format(v)
+            return f"{show(before)} -> {show(after)}"
+        lines.append(f"{r['mix']:<9} {r['endpoint'][:38]:<38} {pair('req_per_sec'):>17} {pair('p50_ms'):>17} "
+                     f"{pair('p95_ms'):>17} {pair('sql_avg'):>11}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    _wsgi_child()
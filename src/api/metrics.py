@@ -0,0 +1,376 @@
+"""
+Métricas por petición en formato Prometheus (GET /api/metrics).
+
+setup_metrics(app) (en app.py) mide cada petición:
+- latencia (histograma) y peticiones por ruta, método y código,
+- nº de sentencias SQL (histograma) y tiempo en la BD, con eventos del engine de `db`,
+- bytes de respuesta (las respuestas en streaming no tienen tamaño conocido y no suman),
+- tiempo en llamadas externas (Stripe, DummyJSON) medido por outbound.py.
+outbound.py además alimenta un histograma por servicio externo.
+
+Varios workers de gunicorn: cada proceso acumula en memoria y cada
+METRICS_FLUSH_INTERVAL segundos vuelca su foto a un SQLite compartido (una fila
+por proceso, como SQLiteCache). Quien responde a /api/metrics suma las filas de
+todos los procesos de la máquina, incluido el worker de tareas. La fila de un
+proceso que ya no existe (su pid no está vivo) se borra al leer: tras reiniciar
+un worker los contadores bajan y Prometheus lo trata como un reinicio. Las filas
+que nadie actualiza en METRICS_RETENTION segundos se borran igualmente (pid
+reutilizado). Con METRICS_BACKEND=memory solo se ve el proceso actual.
+
+/api/metrics exige "Authorization: Bearer <METRICS_TOKEN>" (bearer_token en la
+configuración de Prometheus); sin METRICS_TOKEN el endpoint responde 404.
+
+Con METRICS_SERVER_TIMING=1 cada respuesta lleva además una cabecera
+Server-Timing (sql, outbound y app, en ms; el nº de sentencias en desc). La
+usa `flask loadtest` para saber las sentencias de cada petición; no conviene
+dejarla activa en producción (da pistas del coste de cada ruta).
+"""
+import os
+import json
+import hmac
+import time
+import bisect
+import sqlite3
+import threading
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from src.api.models import db
+
+PREFIX = "marketly"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# nombre -> (tipo, ayuda, buckets de los histogramas)
+METRICS = {
+    "http_requests_total": ("counter", "Peticiones HTTP atendidas.", None),
+    "http_request_duration_seconds": ("histogram", "Latencia de las peticiones HTTP.", LATENCY_BUCKETS),
+    "http_request_sql_statements": ("histogram", "Sentencias SQL por petición.", SQL_COUNT_BUCKETS),
+    "http_request_sql_seconds_total": ("counter", "Tiempo en la base de datos durante las peticiones.", None),
+    "http_response_bytes_total": ("counter", "Bytes de respuesta enviados.", None),
+    "http_request_outbound_seconds_total": ("counter", "Tiempo en servicios externos durante las peticiones.", None),
+    "outbound_calls_total": ("counter", "Llamadas a servicios externos.", None),
+    "outbound_call_duration_seconds": ("histogram", "Latencia de las llamadas a servicios externos.",
+                                       LATENCY_BUCKETS),
+    "slow_queries_total": ("counter", "Sentencias SQL por encima de SLOW_QUERY_MS (ver profiling.py).", None),
+    "metrics_processes": ("gauge", "Procesos cuyas métricas se han sumado.", None),
+}
+
+FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", 5))
+SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "").lower() in ("1", "true", "yes")
+RETENTION = int(os.getenv("METRICS_RETENTION", 7 * 24 * 3600))
+TOKEN = os.getenv("METRICS_TOKEN", "")
+
+
+class Registry:
+    """
+    Contadores e histogramas de un proceso. Un histograma se guarda como
+    [n por bucket..., n en +Inf, suma] (sin acumular: se acumula al exportar).
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][2]
+        key = (name, labels)
+        with self._lock:
+            hist = self._values.get(key)
+            if hist is None:
+                hist = self._values[key] = [0] * (len(buckets) + 2)
+            hist[bisect.bisect_left(buckets, value)] += 1
+            hist[-1] += value
+
+    def snapshot(self):
+        """Lista serializable a JSON: [[nombre, [[etiqueta, valor], ...], valor], ...]."""
+        with self._lock:
+            return [[name, [list(pair) for pair in labels], list(value) if isinstance(value, list) else value]
+                    for (name, labels), value in self._values.items()]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+def merge(snapshots):
+    """Suma fotos de varios procesos. Devuelve {(nombre, etiquetas): valor}."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            if isinstance(value, list):
+                current = merged.setdefault(key, [0] * len(value))
+                for i, v in enumerate(value):
+                    current[i] += v
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def render(values):
+    """Formato de texto de Prometheus (0.0.4)."""
+    by_name = {}
+    for (name, labels), value in values.items():
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name in METRICS:
+        if name not in by_name:
+            continue
+        kind, help_text, buckets = METRICS[name]
+        full = f"{PREFIX}_{name}"
+        lines.append(f"# HELP {full} {help_text}")
+        lines.append(f"# TYPE {full} {kind}")
+        for labels, value in sorted(by_name[name]):
+            if kind != "histogram":
+                lines.append(f"{full}{_labels(labels)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, value):
+                cumulative += count
+                lines.append(f"{full}_bucket{_labels(labels, [('le', _number(float(bound)))])} {cumulative}")
+            cumulative += value[len(buckets)]
+            lines.append(f"{full}_bucket{_labels(labels, [('le', '+Inf')])} {cumulative}")
+            lines.append(f"{full}_sum{_labels(labels)} {_number(float(value[-1]))}")
+            lines.append(f"{full}_count{_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+class SQLiteStore:
+    """Una fila por proceso con su última foto, en un fichero compartido por los workers."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS metrics_process ("
+            "process TEXT PRIMARY KEY, snapshot TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def save(self, process, snapshot):
+        self._conn().execute(
+            "INSERT OR REPLACE INTO metrics_process (process, snapshot, updated_at) VALUES (?, ?, ?)",
+            (process, json.dumps(snapshot), time.time()),
+        )
+
+    def load(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM metrics_process WHERE updated_at < ?", (time.time() - RETENTION,))
+        snapshots = []
+        for process, snapshot in conn.execute("SELECT process, snapshot FROM metrics_process").fetchall():
+            if _alive(process):
+                snapshots.append(json.loads(snapshot))
+            else:
+                conn.execute("DELETE FROM metrics_process WHERE process = ?", (process,))
+        return snapshots
+
+    def clear(self):
+        self._conn().execute("DELETE FROM metrics_process")
+
+
+def _alive(process):
+    """¿Sigue vivo el proceso de la clave "<pid>-<arranque>"? (mismo host: el fichero es local)"""
+    try:
+        os.kill(int(process.split("-", 1)[0]), 0)
+    except ProcessLookupError:
+        return False
+    except (ValueError, PermissionError):
+        # clave ajena o proceso de otro usuario: existe
+        return True
+    return True
+
+
+def make_store():
+    backend = os.getenv("METRICS_BACKEND", "sqlite").lower()
+    if backend == "memory":
+        return None
+    if backend == "sqlite":
+        return SQLiteStore(os.getenv("METRICS_SQLITE_PATH", "/tmp/marketly-metrics.db"))
+    raise ValueError(f"METRICS_BACKEND desconocido: {backend}")
+
+
+registry = Registry()
+store = make_store()
+
+_process = None
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def _process_key():
+    """Id de este proceso. Tras un fork (gunicorn --preload) se empieza de cero."""
+    global _process
+    pid = os.getpid()
+    if _process is None or _process[0] != pid:
+        if _process is not None:
+            registry.clear()
+        _process = (pid, f"{pid}-{time.time():.0f}")
+    return _process[1]
+
+
+def flush(force=False):
+    """Vuelca la foto de este proceso al almacén compartido (como mucho cada FLUSH_INTERVAL)."""
+    global _last_flush
+    if store is None:
+        return
+    key = _process_key()
+    now = time.monotonic()
+    if not force and now - _last_flush < FLUSH_INTERVAL:
+        return
+    with _flush_lock:
+        _last_flush = now
+        store.save(key, registry.snapshot())
+
+
+def collect():
+    """Métricas de todos los procesos en formato Prometheus."""
+    if store is None:
+        snapshots = [registry.snapshot()]
+    else:
+        flush(force=True)
+        snapshots = store.load()
+    values = merge(snapshots)
+    values[("metrics_processes", ())] = len(snapshots)
+    return render(values)
+
+
+def authorized(header):
+    """Cabecera Authorization de la petición a /api/metrics frente a METRICS_TOKEN."""
+    scheme, _, token = (header or "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.strip(), TOKEN)
+
+
+def reset():
+    registry.clear()
+    if store is not None:
+        store.clear()
+
+
+# ---------------------------
+# Observaciones
+# ---------------------------
+class _RequestStats:
+    __slots__ = ("start", "sql_statements", "sql_seconds", "outbound_seconds")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.outbound_seconds = 0.0
+
+
+def _current():
+    if not has_request_context():
+        return None
+    return g.get("_metrics")
+
+
+def observe_outbound(name, ms, ok):
+    """Lo llama outbound.record() en cada llamada externa."""
+    seconds = ms / 1000
+    _process_key()
+    registry.inc("outbound_calls_total", (("name", name), ("result", "ok" if ok else "error")))
+    registry.observe("outbound_call_duration_seconds", (("name", name),), seconds)
+    stats = _current()
+    if stats is not None:
+        stats.outbound_seconds += seconds
+    else:
+        # fuera de una petición (worker de tareas): que también llegue al almacén compartido
+        flush()
+
+
+# el inicio va en el contexto de ejecución de cada sentencia: si falla no queda
+# nada colgando en la conexión (que vuelve al pool) para emparejar con la siguiente
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current() is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _observe_statement(context):
+    stats = _current()
+    started = getattr(context, "_metrics_started", None)
+    if stats is None or started is None:
+        return
+    context._metrics_started = None
+    stats.sql_statements += 1
+    stats.sql_seconds += time.perf_counter() - started
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _observe_statement(context)
+
+
+def _handle_error(exception_context):
+    # una sentencia que falla también cuenta (y su tiempo)
+    if exception_context.execution_context is not None:
+        _observe_statement(exception_context.execution_context)
+
+
+def setup_metrics(app):
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+            event.listen(engine, "handle_error", _handle_error)
+
+    @app.before_request
+    def start_request_metrics():
+        g._metrics = _RequestStats()
+
+    @app.after_request
+    def record_request_metrics(response):
+        stats = g.pop("_metrics", None)
+        if stats is None:
+            return response
+        _process_key()
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        labels = (("route", route), ("method", request.method))
+        registry.inc("http_requests_total", labels + (("status", str(response.status_code)),))
+        elapsed = time.perf_counter() - stats.start
+        registry.observe("http_request_duration_seconds", labels, elapsed)
+        registry.observe("http_request_sql_statements", labels, stats.sql_statements)
+        registry.inc("http_request_sql_seconds_total", labels, stats.sql_seconds)
+        registry.inc("http_request_outbound_seconds_total", labels, stats.outbound_seconds)
+        size = response.content_length
+        if size is None and not response.is_streamed:
+            size = response.calculate_content_length()
+        registry.inc("http_response_bytes_total", labels, size or 0)
+        if SERVER_TIMING:
+            response.headers["Server-Timing"] = (
+                f'sql;dur={stats.sql_seconds * 1000:.2f};desc="{stats.sql_statements}", '
+                f"outbound;dur={stats.outbound_seconds * 1000:.2f}, app;dur={elapsed * 1000:.2f}"
+            )
+        flush()
+        return response
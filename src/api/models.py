@@ -1,5 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String, Boolean, Text, Integer, ForeignKey, DateTime
+from sqlalchemy import String, Boolean, Text, Integer, ForeignKey, DateTime, Index, JSON
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from datetime import datetime, timezone
 
@@ -50,16 +50,43 @@ class User(db.Model):
 # Producto
 # -----------------------------
 class Product(db.Model):
+    __table_args__ = (
+        # paginación keyset del listado
+        Index("ix_product_created_at_id", "created_at", "id"),
+        # un producto por id del feed de origen (importador en modo upsert)
+        Index("ix_product_external_source_external_id", "external_source", "external_id", unique=True),
+    )
+
     id: Mapped[int] = mapped_column(primary_key=True)
     title: Mapped[str] = mapped_column(String(200), nullable=False)
     description: Mapped[str] = mapped_column(Text)
     price_cents: Mapped[int] = mapped_column(Integer, nullable=False)
     image_url: Mapped[str] = mapped_column(String(500))
+
+    # origen del producto si vino de un importador (ej. "dummyjson", "42")
+    external_source: Mapped[str] = mapped_column(String(50), nullable=True)
+    external_id: Mapped[str] = mapped_column(String(100), nullable=True)
+    # hash del contenido importado, para no reescribir filas sin cambios
+    content_hash: Mapped[str] = mapped_column(String(40), nullable=True)
+
+    # unidades disponibles (NULL = sin control de stock). Si stock_buckets > 0 el
+    # producto está repartido en product_stock_bucket y el disponible es stock + buckets
+    stock: Mapped[int] = mapped_column(Integer, nullable=True)
+    stock_buckets: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
         default=lambda: datetime.now(timezone.utc),
         nullable=False
     )
+    # versión de la fila (ETag / Last-Modified)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+        nullable=False,
+        index=True
+    )
 
     cart_items: Mapped[list["CartItem"]] = relationship(
         back_populates="product", cascade="all, delete-orphan"
@@ -70,24 +97,40 @@ class Product(db.Model):
         back_populates="product"
     )
 
-    def serialize(self):
-        return {
-            "id": self.id,
-            "title": self.title,
-            "description": self.description,
-            "price_cents": self.price_cents,
-            "image_url": self.image_url,
-            "created_at": self.created_at.isoformat() if self.created_at else None,
-        }
+    # stock repartido (ver inventory.py)
+    buckets: Mapped[list["ProductStockBucket"]] = relationship(cascade="all, delete-orphan")
+    reservations: Mapped[list["StockReservation"]] = relationship(cascade="all, delete-orphan")
+
+    # Campos que se pueden pedir con ?fields= en el listado
+    SERIALIZABLE_FIELDS = ("id", "title", "description", "price_cents", "image_url", "created_at", "updated_at")
+
+    def serialize(self, fields=None):
+        if fields is None:
+            fields = self.SERIALIZABLE_FIELDS
+        # solo se leen los atributos pedidos (description no se carga si no hace falta)
+        data = {}
+        for name in self.SERIALIZABLE_FIELDS:
+            if name not in fields:
+                continue
+            value = getattr(self, name)
+            if name in ("created_at", "updated_at"):
+                value = value.isoformat() if value else None
+            data[name] = value
+        return data
 
 
 # -----------------------------
 # CartItem
 # -----------------------------
 class CartItem(db.Model):
+    __table_args__ = (
+        # una línea por (usuario, producto); también sirve para buscar por user_id
+        Index("ix_cart_item_user_id_product_id", "user_id", "product_id", unique=True),
+    )
+
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False)
-    product_id: Mapped[int] = mapped_column(ForeignKey("product.id"), nullable=False)
+    product_id: Mapped[int] = mapped_column(ForeignKey("product.id"), nullable=False, index=True)
     quantity: Mapped[int] = mapped_column(Integer, default=1)
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
@@ -112,14 +155,27 @@ class CartItem(db.Model):
 # Order
 # -----------------------------
 class Order(db.Model):
+    __table_args__ = (
+        # historial de pedidos del usuario paginado por id (keyset)
+        Index("ix_order_user_id_id", "user_id", "id"),
+        # el webhook de Stripe localiza el pedido por su sesión de Checkout
+        Index("ix_order_stripe_session_id", "stripe_session_id", unique=True),
+    )
+
     id: Mapped[int] = mapped_column(primary_key=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), nullable=False)
 
     # total en céntimos para evitar problemas de decimales
     total_cents: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
 
+    # pending -> processing -> paid -> refunded; pending/processing -> failed; pending -> expired
+    # (las transiciones las aplica el webhook de Stripe, ver stripe_events.py)
     status: Mapped[str] = mapped_column(String(30), nullable=False, default="paid")
 
+    # sesión de Stripe Checkout y pago asociado
+    stripe_session_id: Mapped[str] = mapped_column(String(255), nullable=True)
+    stripe_payment_intent: Mapped[str] = mapped_column(String(255), nullable=True, index=True)
+
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True),
         default=lambda: datetime.now(timezone.utc),
@@ -130,6 +186,7 @@ class Order(db.Model):
     items: Mapped[list["OrderItem"]] = relationship(
         back_populates="order", cascade="all, delete-orphan"
     )
+    reservations: Mapped[list["StockReservation"]] = relationship(cascade="all, delete-orphan")
 
     def serialize(self):
         return {
@@ -141,20 +198,36 @@ class Order(db.Model):
             "items": [it.serialize() for it in self.items],
         }
 
+    def summary(self, item_count):
+        """Sin recorrer items: el número de líneas se calcula aparte (COUNT o rowcount)."""
+        return {
+            "id": self.id,
+            "user_id": self.user_id,
+            "total_cents": self.total_cents,
+            "status": self.status,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "item_count": item_count,
+        }
+
 
 # -----------------------------
 # OrderItem
 # -----------------------------
 class OrderItem(db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
-    order_id: Mapped[int] = mapped_column(ForeignKey("order.id"), nullable=False)
-    product_id: Mapped[int] = mapped_column(ForeignKey("product.id"), nullable=False)
+    order_id: Mapped[int] = mapped_column(ForeignKey("order.id"), nullable=False, index=True)
+    # NULL si el producto se borró después: el pedido conserva su copia
+    product_id: Mapped[int] = mapped_column(ForeignKey("product.id"), nullable=True, index=True)
 
     quantity: Mapped[int] = mapped_column(Integer, nullable=False, default=1)
 
     # guardamos el precio en el momento de compra
     unit_price_cents: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
 
+    # copia del producto al comprar: el historial no vuelve a la tabla product
+    product_title: Mapped[str] = mapped_column(String(200), nullable=False, default="")
+    product_image_url: Mapped[str] = mapped_column(String(500), nullable=True)
+
     order: Mapped["Order"] = relationship(back_populates="items")
     product: Mapped["Product"] = relationship(back_populates="order_items")
 
@@ -165,5 +238,132 @@ class OrderItem(db.Model):
             "product_id": self.product_id,
             "quantity": self.quantity,
             "unit_price_cents": self.unit_price_cents,
-            "product": self.product.serialize() if self.product else None,
+            "subtotal_cents": self.unit_price_cents * self.quantity,
+            "product_title": self.product_title,
+            "product_image_url": self.product_image_url,
+        }
+
+
+# -----------------------------
+# Job (tareas en segundo plano, ver jobs.py)
+# -----------------------------
+class Job(db.Model):
+    __table_args__ = (
+        # el worker busca la siguiente tarea en cola por estado
+        Index("ix_job_status_id", "status", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    kind: Mapped[str] = mapped_column(String(50), nullable=False)
+
+    # queued -> running -> succeeded / failed
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="queued")
+
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False, default=dict)
+    progress: Mapped[dict] = mapped_column(JSON, nullable=True)
+    result: Mapped[dict] = mapped_column(JSON, nullable=True)
+    error: Mapped[str] = mapped_column(Text, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        nullable=False
+    )
+    started_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+    finished_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+    # latido del worker mientras la tarea corre (para detectar workers muertos)
+    heartbeat_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "payload": self.payload,
+            "progress": self.progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
         }
+
+
+# -----------------------------
+# Eventos de Stripe (webhook)
+# -----------------------------
+class StripeEvent(db.Model):
+    """Registro append-only de los eventos recibidos: nunca se modifica una fila."""
+
+    __table_args__ = (
+        # id del evento en Stripe: el índice único descarta los reenvíos
+        Index("ix_stripe_event_event_id", "event_id", unique=True),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    event_id: Mapped[str] = mapped_column(String(255), nullable=False)
+    type: Mapped[str] = mapped_column(String(100), nullable=False)
+    # cuerpo tal y como llegó (el que se firmó)
+    payload: Mapped[str] = mapped_column(Text, nullable=False)
+
+    received_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        nullable=False
+    )
+
+    def serialize(self):
+        return {
+            "id": self.id,
+            "event_id": self.event_id,
+            "type": self.type,
+            "received_at": self.received_at.isoformat() if self.received_at else None,
+        }
+
+
+# -----------------------------
+# Inventario
+# -----------------------------
+class ProductStockBucket(db.Model):
+    """Stock de un producto muy demandado repartido en varias filas para no pelear por un único lock."""
+
+    product_id: Mapped[int] = mapped_column(ForeignKey("product.id"), primary_key=True)
+    bucket: Mapped[int] = mapped_column(Integer, primary_key=True)
+    stock: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+
+
+class StockReservation(db.Model):
+    __table_args__ = (
+        # el barrendero busca las reservas activas caducadas
+        Index("ix_stock_reservation_status_expires_at", "status", "expires_at"),
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    order_id: Mapped[int] = mapped_column(ForeignKey("order.id"), nullable=False, index=True)
+    product_id: Mapped[int] = mapped_column(ForeignKey("product.id"), nullable=False)
+    # bucket de product_stock_bucket del que salió (NULL = de product.stock)
+    bucket: Mapped[int] = mapped_column(Integer, nullable=True)
+    quantity: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    # active -> committed (pagado) / released (devuelto al stock)
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="active")
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        nullable=False
+    )
+
+
+# -----------------------------
+# Generaciones de caché
+# -----------------------------
+class CacheGeneration(db.Model):
+    """
+    Contadores de invalidación que deben ver todos los servicios (web y worker de
+    tareas, que pueden estar en máquinas distintas): viven en la BD compartida,
+    no en el backend de caché. Ver cache.catalog_generation().
+    """
+
+    name: Mapped[str] = mapped_column(String(50), primary_key=True)
+    value: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
@@ -0,0 +1,83 @@
+"""
+Latencia de las llamadas a servicios externos (Stripe, DummyJSON...), por proceso.
+
+    with outbound.timed("stripe.checkout.create"):
+        stripe.checkout.Session.create(...)
+
+Por cada nombre se guardan contadores y las últimas SAMPLE_SIZE duraciones
+(para p50/p95); GET /api/outbound/stats las devuelve. Cada llamada se anota
+también en metrics.py (histograma por servicio y tiempo externo de la petición).
+"""
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from src.api import metrics
+
+SAMPLE_SIZE = 512
+# llamadas más lentas que esto se registran en el log
+SLOW_MS = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class CallStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+    def add(self, ms, ok):
+        self.calls += 1
+        self.errors += 0 if ok else 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.samples.append(ms)
+
+    def to_dict(self):
+        samples = sorted(self.samples)
+        n = len(samples)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_ms": round(self.total_ms / self.calls, 3) if self.calls else None,
+            "p50_ms": round(samples[n // 2], 3) if n else None,
+            "p95_ms": round(samples[min(n - 1, int(n * 0.95))], 3) if n else None,
+            "max_ms": round(self.max_ms, 3),
+        }
+
+
+_stats = {}
+_lock = threading.Lock()
+
+
+def record(name, ms, ok=True):
+    with _lock:
+        _stats.setdefault(name, CallStats()).add(ms, ok)
+    metrics.observe_outbound(name, ms, ok)
+    if ms > SLOW_MS:
+        logger.warning("Llamada lenta a %s: %.0f ms", name, ms)
+
+
+@contextmanager
+def timed(name):
+    start = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        record(name, (time.perf_counter() - start) * 1000, ok)
+
+
+def stats():
+    with _lock:
+        return {name: s.to_dict() for name, s in sorted(_stats.items())}
+
+
+def reset():
+    with _lock:
+        _stats.clear()
@@ -0,0 +1,162 @@
+"""
+Hash de contraseñas fuera del proceso que atiende la petición.
+
+scrypt/pbkdf2 queman CPU a propósito (cientos de ms por llamada). En vez de
+hacerlo dentro del worker de gunicorn, se manda a un pool de procesos acotado:
+la petición espera el resultado pero el worker no se queda con la CPU (ni con
+el GIL), y si el pool está saturado se responde 503 en vez de encolar sin fin.
+
+Configuración por entorno:
+- PASSWORD_HASH_METHOD: scrypt (por defecto) o pbkdf2
+- PASSWORD_SCRYPT_N / PASSWORD_SCRYPT_R / PASSWORD_SCRYPT_P: parámetros de scrypt (32768/8/1)
+- PASSWORD_PBKDF2_ITERATIONS: iteraciones de pbkdf2:sha256 (600000)
+- PASSWORD_HASH_WORKERS: procesos del pool (0 = hash en el propio proceso)
+- PASSWORD_HASH_MAX_PENDING: hashes en vuelo por proceso web antes de rechazar
+- PASSWORD_HASH_TIMEOUT: segundos que espera la petición antes de responder 503 (30)
+
+Si un hijo del pool muere (falta de memoria, señal) el pool queda roto: esa
+petición recibe 503 y el pool se sustituye por uno nuevo.
+
+Los hashes guardados con otros parámetros siguen validando; en el siguiente
+login correcto se rehacen con los actuales (needs_rehash).
+"""
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as HashTimeout
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordHashBusy(Exception):
+    """El pool de hash está saturado, tarda más de timeout o se ha roto."""
+
+
+class HashConfig:
+    def __init__(self, method="scrypt", scrypt_n=32768, scrypt_r=8, scrypt_p=1,
+                 pbkdf2_iterations=600_000, workers=None, max_pending=None, timeout=30):
+        if method not in ("scrypt", "pbkdf2"):
+            raise ValueError(f"método de hash desconocido: {method}")
+        self.method = method
+        self.scrypt_n = scrypt_n
+        self.scrypt_r = scrypt_r
+        self.scrypt_p = scrypt_p
+        self.pbkdf2_iterations = pbkdf2_iterations
+        self.workers = min(4, os.cpu_count() or 1) if workers is None else workers
+        self.max_pending = max_pending or max(1, self.workers) * 8
+        self.timeout = timeout
+
+    @property
+    def method_string(self):
+        """Formato de werkzeug: es también el prefijo del hash guardado."""
+        if self.method == "scrypt":
+            return f"scrypt:{self.scrypt_n}:{self.scrypt_r}:{self.scrypt_p}"
+        return f"pbkdf2:sha256:{self.pbkdf2_iterations}"
+
+    @classmethod
+    def from_env(cls):
+        workers = os.getenv("PASSWORD_HASH_WORKERS")
+        max_pending = os.getenv("PASSWORD_HASH_MAX_PENDING")
+        return cls(
+            method=os.getenv("PASSWORD_HASH_METHOD", "scrypt").lower(),
+            scrypt_n=int(os.getenv("PASSWORD_SCRYPT_N", 32768)),
+            scrypt_r=int(os.getenv("PASSWORD_SCRYPT_R", 8)),
+            scrypt_p=int(os.getenv("PASSWORD_SCRYPT_P", 1)),
+            pbkdf2_iterations=int(os.getenv("PASSWORD_PBKDF2_ITERATIONS", 600_000)),
+            workers=int(workers) if workers else None,
+            max_pending=int(max_pending) if max_pending else None,
+            timeout=float(os.getenv("PASSWORD_HASH_TIMEOUT", 30)),
+        )
+
+
+config = HashConfig.from_env()
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(config.max_pending)
+
+
+def configure(new_config):
+    """Cambia la configuración (benchmarks). Cierra el pool actual."""
+    global config, _slots
+    shutdown()
+    config = new_config
+    _slots = threading.BoundedSemaphore(config.max_pending)
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: los hijos no heredan conexiones a la BD ni hilos del proceso web
+                _pool = ProcessPoolExecutor(max_workers=config.workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _discard_pool(pool):
+    """Retira un pool roto (un hijo murió, p. ej. por falta de memoria): el siguiente hash crea otro."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _submit(fn, *args):
+    pool = _get_pool()
+    try:
+        return pool, pool.submit(fn, *args)
+    except BrokenProcessPool:
+        _discard_pool(pool)
+    pool = _get_pool()
+    return pool, pool.submit(fn, *args)
+
+
+def _run(fn, *args):
+    if config.workers <= 0:
+        return fn(*args)
+    slots = _slots
+    if not slots.acquire(blocking=False):
+        raise PasswordHashBusy()
+    try:
+        pool, future = _submit(fn, *args)
+    except BaseException:
+        slots.release()
+        raise
+    # el hueco se libera cuando el hash termina, no cuando la petición deja de
+    # esperar: un hash que sigue corriendo tras el timeout sigue ocupando un proceso
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        return future.result(timeout=config.timeout)
+    except HashTimeout:
+        future.cancel()
+        raise PasswordHashBusy()
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise PasswordHashBusy()
+
+
+def hash_password(password):
+    return _run(generate_password_hash, password, config.method_string)
+
+
+def verify_password(stored_hash, password):
+    if not stored_hash:
+        return False
+    return _run(check_password_hash, stored_hash, password)
+
+
+def needs_rehash(stored_hash):
+    """True si el hash se generó con otros parámetros que los configurados."""
+    method = (stored_hash or "").split("$", 1)[0]
+    return method != config.method_string
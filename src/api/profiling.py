@@ -0,0 +1,270 @@
+"""
+Log de consultas lentas y perfilado de peticiones bajo demanda.
+
+Consultas lentas (SLOW_QUERY_MS, por defecto 500; 0 = desactivado): toda
+sentencia que tarde más se registra en el logger "src.api.profiling" como una
+línea JSON con el SQL, la forma de los parámetros (tipos, nunca valores), la
+duración, la ruta que la lanzó y su EXPLAIN. El EXPLAIN se hace en un hilo
+aparte con otra conexión (no alarga la petición) y, para la misma sentencia,
+como mucho una vez cada SLOW_QUERY_EXPLAIN_EVERY segundos.
+
+Perfilado (solo rutas del blueprint `api`):
+- con la cabecera "X-Profile: <PROFILE_SECRET>" (sin PROFILE_SECRET no se admite), o
+- al azar en una fracción PROFILE_SAMPLE_RATE de las peticiones (p. ej. 0.001).
+PROFILE_MODE=cprofile guarda un .prof (pstats, snakeviz...); PROFILE_MODE=stack
+muestrea la pila cada PROFILE_INTERVAL_MS y guarda un .folded (flamegraph.pl,
+speedscope). Los ficheros van a PROFILE_DIR (se conservan los PROFILE_MAX_FILES
+últimos) y la respuesta lleva su nombre en X-Profile-File. Como mucho se perfila
+una petición a la vez por proceso.
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import random
+import hashlib
+import cProfile
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from flask import g, request, has_request_context
+from sqlalchemy import event
+from src.api.models import db
+from src.api import metrics
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 500))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "1").lower() in ("1", "true", "yes")
+SLOW_QUERY_EXPLAIN_EVERY = int(os.getenv("SLOW_QUERY_EXPLAIN_EVERY", 300))
+# consultas lentas pendientes de EXPLAIN/log; si hay más se registran sin EXPLAIN
+SLOW_QUERY_BACKLOG = 100
+SQL_MAX_CHARS = 4000
+
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile").lower()
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/marketly-profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 200))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+
+EXPLAIN_PREFIXES = {"sqlite": "EXPLAIN QUERY PLAN ", "postgresql": "EXPLAIN ", "mysql": "EXPLAIN "}
+EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "DELETE", "INSERT")
+
+
+# ---------------------------
+# Consultas lentas
+# ---------------------------
+_reporter = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query")
+_pending = 0
+_explained = {}
+_state = threading.local()
+_lock = threading.Lock()
+
+
+def parameters_shape(parameters, executemany=False):
+    """Tipos de los parámetros, sin sus valores (pueden ser datos personales)."""
+    if executemany:
+        rows = list(parameters or [])
+        return {"rows": len(rows), "each": parameters_shape(rows[0]) if rows else None}
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def explain(engine, statement, parameters):
+    """Plan de la sentencia con una conexión nueva, o None si el motor/sentencia no lo admite."""
+    prefix = EXPLAIN_PREFIXES.get(engine.dialect.name)
+    if prefix is None or not statement.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    _state.explaining = True
+    try:
+        with engine.connect() as conn:
+            rows = conn.exec_driver_sql(prefix + statement, parameters).fetchall()
+            conn.rollback()
+    finally:
+        _state.explaining = False
+    return "\n".join(" | ".join(str(value) for value in row) for row in rows)
+
+
+def _should_explain(statement):
+    digest = hashlib.sha1(statement.encode()).hexdigest()
+    now = time.monotonic()
+    with _lock:
+        if now - _explained.get(digest, -SLOW_QUERY_EXPLAIN_EVERY) < SLOW_QUERY_EXPLAIN_EVERY:
+            return False
+        if len(_explained) > 10000:
+            _explained.clear()
+        _explained[digest] = now
+    return True
+
+
+def _report(record, engine, statement, parameters):
+    global _pending
+    try:
+        if parameters is not None and _should_explain(statement):
+            try:
+                record["explain"] = explain(engine, statement, parameters)
+            except Exception as e:
+                record["explain_error"] = f"{type(e).__name__}: {e}"
+        logger.warning("Consulta lenta %s", json.dumps(record, ensure_ascii=False, default=str))
+    finally:
+        with _lock:
+            _pending -= 1
+
+
+# el inicio va en el contexto de ejecución (como en metrics.py): una sentencia que
+# falla no deja nada en la conexión que desempareje las siguientes
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._profiling_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    global _pending
+    started = getattr(context, "_profiling_started", None)
+    if started is None:
+        return
+    ms = (time.perf_counter() - started) * 1000
+    if SLOW_QUERY_MS <= 0 or ms < SLOW_QUERY_MS or getattr(_state, "explaining", False):
+        return
+
+    in_request = has_request_context()
+    route = (request.url_rule.rule if request.url_rule is not None else request.path) if in_request else None
+    metrics.registry.inc("slow_queries_total", (("route", route or "-"),))
+    record = {
+        "ms": round(ms, 1),
+        "route": route,
+        "method": request.method if in_request else None,
+        "sql": statement[:SQL_MAX_CHARS],
+        "parameters": parameters_shape(parameters, executemany),
+    }
+    explain_parameters = None
+    if SLOW_QUERY_EXPLAIN:
+        explain_parameters = (parameters[0] if parameters else None) if executemany else parameters
+    with _lock:
+        if _pending >= SLOW_QUERY_BACKLOG:
+            explain_parameters = None
+        _pending += 1
+    _reporter.submit(_report, record, conn.engine, statement, explain_parameters)
+
+
+# ---------------------------
+# Perfilado de peticiones
+# ---------------------------
+_profiling = threading.Lock()
+
+
+class StackSampler:
+    """Muestrea la pila de un hilo cada `interval` segundos; resultado en formato "folded"."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="stack-sampler")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _wants_profile():
+    if request.blueprint != "api":
+        return False
+    header = request.headers.get("X-Profile")
+    if header and PROFILE_SECRET:
+        return hmac.compare_digest(header, PROFILE_SECRET)
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _profile_path(ms):
+    route = request.url_rule.rule if request.url_rule is not None else request.path
+    slug = "".join(c if c.isalnum() else "_" for c in route).strip("_")[:80]
+    extension = "folded" if PROFILE_MODE == "stack" else "prof"
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{request.method}-{slug}-{ms:.0f}ms.{extension}"
+    return os.path.join(PROFILE_DIR, name)
+
+
+def _prune_profiles():
+    files = sorted(os.scandir(PROFILE_DIR), key=lambda entry: entry.stat().st_mtime)
+    for entry in files[:max(0, len(files) - PROFILE_MAX_FILES)]:
+        os.remove(entry.path)
+
+
+def _stop(profiler):
+    if PROFILE_MODE == "stack":
+        profiler.stop()
+    else:
+        profiler.disable()
+
+
+def setup_profiling(app):
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+    @app.before_request
+    def start_profile():
+        if not _wants_profile() or not _profiling.acquire(blocking=False):
+            return
+        if PROFILE_MODE == "stack":
+            profiler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000)
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        g._profile = (profiler, time.perf_counter())
+
+    @app.after_request
+    def stop_profile(response):
+        profile = g.pop("_profile", None)
+        if profile is None:
+            return response
+        profiler, start = profile
+        try:
+            _stop(profiler)
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = _profile_path((time.perf_counter() - start) * 1000)
+            if PROFILE_MODE == "stack":
+                profiler.dump(path)
+            else:
+                profiler.dump_stats(path)
+            _prune_profiles()
+        finally:
+            _profiling.release()
+        response.headers["X-Profile-File"] = os.path.basename(path)
+        logger.info("Perfil de %s %s guardado en %s", request.method, request.path, path)
+        return response
+
+    @app.teardown_request
+    def abandon_profile(exc):
+        # la petición no llegó a after_request: se descarta el perfil y se libera el turno
+        profile = g.pop("_profile", None)
+        if profile is not None:
+            _stop(profile[0])
+            _profiling.release()
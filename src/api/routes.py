@@ -2,12 +2,23 @@
 Rutas API (JWT + hash + perfil opcional + productos + carrito + STRIPE checkout)
 """
 import os
-import requests
+import time
+import hashlib
+from datetime import datetime, timedelta, timezone
 from flask import request, jsonify, Blueprint
-from src.api.models import db, User, Product, CartItem
+from sqlalchemy import and_, or_, func, select, insert, update, delete, literal, literal_column
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, selectinload
+from src.api.models import db, User, Product, CartItem, Order, OrderItem, Job
+from src.api import importer, jobs, search, passwords, auth, stripe_events, stripe_checkout, outbound, inventory, metrics, serialization
+from src.api.utils import encode_cursor, decode_cursor, parse_limit, not_modified, with_validators, as_utc
+from src.api.cache import (
+    cache, catalog_generation, catalog_key, product_key, product_list_key, bump_catalog_generation, cart_key,
+    bump_cart_generation,
+)
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, get_current_user
 
 # Stripe (asi si no esta instalado sigue funcinando)
 try:
@@ -22,10 +33,20 @@ CORS(api)
 # STRIPE CONFIG
 # ---------------------------
 if stripe:
-    stripe.api_key = os.getenv("STRIPE_SECRET_KEY", "")
+    # clave, STRIPE_API_BASE opcional y pool de conexiones keep-alive compartido
+    stripe_checkout.configure(stripe)
 
 FRONTEND_URL = os.getenv("FRONTEND_URL", "").rstrip("/")
 
+
+@api.errorhandler(passwords.PasswordHashBusy)
+def password_hash_busy(e):
+    # el pool de hash está lleno: mejor que el cliente reintente que bloquear el worker
+    response = jsonify({"error": "Servidor ocupado, inténtalo de nuevo"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
 # ---------------------------
 # TEST
 # ---------------------------
@@ -49,7 +70,7 @@ def register_user():
     if User.query.filter_by(email=email).first():
         return jsonify({"error": "El email ya está registrado"}), 409
 
-    hashed = generate_password_hash(password)
+    hashed = passwords.hash_password(password)
 
     user = User(
         email=email,
@@ -75,21 +96,24 @@ def login():
         return jsonify({"error": "email y password son requeridos"}), 400
 
     user = User.query.filter_by(email=email).first()
-    if not user or not check_password_hash(user.password, password):
+    if not user or not passwords.verify_password(user.password, password):
         return jsonify({"error": "Credenciales inválidas"}), 401
 
+    # hash con parámetros antiguos: se rehace ahora que tenemos la contraseña en claro
+    if passwords.needs_rehash(user.password):
+        user.password = passwords.hash_password(password)
+        db.session.commit()
+
     token = create_access_token(identity=str(user.id))
+    auth.remember_user(user)
     return jsonify({"access_token": token, "user": user.serialize()}), 200
 
 
 @api.route("/me", methods=["GET"])
 @jwt_required()
 def me():
-    user_id = int(get_jwt_identity())
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({"error": "Usuario no encontrado"}), 404
-    return jsonify(user.serialize()), 200
+    # la identidad ya viene de la caché de auth.py (sin SELECT a user)
+    return jsonify(get_current_user()["user"]), 200
 
 
 @api.route("/me", methods=["PUT"])
@@ -116,9 +140,10 @@ def update_me():
         user.email = data["email"]
 
     if "password" in data and data["password"]:
-        user.password = generate_password_hash(data["password"])
+        user.password = passwords.hash_password(data["password"])
 
     db.session.commit()
+    auth.invalidate_user(user_id)
     return jsonify(user.serialize()), 200
 
 
@@ -130,18 +155,27 @@ def delete_me():
     if not user:
         return jsonify({"error": "Usuario no encontrado"}), 404
 
+    # el stock reservado por sus pedidos sin pagar vuelve a estar disponible
+    inventory.release(select(Order.id).where(Order.user_id == user_id))
     db.session.delete(user)
     db.session.commit()
+    bump_cart_generation(user_id)
+    auth.invalidate_user(user_id, revoke=True)
     return jsonify({"message": "Cuenta eliminada"}), 200
 
 
 # ---------------------------
 # USERS (dev)
 # ---------------------------
+USER_LIST_COLUMNS = (User.id, User.email, User.name, User.lastname, User.address, User.created_at)
+
+
 @api.route("/users", methods=["GET"])
 def list_users():
-    users = User.query.all()
-    return jsonify([u.serialize() for u in users]), 200
+    # mismas claves que User.serialize(), en streaming y sin cargar entidades
+    rows = db.session.execute(select(*USER_LIST_COLUMNS).order_by(User.id)
+                              .execution_options(yield_per=serialization.STREAM_CHUNK_ROWS))
+    return serialization.stream_response(rows, serialization.column_keys(USER_LIST_COLUMNS))
 
 
 # ---------------------------
@@ -160,23 +194,256 @@ def create_product():
         price_cents=int(data["price_cents"]),
         image_url=data.get("image_url", ""),
     )
+    try:
+        stock = _parse_stock(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if stock is not None and stock[1] and stock[0] is None:
+        return jsonify({"error": "stock_buckets requiere stock"}), 400
     db.session.add(product)
+    db.session.flush()
+    if stock is not None:
+        inventory.set_stock(product.id, stock[0], buckets=stock[1])
     db.session.commit()
+    bump_catalog_generation()
+    search.index_product(product)
     return jsonify(product.serialize()), 201
 
 
+def _parse_stock(data):
+    """
+    "stock" (entero >= 0 o null = sin control) y "stock_buckets" opcionales del body.
+    Devuelve None si no vienen, o (stock, buckets) para inventory.set_stock().
+    Si solo viene "stock_buckets", stock es None: al crear es un error y al
+    actualizar se reparte el disponible actual.
+    """
+    if "stock" not in data and "stock_buckets" not in data:
+        return None
+    stock = data.get("stock")
+    buckets = data.get("stock_buckets")
+    try:
+        stock = None if stock is None else int(stock)
+        buckets = None if buckets is None else int(buckets)
+    except (TypeError, ValueError):
+        raise ValueError("stock y stock_buckets deben ser números")
+    if (stock is not None and stock < 0) or (buckets is not None and not 0 <= buckets <= 64):
+        raise ValueError("stock debe ser >= 0 y stock_buckets estar entre 0 y 64")
+    return stock, buckets
+
+
+PRODUCTS_DEFAULT_LIMIT = 20
+PRODUCTS_MAX_LIMIT = 100
+
+
+def _parse_product_fields(raw):
+    if not raw:
+        return None
+    fields = {f.strip() for f in raw.split(",") if f.strip()}
+    unknown = fields - set(Product.SERIALIZABLE_FIELDS)
+    if unknown:
+        raise ValueError(f"fields desconocidos: {', '.join(sorted(unknown))}")
+    # id y created_at siempre se devuelven (hacen falta para el cursor)
+    return fields | {"id", "created_at"}
+
+
+def _product_columns(fields):
+    """Columnas del listado en el orden de SERIALIZABLE_FIELDS (las mismas claves que Product.serialize())."""
+    return [getattr(Product, name) for name in Product.SERIALIZABLE_FIELDS if fields is None or name in fields]
+
+
+def _product_filters(args):
+    conditions = []
+
+    min_price = args.get("min_price_cents")
+    max_price = args.get("max_price_cents")
+    try:
+        if min_price not in (None, ""):
+            conditions.append(Product.price_cents >= int(min_price))
+        if max_price not in (None, ""):
+            conditions.append(Product.price_cents <= int(max_price))
+    except ValueError:
+        raise ValueError("min_price_cents y max_price_cents deben ser números")
+
+    title_prefix = (args.get("title_prefix") or "").strip()
+    if title_prefix:
+        conditions.append(Product.title.startswith(title_prefix, autoescape=True))
+
+    return conditions
+
+
+def _catalog_fingerprint(generation=None):
+    """
+    (nº de productos, max(updated_at)) del catálogo: basta para saber si cambió algo.
+    Se guarda en caché por generación, así que normalmente no toca la BD.
+    """
+    key = catalog_key("fingerprint", generation)
+    cached = cache.get(key)
+    if cached is not None:
+        count, last_modified = cached
+        return count, datetime.fromisoformat(last_modified) if last_modified else None
+
+    count, last_modified = db.session.query(func.count(Product.id), func.max(Product.updated_at)).one()
+    cache.set(key, [count, last_modified.isoformat() if last_modified else None])
+    return count, last_modified
+
+
+def _product_list_etag(args, count, last_modified):
+    query = "&".join(f"{k}={v}" for k, v in sorted(args.items(multi=True)))
+    version = f"{count}:{last_modified.isoformat() if last_modified else ''}:{query}"
+    return hashlib.sha1(version.encode()).hexdigest()
+
+
+def _product_etag(product_id, updated_at):
+    return f"product-{product_id}-{updated_at.isoformat() if updated_at else ''}"
+
+
 @api.route("/products", methods=["GET"])
 def get_products():
-    products = Product.query.all()
-    return jsonify([p.serialize() for p in products]), 200
+    """
+    Listado de productos paginado por cursor (keyset sobre created_at, id).
+
+    Query params opcionales:
+    - limit: número (por defecto 20, máximo 100)
+    - cursor: valor next_cursor de la página anterior
+    - min_price_cents / max_price_cents: rango de precio
+    - title_prefix: el título empieza por este texto
+    - fields: lista separada por comas (ej. id,title,price_cents,image_url)
+    - all: true para el formato antiguo (lista completa sin paginar, en streaming)
+
+    Se leen tuplas con las columnas pedidas (select de Core), no entidades: ver serialization.py.
+    """
+    args = request.args
+
+    # 304 sin tocar filas si el catálogo no cambió
+    generation = catalog_generation()
+    count, last_modified = _catalog_fingerprint(generation)
+    etag = _product_list_etag(args, count, last_modified)
+    unchanged = not_modified(etag, last_modified)
+    if unchanged is not None:
+        return unchanged
+
+    cache_key = product_list_key(args, generation)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return with_validators(serialization.json_response(cached), etag, last_modified), 200
+
+    try:
+        fields = _parse_product_fields(args.get("fields"))
+        conditions = _product_filters(args)
+        limit = parse_limit(args.get("limit"), PRODUCTS_DEFAULT_LIMIT, PRODUCTS_MAX_LIMIT)
+        cursor = decode_cursor(args["cursor"]) if args.get("cursor") else None
+        if cursor is not None:
+            last_created_at, last_id = datetime.fromisoformat(cursor[0]), int(cursor[1])
+    except (ValueError, IndexError, TypeError) as e:
+        return jsonify({"error": str(e) or "parámetros inválidos"}), 400
+
+    columns = _product_columns(fields)
+    keys = serialization.column_keys(columns)
+    query = select(*columns).where(*conditions).order_by(Product.created_at, Product.id)
+
+    # Formato antiguo: lista completa. Va en streaming y no se guarda en caché (puede
+    # ser todo el catálogo); el ETag sigue permitiendo responder 304.
+    if args.get("all", "").lower() in ("1", "true", "yes"):
+        rows = db.session.execute(query.execution_options(yield_per=serialization.STREAM_CHUNK_ROWS))
+        return with_validators(serialization.stream_response(rows, keys), etag, last_modified), 200
+
+    if cursor is not None:
+        query = query.where(or_(
+            Product.created_at > last_created_at,
+            and_(Product.created_at == last_created_at, Product.id > last_id),
+        ))
+
+    # pedimos uno de más para saber si hay página siguiente
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    items = serialization.row_dicts(rows[:limit], keys)
+
+    next_cursor = None
+    if has_more:
+        last = items[-1]
+        next_cursor = encode_cursor(last["created_at"], last["id"])
+
+    data = {
+        "items": items,
+        "next_cursor": next_cursor,
+        "limit": limit,
+    }
+    cache.set(cache_key, data)
+    return with_validators(serialization.json_response(data), etag, last_modified), 200
+
+
+SEARCH_MAX_OFFSET = 1000
+
+
+@api.route("/products/search", methods=["GET"])
+def search_products():
+    """
+    Búsqueda de texto completo en título y descripción (ordenada por relevancia).
+
+    Query params:
+    - q: texto a buscar (cada palabra cuenta como prefijo: "cami" encuentra "camiseta")
+    - limit: número (por defecto 20, máximo 100)
+    - cursor: valor next_cursor de la página anterior
+    - engine: "db" (índice de la BD) o "memory" (índice en memoria); por defecto según la BD
+    """
+    args = request.args
+    q = (args.get("q") or "").strip()
+    if not q:
+        return jsonify({"error": "q es requerido"}), 400
+
+    engine = args.get("engine") or search.default_engine()
+    if engine not in search.ENGINES:
+        return jsonify({"error": "engine debe ser db o memory"}), 400
+    if engine == "db" and not search.has_native_index(db.session.get_bind()):
+        return jsonify({"error": "La base de datos no tiene índice de texto completo"}), 400
+
+    try:
+        limit = parse_limit(args.get("limit"), PRODUCTS_DEFAULT_LIMIT, PRODUCTS_MAX_LIMIT)
+        offset = int(decode_cursor(args["cursor"])[0]) if args.get("cursor") else 0
+    except (ValueError, IndexError, TypeError) as e:
+        return jsonify({"error": str(e) or "parámetros inválidos"}), 400
+    if offset < 0 or offset > SEARCH_MAX_OFFSET:
+        return jsonify({"error": "cursor inválido"}), 400
+
+    key = catalog_key(f"search:{engine}:{q.lower()}:{limit}:{offset}")
+    cached = cache.get(key)
+    if cached is not None:
+        return jsonify(cached), 200
+
+    items, has_more = search.search_products(q, limit, offset, engine=engine)
+    data = {
+        "items": items,
+        "next_cursor": encode_cursor(offset + limit) if has_more and offset + limit <= SEARCH_MAX_OFFSET else None,
+        "limit": limit,
+    }
+    cache.set(key, data)
+    return jsonify(data), 200
 
 
 @api.route("/products/<int:product_id>", methods=["GET"])
 def get_product(product_id):
+    key = product_key(product_id)
+    cached = cache.get(key)
+    if cached is not None:
+        updated_at = datetime.fromisoformat(cached["updated_at"]) if cached.get("updated_at") else None
+        etag = _product_etag(product_id, updated_at)
+        unchanged = not_modified(etag, updated_at)
+        if unchanged is not None:
+            return unchanged
+        return with_validators(jsonify(cached), etag, updated_at), 200
+
     product = Product.query.get(product_id)
     if not product:
         return jsonify({"error": "Product not found"}), 404
-    return jsonify(product.serialize()), 200
+
+    etag = _product_etag(product_id, product.updated_at)
+    unchanged = not_modified(etag, product.updated_at)
+    if unchanged is not None:
+        return unchanged
+
+    data = product.serialize()
+    cache.set(key, data)
+    return with_validators(jsonify(data), etag, product.updated_at), 200
 
 
 @api.route("/products/<int:product_id>", methods=["PUT"])
@@ -194,8 +461,22 @@ def update_product(product_id):
         product.price_cents = int(data["price_cents"])
     if "image_url" in data:
         product.image_url = data["image_url"]
+    try:
+        stock = _parse_stock(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if stock is not None:
+        if "stock" not in data:
+            # solo cambia el reparto: se conserva el disponible actual
+            stock = (inventory.available(product_id)[0], stock[1])
+        if stock[1] and stock[0] is None:
+            db.session.rollback()
+            return jsonify({"error": "stock_buckets requiere stock"}), 400
+        inventory.set_stock(product_id, stock[0], buckets=stock[1])
 
     db.session.commit()
+    bump_catalog_generation()
+    search.index_product(product)
     return jsonify(product.serialize()), 200
 
 
@@ -207,35 +488,176 @@ def delete_product(product_id):
 
     db.session.delete(product)
     db.session.commit()
+    bump_catalog_generation()
+    search.unindex_product(product_id)
     return jsonify({"message": "Product deleted"}), 200
 
 
+@api.route("/products/<int:product_id>/stock", methods=["GET"])
+def get_product_stock(product_id):
+    """Disponible en este momento (sin caché: cambia con cada compra)."""
+    stock = inventory.available(product_id)
+    if stock is None:
+        return jsonify({"error": "Product not found"}), 404
+    available, buckets = stock
+    return jsonify({"product_id": product_id, "stock": available, "buckets": buckets}), 200
+
+
+@api.route("/products/search/stats", methods=["GET"])
+def search_stats():
+    return jsonify({"default_engine": search.default_engine(), "memory": search.memory_stats()}), 200
+
+
+@api.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(cache.stats()), 200
+
+
+@api.route("/metrics", methods=["GET"])
+def get_metrics():
+    """Métricas de todos los workers en formato de texto de Prometheus (ver metrics.py)."""
+    if not metrics.TOKEN:
+        return jsonify({"error": "Not found"}), 404
+    if not metrics.authorized(request.headers.get("Authorization")):
+        return jsonify({"error": "Token de métricas inválido"}), 401
+    return metrics.collect(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+@api.route("/outbound/stats", methods=["GET"])
+def outbound_stats():
+    """Latencias de las llamadas a servicios externos (Stripe...) de este proceso."""
+    return jsonify(outbound.stats()), 200
+
+
 # ---------------------------
 # CART
 # ---------------------------
+# ?view=compact: lo justo para pintar una línea (sin description ni el producto entero)
+CART_COMPACT_COLUMNS = (CartItem.id, CartItem.product_id, CartItem.quantity,
+                        Product.title, Product.price_cents, Product.image_url)
+
+
 @api.route("/cart-items", methods=["GET"])
 @jwt_required()
 def get_cart_items():
     user_id = int(get_jwt_identity())
-    items = CartItem.query.filter_by(user_id=user_id).all()
-    return jsonify([i.serialize() for i in items]), 200
+    compact = request.args.get("view") == "compact"
+    key = f"{cart_key(user_id)}:compact" if compact else cart_key(user_id)
+    cached = cache.get(key)
+    if cached is not None:
+        return jsonify(cached), 200
+
+    if compact:
+        rows = db.session.execute(
+            select(*CART_COMPACT_COLUMNS)
+            .join(Product, Product.id == CartItem.product_id)
+            .where(CartItem.user_id == user_id)
+            .order_by(CartItem.id)
+        ).mappings().all()
+        data = [dict(row) for row in rows]
+    else:
+        # un solo SELECT con JOIN a product (CartItem.serialize() incluye el producto)
+        items = CartItem.query.options(joinedload(CartItem.product)).filter_by(user_id=user_id).all()
+        data = [i.serialize() for i in items]
+    cache.set(key, data)
+    return jsonify(data), 200
 
 
-@api.route("/cart-items", methods=["POST"])
+@api.route("/cart/summary", methods=["GET"])
 @jwt_required()
-def add_cart_item():
+def get_cart_summary():
+    """
+    Nº de líneas, de unidades y total en céntimos con un único SELECT agregado
+    sobre cart_item JOIN product. Pensado para el contador del Navbar, que lo
+    consulta periódicamente: con If-None-Match responde 304 (si el resumen está
+    en caché, sin tocar la BD).
+    """
     user_id = int(get_jwt_identity())
-    data = request.get_json() or {}
-
-    product_id = data.get("product_id")
-    quantity = int(data.get("quantity", 1))
-
-    if not product_id:
-        return jsonify({"error": "product_id es requerido"}), 400
+    key = f"{cart_key(user_id)}:summary"
+    data = cache.get(key)
+    if data is None:
+        lines, item_count, total_cents = db.session.execute(
+            select(
+                func.count(CartItem.id),
+                func.coalesce(func.sum(CartItem.quantity), 0),
+                func.coalesce(func.sum(CartItem.quantity * Product.price_cents), 0),
+            )
+            .join(Product, Product.id == CartItem.product_id)
+            .where(CartItem.user_id == user_id)
+        ).one()
+        data = {"lines": lines, "item_count": int(item_count), "total_cents": int(total_cents)}
+        cache.set(key, data)
+
+    # el ETag sale del propio resumen, no de la clave de caché: los contadores de
+    # generación vuelven a 0 al reiniciar o vaciar la caché (o en otra instancia)
+    etag = hashlib.sha1(f"{data['lines']}:{data['item_count']}:{data['total_cents']}".encode()).hexdigest()
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+    return with_validators(jsonify(data), etag), 200
+
+
+UPSERT_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _upsert_cart_item(user_id, product_id, quantity):
+    """
+    INSERT ... SELECT FROM product ... ON CONFLICT (user_id, product_id) DO UPDATE
+    en una sola sentencia: si el producto no existe no se inserta nada (None),
+    y el RETURNING trae también los datos del producto para serializar la línea.
+    """
+    dialect_insert = UPSERT_DIALECTS[db.session.get_bind().dialect.name]
+    cart_item = CartItem.__table__
+    product = Product.__table__
+
+    source = select(
+        literal(user_id),
+        product.c.id,
+        literal(quantity),
+        literal(datetime.now(timezone.utc), type_=CartItem.created_at.type),
+    ).where(product.c.id == product_id)
+
+    stmt = dialect_insert(cart_item).from_select(["user_id", "product_id", "quantity", "created_at"], source)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[cart_item.c.user_id, cart_item.c.product_id],
+        set_={"quantity": cart_item.c.quantity + stmt.excluded.quantity},
+    )
+    # subconsultas escalares en el RETURNING (el compilador de SQLAlchemy no las correlaciona ahí)
+    product_columns = [
+        literal_column(
+            f"(SELECT p.{name} FROM product AS p WHERE p.id = cart_item.product_id)",
+            type_=product.c[name].type,
+        ).label(f"product_{name}")
+        for name in Product.SERIALIZABLE_FIELDS if name != "id"
+    ]
+    stmt = stmt.returning(
+        cart_item.c.id, cart_item.c.user_id, cart_item.c.quantity, cart_item.c.created_at,
+        cart_item.c.product_id, *product_columns
+    )
 
-    product = Product.query.get(int(product_id))
+    row = db.session.execute(stmt).mappings().first()
+    db.session.commit()
+    if row is None:
+        return None
+
+    product_data = {name: row[f"product_{name}"] for name in Product.SERIALIZABLE_FIELDS if name != "id"}
+    product_data = {"id": row["product_id"], **product_data}
+    for name in ("created_at", "updated_at"):
+        product_data[name] = product_data[name].isoformat() if product_data[name] else None
+    return {
+        "id": row["id"],
+        "user_id": row["user_id"],
+        "product": product_data,
+        "quantity": row["quantity"],
+        "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+    }
+
+
+def _add_cart_item_orm(user_id, product_id, quantity):
+    # Camino genérico para motores sin ON CONFLICT
+    product = Product.query.get(product_id)
     if not product:
-        return jsonify({"error": "Producto no existe"}), 404
+        return None
 
     item = CartItem.query.filter_by(user_id=user_id, product_id=product.id).first()
     if item:
@@ -244,15 +666,50 @@ def add_cart_item():
         item = CartItem(user_id=user_id, product_id=product.id, quantity=quantity)
         db.session.add(item)
 
-    db.session.commit()
-    return jsonify(item.serialize()), 201
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # otra petición creó la misma línea a la vez (índice único user_id + product_id)
+        db.session.rollback()
+        item = CartItem.query.filter_by(user_id=user_id, product_id=product.id).one()
+        item.quantity += quantity
+        db.session.commit()
+    return item.serialize()
+
+
+@api.route("/cart-items", methods=["POST"])
+@jwt_required()
+def add_cart_item():
+    user_id = int(get_jwt_identity())
+    data = request.get_json() or {}
+
+    if not data.get("product_id"):
+        return jsonify({"error": "product_id es requerido"}), 400
+    try:
+        product_id = int(data["product_id"])
+        quantity = int(data.get("quantity", 1))
+    except (ValueError, TypeError):
+        return jsonify({"error": "product_id y quantity deben ser números"}), 400
+    if quantity < 1:
+        return jsonify({"error": "quantity debe ser >= 1"}), 400
+
+    if db.session.get_bind().dialect.name in UPSERT_DIALECTS:
+        item = _upsert_cart_item(user_id, product_id, quantity)
+    else:
+        item = _add_cart_item_orm(user_id, product_id, quantity)
+
+    if item is None:
+        return jsonify({"error": "Producto no existe"}), 404
+
+    bump_cart_generation(user_id)
+    return jsonify(item), 201
 
 
 @api.route("/cart-items/<int:item_id>", methods=["PUT"])
 @jwt_required()
 def update_cart_item(item_id):
     user_id = int(get_jwt_identity())
-    item = CartItem.query.get(item_id)
+    item = CartItem.query.options(joinedload(CartItem.product)).get(item_id)
     if not item:
         return jsonify({"error": "CartItem not found"}), 404
 
@@ -264,6 +721,7 @@ def update_cart_item(item_id):
         item.quantity = max(1, int(data["quantity"]))
 
     db.session.commit()
+    bump_cart_generation(user_id)
     return jsonify(item.serialize()), 200
 
 
@@ -280,15 +738,206 @@ def delete_cart_item(item_id):
 
     db.session.delete(item)
     db.session.commit()
+    bump_cart_generation(user_id)
     return jsonify({"message": "CartItem deleted"}), 200
 
 
+CART_BATCH_MAX_OPERATIONS = 100
+
+
+def _parse_cart_operations(raw):
+    if not isinstance(raw, list) or not raw:
+        raise ValueError("operations debe ser una lista no vacía")
+    if len(raw) > CART_BATCH_MAX_OPERATIONS:
+        raise ValueError(f"máximo {CART_BATCH_MAX_OPERATIONS} operaciones por petición")
+
+    operations = []
+    for op in raw:
+        if not isinstance(op, dict):
+            raise ValueError("cada operación debe ser un objeto")
+        kind = op.get("op")
+        if kind == "add":
+            if not op.get("product_id"):
+                raise ValueError("add requiere product_id")
+            quantity = int(op.get("quantity", 1))
+            if quantity < 1:
+                raise ValueError("add requiere quantity >= 1")
+            operations.append((kind, int(op["product_id"]), quantity))
+        elif kind == "set":
+            if not op.get("id") or op.get("quantity") is None:
+                raise ValueError("set requiere id y quantity")
+            operations.append((kind, int(op["id"]), int(op["quantity"])))
+        elif kind == "remove":
+            if not op.get("id"):
+                raise ValueError("remove requiere id")
+            operations.append((kind, int(op["id"]), None))
+        else:
+            raise ValueError(f"op desconocida: {kind}")
+    return operations
+
+
+@api.route("/cart-items", methods=["PATCH"])
+@jwt_required()
+def patch_cart_items():
+    """
+    Aplica varios cambios al carrito en una sola transacción y devuelve el carrito completo.
+
+    Body:
+    {"operations": [
+        {"op": "add", "product_id": 3, "quantity": 1},
+        {"op": "set", "id": 7, "quantity": 2},     (quantity <= 0 borra la línea)
+        {"op": "remove", "id": 8}
+    ]}
+    """
+    user_id = int(get_jwt_identity())
+    data = request.get_json() or {}
+    try:
+        operations = _parse_cart_operations(data.get("operations"))
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    item_ids = {ref for kind, ref, _ in operations if kind != "add"}
+    product_ids = {ref for kind, ref, _ in operations if kind == "add"}
+
+    if product_ids:
+        found = {pid for (pid,) in db.session.query(Product.id).filter(Product.id.in_(product_ids))}
+        missing = sorted(product_ids - found)
+        if missing:
+            return jsonify({"error": "Producto no existe", "product_ids": missing}), 404
+
+    # una sola consulta: líneas referenciadas por id + líneas existentes de los productos a añadir,
+    # siempre filtrando por el usuario (lo que no sea suyo simplemente no aparece)
+    conditions = []
+    if item_ids:
+        conditions.append(CartItem.id.in_(item_ids))
+    if product_ids:
+        conditions.append(CartItem.product_id.in_(product_ids))
+    lines = CartItem.query.filter(CartItem.user_id == user_id, or_(*conditions)).all()
+
+    by_id = {line.id: line for line in lines}
+    by_product = {line.product_id: line for line in lines}
+    missing = sorted(item_ids - by_id.keys())
+    if missing:
+        return jsonify({"error": "CartItem not found", "ids": missing}), 404
+
+    # primero se calcula el estado final (None = borrar) y luego se aplica una vez por línea
+    final = {line.id: line.quantity for line in lines}
+    new_lines = {}
+    for kind, ref, quantity in operations:
+        if kind == "add":
+            line = by_product.get(ref)
+            if line is not None:
+                final[line.id] = (final[line.id] or 0) + quantity
+            else:
+                new_lines[ref] = new_lines.get(ref, 0) + quantity
+        elif kind == "remove" or quantity <= 0:
+            final[ref] = None
+        else:
+            final[ref] = quantity
+
+    for line in lines:
+        quantity = final[line.id]
+        if quantity is None or quantity <= 0:
+            db.session.delete(line)
+        elif quantity != line.quantity:
+            line.quantity = quantity
+    for product_id, quantity in new_lines.items():
+        if quantity <= 0:
+            continue
+        db.session.add(CartItem(user_id=user_id, product_id=product_id, quantity=quantity))
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"error": "El carrito cambió a la vez en otra petición, reinténtalo"}), 409
+    bump_cart_generation(user_id)
+
+    items = CartItem.query.options(joinedload(CartItem.product)).filter_by(user_id=user_id).all()
+    return jsonify([i.serialize() for i in items]), 200
+
+
 # ---------------------------
 # STRIPE CHECKOUT SESSION (PAGO)
 # ---------------------------
+def _order_from_cart(user_id, status):
+    """
+    Copia el carrito en un Order + OrderItem (precio, título e imagen del momento) con
+    un número fijo de sentencias sea cual sea el tamaño del carrito: INSERT order,
+    INSERT order_item ... SELECT desde cart_item + product y UPDATE del total.
+    No hace commit ni vacía el carrito. Devuelve (order, líneas) o (None, 0) si está vacío.
+    """
+    # bloquea las líneas del carrito (PostgreSQL) para que no cambien mientras se copian
+    cart_ids = db.session.execute(
+        select(CartItem.id).where(CartItem.user_id == user_id).with_for_update()
+    ).scalars().all()
+    if not cart_ids:
+        return None, 0
+
+    order = Order(user_id=user_id, total_cents=0, status=status)
+    db.session.add(order)
+    db.session.flush()
+
+    copied = db.session.execute(
+        insert(OrderItem).from_select(
+            ["order_id", "product_id", "quantity", "unit_price_cents", "product_title", "product_image_url"],
+            select(literal(order.id), CartItem.product_id, CartItem.quantity, Product.price_cents,
+                   Product.title, Product.image_url)
+            .join(Product, Product.id == CartItem.product_id)
+            .where(CartItem.user_id == user_id)
+            .order_by(CartItem.id),
+        )
+    ).rowcount
+
+    total = (
+        select(func.coalesce(func.sum(OrderItem.quantity * OrderItem.unit_price_cents), 0))
+        .where(OrderItem.order_id == order.id)
+        .scalar_subquery()
+    )
+    db.session.execute(
+        update(Order).where(Order.id == order.id).values(total_cents=total)
+        .execution_options(synchronize_session=False)
+    )
+    return order, copied
+
+
+def _abandon_pending_orders(user_id):
+    """
+    Caduca los pedidos "pending" anteriores del usuario: primero su sesión de Stripe
+    y, si Stripe lo confirma, el pedido pasa a "expired" y su reserva vuelve al
+    stock (lo mismo que haría el webhook checkout.session.expired). Los que aún no
+    tienen sesión solo se tocan si son viejos: puede haber otro pago creándola.
+    """
+    in_flight = datetime.now(timezone.utc) - timedelta(seconds=stripe_checkout.REUSE_MARGIN)
+    pending = db.session.execute(
+        select(Order.id, Order.stripe_session_id, Order.created_at)
+        .where(Order.user_id == user_id, Order.status == "pending")
+    ).all()
+    abandoned = [
+        order_id for order_id, session_id, created_at in pending
+        if (stripe_checkout.expire_session(stripe, session_id) if session_id
+            else as_utc(created_at) < in_flight)
+    ]
+    for order_id in abandoned:
+        if stripe_events.transition(Order.id == order_id, "expired"):
+            inventory.release([order_id])
+    db.session.commit()
+
+
 @api.route("/checkout-session", methods=["POST"])
 @jwt_required()
 def create_checkout_session():
+    """
+    Crea el pedido en estado "pending" a partir del carrito y la sesión de Stripe Checkout
+    para pagarlo. El pedido pasa a "paid" cuando llega el webhook de Stripe, no antes.
+
+    Si ya hay una sesión abierta para exactamente el mismo carrito (misma huella),
+    devuelve esa ("reused": true) sin llamar a Stripe ni crear otro pedido.
+
+    El stock de las líneas se reserva en la misma transacción que el pedido
+    (inventory.py); si algún producto no llega responde 409 con sus ids. Antes se
+    caducan los pedidos "pending" anteriores del usuario (sesión y reserva).
+    """
     if stripe is None:
         return jsonify({"error": "Stripe no está instalado en el backend. Añade 'stripe' a requirements.txt"}), 500
 
@@ -299,51 +948,222 @@ def create_checkout_session():
         return jsonify({"error": "Falta FRONTEND_URL en el backend"}), 500
 
     user_id = int(get_jwt_identity())
-    items = CartItem.query.filter_by(user_id=user_id).all()
-    if not items:
+    cart_lines = db.session.execute(
+        select(CartItem.product_id, CartItem.quantity, Product.price_cents, Product.title)
+        .join(Product, Product.id == CartItem.product_id)
+        .where(CartItem.user_id == user_id)
+    ).all()
+    if not cart_lines:
         return jsonify({"error": "El carrito está vacío"}), 400
 
-    line_items = []
-    for it in items:
-        if not it.product:
-            continue
-        line_items.append({
-            "quantity": int(it.quantity or 1),
-            "price_data": {
-                "currency": "eur",
-                "unit_amount": int(it.product.price_cents),
-                "product_data": {"name": it.product.title},
-            },
-        })
-
+    fingerprint = stripe_checkout.cart_fingerprint(cart_lines)
+    open_session = stripe_checkout.cached_session(user_id, fingerprint)
+    if open_session is not None:
+        status = db.session.scalar(select(Order.status).where(Order.id == open_session["order_id"]))
+        if status == "pending":
+            return jsonify({"url": open_session["url"], "order_id": open_session["order_id"], "reused": True}), 200
+        # ya pagado, caducado o fallido: hace falta una sesión nueva
+        stripe_checkout.forget_session(user_id, fingerprint)
+
+    # el carrito cambió desde el último intento: el pedido anterior no debe poder
+    # pagarse ni seguir reteniendo stock (el usuario chocaría con su propia reserva)
+    _abandon_pending_orders(user_id)
+
+    order, copied = _order_from_cart(user_id, status="pending")
+    if order is None or copied == 0:
+        db.session.rollback()
+        return jsonify({"error": "El carrito está vacío"}), 400
+    order_id = order.id
+
+    # se cobra (y se reserva) exactamente la copia guardada en el pedido
+    lines = db.session.execute(
+        select(OrderItem.product_id, OrderItem.quantity, OrderItem.unit_price_cents, OrderItem.product_title)
+        .where(OrderItem.order_id == order_id)
+        .order_by(OrderItem.id)
+    ).all()
+    expires_at = int(time.time()) + stripe_checkout.SESSION_TTL
     try:
-        session = stripe.checkout.Session.create(
-            mode="payment",
-            line_items=line_items,
-            success_url=f"{FRONTEND_URL}/checkout/success",
-            cancel_url=f"{FRONTEND_URL}/checkout/cancel",
+        inventory.reserve(
+            order_id, [(product_id, quantity) for product_id, quantity, _, _ in lines],
+            datetime.fromtimestamp(expires_at, timezone.utc) + inventory.RESERVATION_GRACE,
         )
-        return jsonify({"url": session.url}), 200
+    except inventory.OutOfStock as e:
+        db.session.rollback()
+        return jsonify({"error": str(e), "product_ids": e.product_ids}), 409
+    db.session.commit()
+    line_items = [{
+        "quantity": int(quantity or 1),
+        "price_data": {
+            "currency": "eur",
+            "unit_amount": int(unit_price_cents),
+            "product_data": {"name": title},
+        },
+    } for _, quantity, unit_price_cents, title in lines]
+
+    try:
+        with outbound.timed("stripe.checkout.sessions.create"):
+            session = stripe.checkout.Session.create(
+                mode="payment",
+                line_items=line_items,
+                client_reference_id=str(order_id),
+                metadata={"order_id": str(order_id)},
+                expires_at=expires_at,
+                success_url=f"{FRONTEND_URL}/checkout/success?session_id={{CHECKOUT_SESSION_ID}}",
+                cancel_url=f"{FRONTEND_URL}/checkout/cancel",
+            )
     except Exception as e:
+        db.session.execute(update(Order).where(Order.id == order_id).values(status="failed"))
+        inventory.release([order_id])
+        db.session.commit()
         return jsonify({"error": str(e)}), 500
 
+    db.session.execute(update(Order).where(Order.id == order_id).values(stripe_session_id=session.id))
+    db.session.commit()
+    # la huella se calcula sobre la copia: es lo que realmente se cobra en esta sesión
+    stripe_checkout.remember_session(user_id, stripe_checkout.cart_fingerprint(lines), order_id,
+                                     session.id, session.url, expires_at)
+    return jsonify({"url": session.url, "order_id": order_id, "reused": False}), 200
+
 
 # ---------------------------
-# Limpia el carrito despues del pago
+# Vuelta de Stripe: vacía del carrito lo que se ha pedido
 # ---------------------------
 @api.route("/checkout/success", methods=["POST"])
 @jwt_required()
 def checkout_success():
+    """
+    Body (o query): session_id de Stripe Checkout. No marca nada como pagado (eso
+    lo hace el webhook): solo quita del carrito los productos del pedido con un
+    DELETE masivo y devuelve el pedido con su estado actual.
+    """
     user_id = int(get_jwt_identity())
+    data = request.get_json(silent=True) or {}
+    session_id = data.get("session_id") or request.args.get("session_id")
+    if not session_id:
+        return jsonify({"error": "session_id es requerido"}), 400
+
+    order = Order.query.filter_by(user_id=user_id, stripe_session_id=session_id).first()
+    if not order:
+        return jsonify({"error": "Pedido no encontrado"}), 404
+
+    ordered_products = select(OrderItem.product_id).where(OrderItem.order_id == order.id)
+    cleared = db.session.execute(
+        delete(CartItem)
+        .where(CartItem.user_id == user_id, CartItem.product_id.in_(ordered_products))
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    lines = db.session.execute(
+        select(OrderItem.product_id, OrderItem.quantity, OrderItem.unit_price_cents, OrderItem.product_title)
+        .where(OrderItem.order_id == order.id)
+    ).all()
 
-    items = CartItem.query.filter_by(user_id=user_id).all()
-    cleared = len(items)
+    db.session.commit()
+    bump_cart_generation(user_id)
+    # la sesión ya se usó: el mismo carrito en el futuro necesita una nueva
+    stripe_checkout.forget_session(user_id, stripe_checkout.cart_fingerprint(lines))
+    return jsonify({
+        "message": "Carrito vaciado ✅",
+        "cleared": cleared,
+        "order": order.summary(item_count=len(lines)),
+    }), 200
 
-    for it in items:
-        db.session.delete(it)
 
-    db.session.commit()
-    return jsonify({"message": "Carrito vaciado ✅", "cleared": cleared}), 200
+# ---------------------------
+# STRIPE WEBHOOK
+# ---------------------------
+@api.route("/stripe/webhook", methods=["POST"])
+def stripe_webhook():
+    """
+    Verifica la firma, guarda el evento (una sola vez por id) y encola su procesado.
+    Responde enseguida: Stripe reintenta si tarda o falla.
+    """
+    secret = os.getenv("STRIPE_WEBHOOK_SECRET", "")
+    if not secret:
+        return jsonify({"error": "Stripe no está configurado (falta STRIPE_WEBHOOK_SECRET)"}), 500
+
+    payload = request.get_data()
+    try:
+        stripe_events.verify_signature(payload, request.headers.get("Stripe-Signature"), secret)
+        event = stripe_events.parse_event(payload)
+    except stripe_events.SignatureError as e:
+        return jsonify({"error": str(e)}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not stripe_events.record_event(event, payload):
+        db.session.rollback()
+        return jsonify({"received": True, "duplicate": True}), 200
+
+    # el evento y su tarea se guardan en el mismo commit
+    jobs.enqueue("stripe_event", {"event_id": event["id"]})
+    return jsonify({"received": True, "duplicate": False}), 200
+
+
+# ---------------------------
+# PEDIDOS
+# ---------------------------
+ORDERS_DEFAULT_LIMIT = 20
+ORDERS_MAX_LIMIT = 100
+
+
+@api.route("/orders", methods=["GET"])
+@jwt_required()
+def list_orders():
+    """
+    Historial de pedidos del usuario, del más reciente al más antiguo (keyset por id).
+    Cada fila es un resumen: total guardado y número de líneas, sin cargar los items.
+
+    Query params:
+    - limit: número (por defecto 20, máximo 100)
+    - cursor: valor next_cursor de la página anterior
+    """
+    user_id = int(get_jwt_identity())
+    args = request.args
+    try:
+        limit = parse_limit(args.get("limit"), ORDERS_DEFAULT_LIMIT, ORDERS_MAX_LIMIT)
+        last_id = int(decode_cursor(args["cursor"])[0]) if args.get("cursor") else None
+    except (ValueError, IndexError, TypeError) as e:
+        return jsonify({"error": str(e) or "parámetros inválidos"}), 400
+
+    item_count = (
+        select(func.count(OrderItem.id))
+        .where(OrderItem.order_id == Order.id)
+        .correlate(Order)
+        .scalar_subquery()
+    )
+    # mismas claves que Order.summary(), como tuplas
+    query = (
+        select(Order.id, Order.user_id, Order.total_cents, Order.status, Order.created_at,
+               item_count.label("item_count"))
+        .where(Order.user_id == user_id)
+    )
+    if last_id is not None:
+        query = query.where(Order.id < last_id)
+    result = db.session.execute(query.order_by(Order.id.desc()).limit(limit + 1))
+    keys = tuple(result.keys())
+    rows = result.all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return serialization.json_response({
+        "items": serialization.row_dicts(rows, keys),
+        "next_cursor": encode_cursor(rows[-1].id) if has_more else None,
+        "limit": limit,
+    })
+
+
+@api.route("/orders/<int:order_id>", methods=["GET"])
+@jwt_required()
+def get_order(order_id):
+    user_id = int(get_jwt_identity())
+    order = (
+        Order.query.options(selectinload(Order.items))
+        .filter_by(id=order_id, user_id=user_id)
+        .first()
+    )
+    if not order:
+        return jsonify({"error": "Pedido no encontrado"}), 404
+    return jsonify(order.serialize()), 200
 
 
 # ---------------------------
@@ -352,54 +1172,58 @@ def checkout_success():
 @api.route("/import-products", methods=["POST"])
 def import_products():
     """
-    Descarga productos desde DummyJSON y los guarda en tu tabla Product.
+    Encola una importación de productos desde DummyJSON (o PRODUCT_IMPORT_FILE /
+    PRODUCT_IMPORT_URL). La hace el worker (`flask jobs-worker`); responde 202
+    con el id de la tarea, que se consulta en GET /api/jobs/<id>.
 
     Body opcional:
-    - replace: true/false (si true, borra productos antes de importar)
+    - replace: true/false (si true, borra productos antes de importar; los pedidos
+      conservan sus líneas sin producto y se vacían carritos y reservas)
+    - mode: "insert" (por defecto) o "upsert" (sincroniza por external_id:
+      inserta los nuevos y actualiza solo los que cambiaron, sin borrar nada)
     - limit: número (por defecto 50)
+    - page_size: productos por página pedida a DummyJSON (por defecto 100)
+    - chunk_size: filas por INSERT/commit (por defecto 1000)
     """
     payload = request.get_json(silent=True) or {}
     replace = bool(payload.get("replace", False))
-    limit = int(payload.get("limit", 50))
-
-    if replace:
-        Product.query.delete()
-        db.session.commit()
-    else:
-        existing = Product.query.count()
-        if existing > 0:
+    mode = payload.get("mode", "insert")
+    try:
+        job_payload = {
+            "replace": replace,
+            "mode": mode,
+            "limit": int(payload.get("limit", 50)),
+            "page_size": int(payload.get("page_size", importer.DEFAULT_PAGE_SIZE)),
+            "chunk_size": int(payload.get("chunk_size", importer.DEFAULT_CHUNK_SIZE)),
+        }
+    except (TypeError, ValueError):
+        return jsonify({"error": "limit, page_size y chunk_size deben ser números"}), 400
+
+    if mode not in ("insert", "upsert"):
+        return jsonify({"error": "mode debe ser insert o upsert"}), 400
+
+    if mode == "upsert" and replace:
+        return jsonify({"error": "replace no se puede usar con mode=upsert"}), 400
+
+    if mode == "insert" and not replace:
+        # basta con saber si hay alguno (sin COUNT sobre toda la tabla)
+        if db.session.query(Product.id).limit(1).first():
             return jsonify({
                 "message": "Ya hay productos en la BD, no se importó nada (usa replace=true)",
-                "count": existing
             }), 200
 
-    try:
-        r = requests.get(f"https://dummyjson.com/products?limit={limit}", timeout=20, headers={
-            "User-Agent": "Mozilla/5.0 (Marketly Importer)",
-            "Accept": "application/json",
-        })
-        r.raise_for_status()
-        payload = r.json()
-        data = payload.get("products", [])
-    except Exception as e:
-        return jsonify({"error": f"No se pudo leer DummyJSON: {str(e)}"}), 502
-
-    created = 0
-    for p in data:
-        price = p.get("price", 0) or 0
-        try:
-            price_cents = int(round(float(price) * 100))
-        except Exception:
-            price_cents = 0
-
-        product = Product(
-            title=(p.get("title") or "Producto sin título")[:200],
-            description=(p.get("description") or "")[:2000],
-            price_cents=price_cents,
-            image_url=p.get("thumbnail", "") or "",
-        )
-        db.session.add(product)
-        created += 1
-
-    db.session.commit()
-    return jsonify({"message": "Productos importados ✅", "count": created}), 201
+    job = jobs.enqueue("import_products", job_payload)
+    return jsonify({
+        "message": "Importación encolada",
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}",
+    }), 202
+
+
+@api.route("/jobs/<int:job_id>", methods=["GET"])
+def get_job(job_id):
+    job = Job.query.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.serialize()), 200
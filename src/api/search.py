@@ -0,0 +1,312 @@
+"""
+Búsqueda de productos con el índice de texto completo de la BD.
+
+- SQLite: tabla virtual FTS5 `product_fts` (contenido externo = product) con
+  triggers, así que cualquier escritura (rutas, importador, admin) la mantiene.
+- PostgreSQL: columna generada `product.search_vector` (tsvector) con índice GIN.
+
+Ranking: bm25 en SQLite, ts_rank_cd en PostgreSQL; el título pesa más que la
+descripción. Cada palabra de la consulta se busca como prefijo.
+
+Si la BD no tiene índice de texto completo (otro motor, o un SQLite creado con
+create_all como el /tmp/test.db de desarrollo) se usa un índice invertido en
+memoria (inverted_index.py) construido a partir de la tabla product la primera
+vez que se busca. SEARCH_ENGINE=db|memory fuerza uno u otro (por defecto auto).
+"""
+import os
+import re
+import time
+import threading
+from sqlalchemy import text, select, func
+from src.api.models import db, Product
+from src.api.cache import catalog_generation
+from src.api.inverted_index import InvertedIndex
+
+# Palabras (con acentos) de la consulta; todo lo demás se descarta
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+MAX_TOKENS = 8
+
+ENGINES = ("db", "memory")
+SEARCH_ENGINE = os.getenv("SEARCH_ENGINE", "auto").lower()
+
+SQLITE_DDL = (
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS product_fts USING fts5(
+        title, description, content='product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF title, description ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO product_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+)
+
+POSTGRES_DDL = (
+    """
+    ALTER TABLE product ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_product_search_vector ON product USING GIN (search_vector)",
+)
+
+
+def dialect_name(bind=None):
+    return (bind or db.session.get_bind()).dialect.name
+
+
+def ensure_search_index(conn):
+    """Crea el índice si falta (para BDs creadas con create_all en vez de migraciones)."""
+    name = conn.dialect.name
+    if name == "sqlite":
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_fts'"
+        )).first()
+        for ddl in SQLITE_DDL:
+            conn.execute(text(ddl))
+        if not exists:
+            rebuild_search_index(conn)
+    elif name == "postgresql":
+        for ddl in POSTGRES_DDL:
+            conn.execute(text(ddl))
+    _native_index.pop(str(conn.engine.url), None)
+
+
+def rebuild_search_index(conn):
+    if conn.dialect.name == "sqlite":
+        conn.execute(text("INSERT INTO product_fts(product_fts) VALUES ('rebuild')"))
+    # en PostgreSQL la columna es generada: siempre está al día
+
+
+def tokenize_query(q):
+    return _TOKEN_RE.findall(q or "")[:MAX_TOKENS]
+
+
+def _sqlite_match(tokens):
+    # "palabra"* = prefijo; las comillas evitan que se interpreten operadores FTS5
+    return " ".join(f'"{t}"*' for t in tokens)
+
+
+def _postgres_tsquery(tokens):
+    return " & ".join(f"{t}:*" for t in tokens)
+
+
+_native_index = {}
+
+
+def has_native_index(bind):
+    """¿Tiene la BD índice de texto completo? (se comprueba una vez por engine)"""
+    key = str(bind.url)
+    if key not in _native_index:
+        name = bind.dialect.name
+        if name == "sqlite":
+            with bind.connect() as conn:
+                _native_index[key] = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'product_fts'"
+                )).first() is not None
+        else:
+            _native_index[key] = name == "postgresql"
+    return _native_index[key]
+
+
+def default_engine(session=None):
+    if SEARCH_ENGINE in ENGINES:
+        return SEARCH_ENGINE
+    bind = (session or db.session).get_bind()
+    return "db" if has_native_index(bind) else "memory"
+
+
+def search_products(q, limit, offset=0, session=None, engine=None):
+    """
+    Devuelve (filas, hay_más). Cada fila es un dict con los campos de Product.serialize()
+    sin description, más "rank" (mayor = más relevante).
+    engine: "db" (índice de la BD) o "memory" (índice invertido); por defecto default_engine().
+    """
+    session = session or db.session
+    tokens = tokenize_query(q)
+    if not tokens:
+        return [], False
+
+    engine = engine or default_engine(session)
+    if engine == "memory":
+        return _search_memory(session, " ".join(tokens), limit, offset)
+
+    name = dialect_name(session.get_bind())
+    if name == "sqlite":
+        sql = text("""
+            SELECT p.id, p.title, p.price_cents, p.image_url, p.created_at, p.updated_at,
+                   -bm25(product_fts, 10.0, 1.0) AS rank
+            FROM product_fts JOIN product p ON p.id = product_fts.rowid
+            WHERE product_fts MATCH :match
+            ORDER BY bm25(product_fts, 10.0, 1.0), p.id
+            LIMIT :limit OFFSET :offset
+        """).columns(created_at=Product.created_at.type, updated_at=Product.updated_at.type)
+        params = {"match": _sqlite_match(tokens)}
+    elif name == "postgresql":
+        sql = text("""
+            SELECT p.id, p.title, p.price_cents, p.image_url, p.created_at, p.updated_at,
+                   ts_rank_cd(p.search_vector, query) AS rank
+            FROM product p, to_tsquery('simple', :tsquery) AS query
+            WHERE p.search_vector @@ query
+            ORDER BY rank DESC, p.id
+            LIMIT :limit OFFSET :offset
+        """)
+        params = {"tsquery": _postgres_tsquery(tokens)}
+    else:
+        raise ValueError(f"{name} no tiene índice de texto completo: usa engine=memory")
+
+    rows = session.execute(sql, {**params, "limit": limit + 1, "offset": offset}).mappings().all()
+    return [_row_to_dict(r) for r in rows[:limit]], len(rows) > limit
+
+
+def _row_to_dict(row):
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "price_cents": row["price_cents"],
+        "image_url": row["image_url"],
+        "created_at": row["created_at"].isoformat() if row["created_at"] else None,
+        "updated_at": row["updated_at"].isoformat() if row["updated_at"] else None,
+        "rank": round(float(row["rank"]), 6) if row.get("rank") is not None else None,
+    }
+
+
+# ---------------------------
+# Índice en memoria
+# ---------------------------
+class MemorySearch:
+    """
+    InvertedIndex + sincronización con la tabla product.
+
+    Las rutas de productos actualizan el índice del propio proceso al momento
+    (index_product / unindex_product). Los cambios hechos por otros procesos
+    (otros workers de gunicorn, el importador) se detectan por la generación del
+    catálogo: si cambió, se reindexan las filas con updated_at >= la última vista
+    y, si el número de productos no cuadra, se comparan los ids para quitar los borrados.
+    """
+
+    def __init__(self):
+        self.index = InvertedIndex()
+        self.generation = None
+        self.last_seen = None
+        self.build_seconds = None
+        self._lock = threading.Lock()
+
+    def _columns(self):
+        return select(Product.id, Product.title, Product.description, Product.updated_at)
+
+    def _add_rows(self, rows):
+        for product_id, title, description, updated_at in rows:
+            self.index.add(product_id, title, description)
+            if updated_at is not None and (self.last_seen is None or updated_at > self.last_seen):
+                self.last_seen = updated_at
+
+    def build(self, session):
+        start = time.perf_counter()
+        # la generación se lee antes de cargar: lo que cambie durante la carga se verá en el siguiente sync
+        generation = catalog_generation(session)
+        self._add_rows(session.execute(self._columns().execution_options(yield_per=5000)))
+        self.generation = generation
+        self.build_seconds = time.perf_counter() - start
+
+    def sync(self, session):
+        generation = catalog_generation(session)
+        if generation == self.generation:
+            return
+        with self._lock:
+            if generation == self.generation:
+                return
+            if self.last_seen is not None:
+                # >= porque varias filas pueden compartir updated_at; reindexar es idempotente
+                self._add_rows(session.execute(self._columns().where(Product.updated_at >= self.last_seen)))
+
+            count = session.scalar(select(func.count()).select_from(Product))
+            if count != len(self.index):
+                ids = set(session.scalars(select(Product.id)))
+                indexed = set(self.index.ids())
+                for product_id in indexed - ids:
+                    self.index.remove(product_id)
+                missing = ids - indexed
+                if missing:
+                    self._add_rows(session.execute(self._columns().where(Product.id.in_(missing))))
+            self.generation = generation
+
+    def stats(self):
+        return {
+            **self.index.stats(),
+            "build_seconds": round(self.build_seconds, 3) if self.build_seconds is not None else None,
+        }
+
+
+_memory = None
+_memory_lock = threading.Lock()
+
+
+def memory_search(session=None):
+    """El índice en memoria del proceso; se construye la primera vez que se pide."""
+    global _memory
+    if _memory is None:
+        with _memory_lock:
+            if _memory is None:
+                memory = MemorySearch()
+                memory.build(session or db.session)
+                _memory = memory
+    return _memory
+
+
+def reset_memory_search():
+    global _memory
+    _memory = None
+
+
+def index_product(product):
+    """Tras crear/editar un producto. No hace nada si el índice en memoria no está cargado."""
+    if _memory is not None:
+        _memory.index.add(product.id, product.title, product.description)
+
+
+def unindex_product(product_id):
+    if _memory is not None:
+        _memory.index.remove(product_id)
+
+
+def memory_stats():
+    if _memory is None:
+        return {"loaded": False}
+    return {"loaded": True, **_memory.stats()}
+
+
+def _search_memory(session, q, limit, offset):
+    memory = memory_search(session)
+    memory.sync(session)
+    hits, has_more = memory.index.search(q, limit, offset)
+    if not hits:
+        return [], False
+
+    rows = session.execute(
+        select(Product.id, Product.title, Product.price_cents, Product.image_url,
+               Product.created_at, Product.updated_at)
+        .where(Product.id.in_([product_id for product_id, _ in hits]))
+    ).mappings().all()
+    by_id = {r["id"]: r for r in rows}
+    # un producto borrado por otro proceso aún no sincronizado simplemente no aparece
+    return [
+        _row_to_dict({**by_id[product_id], "rank": score})
+        for product_id, score in hits if product_id in by_id
+    ], has_more
@@ -0,0 +1,112 @@
+"""
+Serialización JSON rápida para los listados.
+
+El camino habitual (`jsonify([p.serialize() for p in query.all()])`) construye una
+entidad ORM por fila, luego un dict con `isoformat()` por fecha y al final lo
+codifica todo de golpe con el módulo json. Aquí:
+- se piden solo las columnas necesarias con select() de Core (tuplas, sin
+  entidades ni identity map) y cada fila es dict(zip(claves, tupla));
+- el codificador es orjson si está instalado (convierte las fechas él mismo, con
+  el mismo formato que isoformat()) y si no json de la stdlib con default=;
+  JSON_ENCODER=json fuerza la stdlib;
+- los listados completos (GET /api/products?all=true, GET /api/users) se envían
+  como un array JSON en streaming por bloques de STREAM_CHUNK_ROWS filas: la
+  memoria no crece con el número de filas y el primer byte sale enseguida.
+
+Lo que va a la caché (cache.py guarda con json.dumps) debe llevar las fechas ya
+como texto: para eso está row_dicts(); stream_array() y dumps() aceptan datetime.
+"""
+import os
+import json
+from datetime import date, datetime
+from flask import current_app, stream_with_context
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+STREAM_CHUNK_ROWS = int(os.getenv("JSON_STREAM_CHUNK_ROWS", 1000))
+MIMETYPE = "application/json"
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} no es serializable a JSON")
+
+
+def _stdlib_dumps(value):
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_default).encode()
+
+
+def _orjson_dumps(value):
+    return orjson.dumps(value, default=_default)
+
+
+def choose_encoder(name=None):
+    """(nombre, función valor -> bytes) según JSON_ENCODER: auto (orjson si está), orjson o json."""
+    name = (name or os.getenv("JSON_ENCODER", "auto")).lower()
+    if name == "auto":
+        name = "orjson" if orjson is not None else "json"
+    if name == "orjson":
+        if orjson is None:
+            raise ValueError("JSON_ENCODER=orjson pero orjson no está instalado")
+        return name, _orjson_dumps
+    if name == "json":
+        return name, _stdlib_dumps
+    raise ValueError(f"JSON_ENCODER desconocido: {name}")
+
+
+ENCODER, dumps = choose_encoder()
+
+
+# ---------------------------
+# Filas
+# ---------------------------
+def column_keys(columns):
+    return tuple(column.key for column in columns)
+
+
+def row_dicts(rows, keys):
+    """Tuplas -> dicts con las fechas ya en texto (lo que se puede guardar en caché). Para páginas cortas."""
+    return [
+        {key: value.isoformat() if isinstance(value, (datetime, date)) else value for key, value in zip(keys, row)}
+        for row in rows
+    ]
+
+
+def stream_array(rows, keys, encode=None, chunk_rows=None):
+    """Genera el array JSON de las filas por trozos (bytes). `rows` puede ser un resultado con yield_per."""
+    encode = encode or dumps
+    chunk_rows = chunk_rows or STREAM_CHUNK_ROWS
+    yield b"["
+    chunk, first = [], True
+    for row in rows:
+        chunk.append(dict(zip(keys, row)))
+        if len(chunk) >= chunk_rows:
+            # "[a,b]" -> "a,b": cada bloque se codifica de una vez y se encadena con comas
+            yield (b"" if first else b",") + encode(chunk)[1:-1]
+            chunk, first = [], False
+    if chunk:
+        yield (b"" if first else b",") + encode(chunk)[1:-1]
+    yield b"]"
+
+
+# ---------------------------
+# Respuestas
+# ---------------------------
+def json_response(data, status=200):
+    """Como jsonify() pero con el codificador elegido."""
+    return current_app.response_class(dumps(data), status=status, mimetype=MIMETYPE)
+
+
+def stream_response(rows, keys, status=200):
+    """
+    Array JSON en streaming. La consulta sigue leyéndose mientras se envía, así
+    que la petición conserva su contexto (y la sesión de BD) hasta el final. Si
+    falla a mitad ya no se puede cambiar el código de estado: el cliente recibe
+    un JSON cortado.
+    """
+    return current_app.response_class(stream_with_context(stream_array(rows, keys)), status=status,
+                                      mimetype=MIMETYPE)
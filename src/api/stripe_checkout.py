@@ -0,0 +1,98 @@
+"""
+Cliente de Stripe Checkout: pool de conexiones compartido y reutilización de sesiones.
+
+- Un requests.Session con keep-alive para todas las llamadas a Stripe (el cliente
+  por defecto de la librería no reutiliza conexiones entre hilos como queremos).
+- Las sesiones abiertas se guardan en la caché compartida (cache.py) con la huella
+  del carrito: mientras el carrito no cambie y la sesión no caduque, volver a pulsar
+  "pagar" devuelve la misma URL sin llamar a Stripe ni crear otro pedido.
+
+Configuración por entorno: STRIPE_API_BASE (p. ej. el servidor falso de
+fake_stripe.py), STRIPE_POOL_SIZE, STRIPE_TIMEOUT y CHECKOUT_SESSION_TTL.
+"""
+import os
+import time
+import hashlib
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from src.api.cache import cache
+from src.api import outbound
+
+logger = logging.getLogger(__name__)
+
+# Stripe exige que una sesión dure al menos 30 minutos
+SESSION_TTL = max(1800, int(os.getenv("CHECKOUT_SESSION_TTL", 1800)))
+# no se reutiliza una sesión a la que le quede menos que esto
+REUSE_MARGIN = 120
+
+POOL_SIZE = int(os.getenv("STRIPE_POOL_SIZE", 10))
+TIMEOUT = float(os.getenv("STRIPE_TIMEOUT", 20))
+
+
+def configure(stripe):
+    stripe.api_key = os.getenv("STRIPE_SECRET_KEY", "")
+    api_base = os.getenv("STRIPE_API_BASE")
+    if api_base:
+        stripe.api_base = api_base.rstrip("/")
+    stripe.default_http_client = make_http_client(stripe)
+
+
+def make_http_client(stripe):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return stripe.RequestsClient(session=session, timeout=TIMEOUT)
+
+
+def cart_fingerprint(lines):
+    """Huella del carrito a partir de (product_id, quantity, price_cents, title) ordenados."""
+    raw = "\x1e".join("\x1f".join(str(v) for v in line) for line in sorted(lines))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def session_key(user_id, fingerprint):
+    return f"checkout:{user_id}:{fingerprint}"
+
+
+def cached_session(user_id, fingerprint):
+    """Sesión abierta para este carrito exacto, o None si no hay o está a punto de caducar."""
+    entry = cache.get(session_key(user_id, fingerprint))
+    if entry is None or entry["expires_at"] - time.time() < REUSE_MARGIN:
+        return None
+    return entry
+
+
+def remember_session(user_id, fingerprint, order_id, session_id, url, expires_at):
+    entry = {"order_id": order_id, "session_id": session_id, "url": url, "expires_at": expires_at}
+    cache.set(session_key(user_id, fingerprint), entry, ttl=max(1, int(expires_at - time.time())))
+    return entry
+
+
+def forget_session(user_id, fingerprint):
+    cache.delete(session_key(user_id, fingerprint))
+
+
+def expire_session(stripe, session_id):
+    """
+    Caduca una sesión de Checkout para que ya no se pueda pagar. True si ya no
+    admite pagos (caducada ahora o antes); False si está pagada o si Stripe no
+    lo confirma (el pedido se deja como está y lo resolverá el webhook).
+    """
+    try:
+        with outbound.timed("stripe.checkout.sessions.expire"):
+            stripe.checkout.Session.expire(session_id)
+        return True
+    except stripe.InvalidRequestError:
+        # solo se pueden caducar sesiones abiertas: ¿ya había caducado o está pagada?
+        try:
+            with outbound.timed("stripe.checkout.sessions.retrieve"):
+                session = stripe.checkout.Session.retrieve(session_id)
+        except stripe.StripeError as e:
+            logger.warning("No se pudo consultar la sesión %s: %s", session_id, e)
+            return False
+        return session.status == "expired"
+    except stripe.StripeError as e:
+        logger.warning("No se pudo caducar la sesión %s: %s", session_id, e)
+        return False
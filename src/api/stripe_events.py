@@ -0,0 +1,200 @@
+"""
+Webhook de Stripe: verificación de firma, registro de eventos y transiciones de Order.status.
+
+La ruta (POST /api/stripe/webhook) solo verifica la firma, guarda el cuerpo en
+stripe_event (append-only, índice único por id de evento: los reenvíos de
+Stripe no hacen nada) y encola una tarea "stripe_event". El worker de jobs.py
+aplica después el cambio de estado del pedido con un UPDATE condicional, así
+que reprocesar o recibir eventos desordenados no retrocede un pedido, y
+confirma o devuelve su reserva de stock (inventory.py).
+"""
+import os
+import hmac
+import json
+import time
+import hashlib
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from src.api.models import db, Order, StripeEvent
+from src.api import inventory
+
+# eventos grabados de Stripe (modo test) para reproducirlos sin red: `flask stripe-replay`
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "stripe")
+
+# tolerancia de la marca de tiempo de la firma (la misma que usa la librería de Stripe)
+SIGNATURE_TOLERANCE = 300
+
+# estado destino -> estados desde los que se puede llegar
+TRANSITIONS = {
+    "processing": ("pending",),
+    "paid": ("pending", "processing"),
+    "failed": ("pending", "processing"),
+    "expired": ("pending",),
+    "refunded": ("paid",),
+}
+
+
+# qué hacer con la reserva de stock del pedido al llegar a cada estado
+STOCK_ACTIONS = {
+    "paid": inventory.commit,
+    "failed": inventory.release,
+    "expired": inventory.release,
+}
+
+
+class SignatureError(Exception):
+    pass
+
+
+def sign(payload, secret, timestamp=None):
+    """Cabecera Stripe-Signature para `payload` (bytes). Útil para reproducir eventos grabados."""
+    timestamp = int(timestamp if timestamp is not None else time.time())
+    signed = f"{timestamp}.".encode() + payload
+    signature = hmac.new(secret.encode(), signed, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def verify_signature(payload, header, secret, tolerance=SIGNATURE_TOLERANCE, now=None):
+    """Comprueba la cabecera Stripe-Signature (HMAC-SHA256 de "t.payload"). Lanza SignatureError."""
+    if not header:
+        raise SignatureError("Falta la cabecera Stripe-Signature")
+
+    timestamp, signatures = None, []
+    for part in header.split(","):
+        key, _, value = part.strip().partition("=")
+        if key == "t":
+            timestamp = value
+        elif key == "v1":
+            signatures.append(value)
+    try:
+        timestamp = int(timestamp)
+    except (TypeError, ValueError):
+        raise SignatureError("Cabecera Stripe-Signature inválida")
+    if not signatures:
+        raise SignatureError("La cabecera no trae firmas v1")
+
+    expected = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    if not any(hmac.compare_digest(expected, s) for s in signatures):
+        raise SignatureError("Firma inválida")
+    now = time.time() if now is None else now
+    if tolerance and abs(now - timestamp) > tolerance:
+        raise SignatureError("Firma caducada")
+
+
+def parse_event(payload):
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        raise ValueError("JSON inválido")
+    if not isinstance(event, dict) or not event.get("id") or not event.get("type"):
+        raise ValueError("El evento no tiene id/type")
+    return event
+
+
+RECORD_DIALECTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def record_event(event, payload):
+    """
+    Inserta el evento (sin commit). Devuelve False si ya estaba registrado.
+    En PostgreSQL/SQLite con ON CONFLICT DO NOTHING; en otros motores por IntegrityError.
+    """
+    values = {"event_id": event["id"], "type": event["type"], "payload": payload.decode("utf-8")}
+    dialect_insert = RECORD_DIALECTS.get(db.session.get_bind().dialect.name)
+    if dialect_insert is not None:
+        stmt = (
+            dialect_insert(StripeEvent)
+            .values(**values)
+            .on_conflict_do_nothing(index_elements=["event_id"])
+            .returning(StripeEvent.id)
+        )
+        return db.session.execute(stmt).scalar() is not None
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(StripeEvent(**values))
+    except IntegrityError:
+        return False
+    return True
+
+
+# ---------------------------
+# Procesado (worker)
+# ---------------------------
+def _order_filter(obj):
+    """Cómo encontrar el pedido de un objeto checkout.session."""
+    order_id = (obj.get("metadata") or {}).get("order_id") or obj.get("client_reference_id")
+    if order_id and str(order_id).isdigit():
+        return Order.id == int(order_id)
+    return Order.stripe_session_id == obj.get("id")
+
+
+def transition(condition, status, **values):
+    """UPDATE condicional: solo mueve pedidos que estén en un estado de origen válido."""
+    result = db.session.execute(
+        update(Order)
+        .where(condition, Order.status.in_(TRANSITIONS[status]))
+        .values(status=status, **values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def process_event(event_id):
+    """Aplica un evento ya registrado. Devuelve un resumen (resultado de la tarea)."""
+    row = db.session.execute(select(StripeEvent).where(StripeEvent.event_id == event_id)).scalar_one()
+    event = json.loads(row.payload)
+    obj = (event.get("data") or {}).get("object") or {}
+    kind = event["type"]
+
+    if kind == "checkout.session.completed":
+        status = "paid" if obj.get("payment_status") in ("paid", "no_payment_required") else "processing"
+        extra = {"stripe_payment_intent": obj.get("payment_intent")} if obj.get("payment_intent") else {}
+        condition = _order_filter(obj)
+        changed = transition(condition, status, **extra)
+    elif kind == "checkout.session.async_payment_succeeded":
+        condition = _order_filter(obj)
+        status, changed = "paid", transition(condition, "paid")
+    elif kind == "checkout.session.async_payment_failed":
+        condition = _order_filter(obj)
+        status, changed = "failed", transition(condition, "failed")
+    elif kind == "checkout.session.expired":
+        condition = _order_filter(obj)
+        status, changed = "expired", transition(condition, "expired")
+    elif kind == "charge.refunded" and obj.get("refunded") and obj.get("payment_intent"):
+        status = "refunded"
+        changed = transition(Order.stripe_payment_intent == obj["payment_intent"], "refunded")
+    else:
+        return {"event_id": event_id, "type": kind, "ignored": True}
+
+    # pagado: la reserva de stock se confirma; fallido/caducado: vuelve al stock
+    if changed and status in STOCK_ACTIONS:
+        STOCK_ACTIONS[status](select(Order.id).where(condition))
+    db.session.commit()
+    return {"event_id": event_id, "type": kind, "status": status, "updated": changed}
+
+
+# ---------------------------
+# Eventos grabados
+# ---------------------------
+def fixture_names():
+    return sorted(f[:-5] for f in os.listdir(FIXTURES_DIR) if f.endswith(".json"))
+
+
+def load_fixture(name, order_id=None, session_id=None, payment_intent=None, event_id=None):
+    """Evento grabado con los ids cambiados para que apunte a un pedido local."""
+    with open(os.path.join(FIXTURES_DIR, f"{name}.json"), encoding="utf-8") as f:
+        event = json.load(f)
+    obj = event["data"]["object"]
+    if event_id:
+        event["id"] = event_id
+    if obj.get("object") == "checkout.session":
+        if order_id is not None:
+            obj["client_reference_id"] = str(order_id)
+            obj["metadata"] = {**(obj.get("metadata") or {}), "order_id": str(order_id)}
+        if session_id:
+            obj["id"] = session_id
+    if payment_intent and obj.get("payment_intent"):
+        obj["payment_intent"] = payment_intent
+    return event
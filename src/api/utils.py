@@ -1,4 +1,10 @@
-from flask import jsonify, url_for
+import base64
+import json
+from contextlib import contextmanager
+from datetime import timezone
+from flask import jsonify, url_for, request, make_response
+from sqlalchemy import event
+from src.api.models import db
 
 class APIException(Exception):
     status_code = 400
@@ -15,6 +21,91 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+def encode_cursor(*values):
+    """Cursor opaco para paginación keyset (lista de valores -> base64)."""
+    raw = json.dumps(list(values), separators=(",", ":"), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """Inverso de encode_cursor. Lanza ValueError si el cursor no es válido."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("cursor inválido")
+    if not isinstance(values, list):
+        raise ValueError("cursor inválido")
+    return values
+
+def parse_limit(value, default=20, maximum=100):
+    """Lee ?limit= acotándolo a [1, maximum]. Lanza ValueError si no es un número."""
+    if value is None or value == "":
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError("limit debe ser un número")
+    return max(1, min(limit, maximum))
+
+def as_utc(dt):
+    """SQLite devuelve datetimes sin zona: se asume UTC."""
+    if dt is None:
+        return None
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+def not_modified(etag, last_modified=None):
+    """
+    Devuelve una respuesta 304 si el cliente ya tiene esta versión
+    (If-None-Match manda sobre If-Modified-Since), o None si hay que responder.
+    """
+    last_modified = as_utc(last_modified)
+    if request.if_none_match:
+        fresh = request.if_none_match.contains(etag)
+    elif request.if_modified_since and last_modified:
+        fresh = last_modified.replace(microsecond=0) <= request.if_modified_since
+    else:
+        fresh = False
+    if not fresh:
+        return None
+    response = make_response("", 304)
+    return with_validators(response, etag, last_modified)
+
+def with_validators(response, etag, last_modified=None):
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = as_utc(last_modified)
+    return response
+
+@contextmanager
+def count_queries(engine=None):
+    """
+    Cuenta las sentencias SQL ejecutadas dentro del bloque:
+
+        with count_queries() as statements:
+            client.get("/api/cart-items", headers=...)
+        print(len(statements))
+    """
+    engine = engine or db.engine
+    statements = []
+
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", _before_cursor_execute)
+
+@contextmanager
+def assert_max_queries(budget, engine=None):
+    """Falla (AssertionError) si el bloque ejecuta más de `budget` sentencias SQL."""
+    with count_queries(engine) as statements:
+        yield statements
+    if len(statements) > budget:
+        listing = "\n".join(f"  {i + 1}. {sql}" for i, sql in enumerate(statements))
+        raise AssertionError(f"{len(statements)} sentencias SQL (presupuesto {budget}):\n{listing}")
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
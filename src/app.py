@@ -10,6 +10,9 @@ from src.api.routes import api
 from src.api.utils import APIException, generate_sitemap
 from src.api.admin import setup_admin
 from src.api.commands import setup_commands
+from src.api.auth import setup_auth
+from src.api.metrics import setup_metrics
+from src.api.profiling import setup_profiling
 
 static_file_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "../dist/")
 
@@ -29,7 +32,10 @@ app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(days=7)
 
 db.init_app(app)
 Migrate(app, db, compare_type=True)
-JWTManager(app)
+jwt = JWTManager(app)
+setup_auth(jwt, app)
+setup_metrics(app)
+setup_profiling(app)
 
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
@@ -1,18 +1,19 @@
 import { Link, useNavigate } from "react-router-dom";
-import { useEffect } from "react";
+import { useEffect, useRef } from "react";
 import useGlobalReducer from "../hooks/useGlobalReducer";
 
+// cada cuánto se consulta el resumen del carrito (solo con la pestaña visible)
+const SUMMARY_POLL_MS = 30000;
+
 export default function Navbar() {
   const navigate = useNavigate();
   const { store, dispatch } = useGlobalReducer();
+  const summaryEtag = useRef(null);
 
-  const cartItems = Array.isArray(store?.cartItems) ? store.cartItems : [];
-
-  const cartCount = cartItems.reduce((acc, it) => acc + (it.quantity || 0), 0);
-  const totalPrice = cartItems.reduce(
-    (acc, it) => acc + ((it.product?.price_cents || 0) * (it.quantity || 0)) / 100,
-    0
-  );
+  // líneas compactas (solo se piden al abrir el desplegable) y totales calculados en el backend
+  const cartItems = Array.isArray(store?.cartLines) ? store.cartLines : [];
+  const cartCount = store?.cartSummary?.item_count || 0;
+  const totalPrice = (store?.cartSummary?.total_cents || 0) / 100;
 
   const logout = () => {
     dispatch({ type: "logout" });
@@ -24,10 +25,32 @@ export default function Navbar() {
     navigate("/login", { replace: true });
   };
 
+  // contador y total: respuesta de pocos bytes, y 304 si no ha cambiado nada
+  const refreshSummary = async (token = store?.token) => {
+    if (!token) return;
+
+    const headers = { Authorization: `Bearer ${token}` };
+    if (summaryEtag.current) headers["If-None-Match"] = summaryEtag.current;
+
+    const res = await fetch(`${store.backendUrl}/api/cart/summary`, { headers });
+
+    //  token caducado
+    if (res.status === 401) {
+      handleUnauthorized();
+      return;
+    }
+
+    if (res.status === 304 || !res.ok) return;
+
+    summaryEtag.current = res.headers.get("ETag");
+    const summary = await res.json();
+    dispatch({ type: "set_cart_summary", payload: summary });
+  };
+
   const refreshCart = async (token = store?.token) => {
     if (!token) return;
 
-    const res = await fetch(`${store.backendUrl}/api/cart-items`, {
+    const res = await fetch(`${store.backendUrl}/api/cart-items?view=compact`, {
       headers: { Authorization: `Bearer ${token}` },
     });
 
@@ -37,8 +60,9 @@ export default function Navbar() {
       return;
     }
 
-    const items = await res.json();
-    dispatch({ type: "set_cart", payload: items });
+    const lines = await res.json();
+    dispatch({ type: "set_cart_lines", payload: lines });
+    await refreshSummary(token);
   };
 
   // recargar el usuario 
@@ -61,15 +85,31 @@ export default function Navbar() {
     dispatch({ type: "set_me", payload: me });
   };
 
-  // al recargar la página, si hay token, recargar carrito + usuario
+  // al recargar la página, si hay token, recargar contador + usuario
   useEffect(() => {
+    summaryEtag.current = null;
     if (store?.token) {
-      refreshCart(store.token);
+      refreshSummary(store.token);
       refreshMe(store.token);
     }
     
   }, [store?.token]);
 
+  // otras páginas cambian el carrito (set_cart): el contador se actualiza enseguida
+  useEffect(() => {
+    if (store?.token) refreshSummary(store.token);
+  }, [store?.cartItems]);
+
+  // sondeo del contador (otra pestaña, otro dispositivo...)
+  useEffect(() => {
+    if (!store?.token) return;
+
+    const id = setInterval(() => {
+      if (document.visibilityState === "visible") refreshSummary(store.token);
+    }, SUMMARY_POLL_MS);
+    return () => clearInterval(id);
+  }, [store?.token]);
+
   const removeItem = async (itemId) => {
     if (!store?.token) return;
 
@@ -162,15 +202,15 @@ export default function Navbar() {
                         <div style={{ maxHeight: 280, overflowY: "auto" }}>
                           {cartItems.map((it) => (
                             <div key={it.id} className="border-bottom pb-2 mb-2">
-                              <div className="fw-semibold">{it.product?.title}</div>
+                              <div className="fw-semibold">{it.title}</div>
 
                               <div className="d-flex justify-content-between align-items-center">
                                 <div className="small text-muted">
-                                  {(it.product?.price_cents || 0) / 100}€ / ud
+                                  {(it.price_cents || 0) / 100}€ / ud
                                 </div>
                                 <div className="small">
                                   <strong>
-                                    {(((it.product?.price_cents || 0) * it.quantity) / 100).toFixed(2)}€
+                                    {(((it.price_cents || 0) * it.quantity) / 100).toFixed(2)}€
                                   </strong>
                                 </div>
                               </div>
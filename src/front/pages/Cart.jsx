@@ -28,33 +28,17 @@ export default function Cart() {
     // evita warning
   }, []);
 
-  const setQty = async (itemId, qty) => {
+  // Cambios en el carrito: un único PATCH que ya devuelve el carrito actualizado
+  const patchCart = async (operations) => {
     setError("");
 
-    // Si llega a cero se borra
-    if (qty <= 0) {
-      const res = await fetch(`${store.backendUrl}/api/cart-items/${itemId}`, {
-        method: "DELETE",
-        headers: { Authorization: `Bearer ${store.token}` },
-      });
-
-      if (res.status === 401) {
-        dispatch({ type: "logout" });
-        return;
-      }
-
-      await load();
-      return;
-    }
-
-    // SI es uno o mas actualiza
-    const res = await fetch(`${store.backendUrl}/api/cart-items/${itemId}`, {
-      method: "PUT",
+    const res = await fetch(`${store.backendUrl}/api/cart-items`, {
+      method: "PATCH",
       headers: {
         "Content-Type": "application/json",
         Authorization: `Bearer ${store.token}`,
       },
-      body: JSON.stringify({ quantity: qty }),
+      body: JSON.stringify({ operations }),
     });
 
     if (res.status === 401) {
@@ -62,25 +46,21 @@ export default function Cart() {
       return;
     }
 
-    await load();
-  };
-
-  const remove = async (itemId) => {
-    setError("");
-
-    const res = await fetch(`${store.backendUrl}/api/cart-items/${itemId}`, {
-      method: "DELETE",
-      headers: { Authorization: `Bearer ${store.token}` },
-    });
-
-    if (res.status === 401) {
-      dispatch({ type: "logout" });
+    const data = await res.json();
+    if (!res.ok) {
+      setError(data?.error || "No se pudo actualizar el carrito");
+      await load();
       return;
     }
 
-    await load();
+    dispatch({ type: "set_cart", payload: data });
   };
 
+  // Si llega a cero se borra (lo hace el backend con set <= 0)
+  const setQty = (itemId, qty) => patchCart([{ op: "set", id: itemId, quantity: qty }]);
+
+  const remove = (itemId) => patchCart([{ op: "remove", id: itemId }]);
+
   // Stripe Checkout
   const pay = async () => {
     setError("");
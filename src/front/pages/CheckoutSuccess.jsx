@@ -1,10 +1,11 @@
 import { useEffect, useState } from "react";
-import { Link, useNavigate } from "react-router-dom";
+import { Link, useNavigate, useSearchParams } from "react-router-dom";
 import useGlobalReducer from "../hooks/useGlobalReducer";
 
 export default function CheckoutSuccess() {
   const { store, dispatch } = useGlobalReducer();
   const navigate = useNavigate();
+  const [searchParams] = useSearchParams();
 
   const [msg, setMsg] = useState("Pago completado ✅");
   const [error, setError] = useState("");
@@ -18,7 +19,11 @@ export default function CheckoutSuccess() {
       try {
         const res = await fetch(`${store.backendUrl}/api/checkout/success`, {
           method: "POST",
-          headers: { Authorization: `Bearer ${store.token}` },
+          headers: {
+            "Content-Type": "application/json",
+            Authorization: `Bearer ${store.token}`,
+          },
+          body: JSON.stringify({ session_id: searchParams.get("session_id") }),
         });
 
         if (res.status === 401) {
@@ -33,7 +38,10 @@ export default function CheckoutSuccess() {
         // deja el carrito vacío en el front
         dispatch({ type: "set_cart", payload: [] });
 
-        setMsg(`Pago completado ✅ (${data.cleared} items vaciados del carrito)`);
+        // el pedido queda "pending" hasta que Stripe confirma el pago por webhook
+        setMsg(data.order.status === "paid"
+          ? `Pago completado ✅ Pedido #${data.order.id} (${data.order.item_count} productos)`
+          : `Pedido #${data.order.id} recibido, confirmando el pago...`);
       } catch (e) {
         setError(e.message || "Error");
       }
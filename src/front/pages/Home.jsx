@@ -5,14 +5,16 @@ import useGlobalReducer from "../hooks/useGlobalReducer";
 export default function Home() {
   const { store, dispatch } = useGlobalReducer();
   const [error, setError] = useState("");
+  // página propia: no pisa el catálogo paginado del store (Products.jsx)
+  const [products, setProducts] = useState([]);
 
   useEffect(() => {
     const load = async () => {
       try {
         setError("");
-        const resp = await fetch(`${store.backendUrl}/api/products`);
+        const resp = await fetch(`${store.backendUrl}/api/products?limit=22`);
         const data = await resp.json();
-        dispatch({ type: "set_products", payload: data });
+        setProducts(data?.items ?? []);
       } catch {
         setError("No se pudieron cargar productos.");
       }
@@ -22,9 +24,8 @@ export default function Home() {
   }, [store.backendUrl]);
 
   const featured = useMemo(() => {
-    const list = Array.isArray(store.products) ? store.products : [];
-    return list.slice(16, 22); 
-  }, [store.products]);
+    return products.slice(16, 22);
+  }, [products]);
 
   const add = async (productId) => {
     if (!store.token) return alert("Debes hacer login para añadir al carrito");
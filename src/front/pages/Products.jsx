@@ -1,33 +1,62 @@
-import { useEffect, useMemo, useState } from "react";
+import { useEffect, useState } from "react";
 import { Link } from "react-router-dom";
 import useGlobalReducer from "../hooks/useGlobalReducer";
 
+const PAGE_SIZE = 100;
+const SEARCH_DELAY_MS = 300;
+
+// con texto se busca en todo el catálogo (/api/products/search), no solo en lo cargado
+const productsUrl = (backendUrl, query, cursor) => {
+  const params = new URLSearchParams({ limit: PAGE_SIZE });
+  if (query) params.set("q", query);
+  if (cursor) params.set("cursor", cursor);
+  return `${backendUrl}/api/products${query ? "/search" : ""}?${params}`;
+};
+
 export default function Products() {
   const { store, dispatch } = useGlobalReducer();
   const [error, setError] = useState("");
   const [q, setQ] = useState("");
+  const [query, setQuery] = useState("");
+  const [loadingMore, setLoadingMore] = useState(false);
+
+  useEffect(() => {
+    const timer = setTimeout(() => setQuery(q.trim()), SEARCH_DELAY_MS);
+    return () => clearTimeout(timer);
+  }, [q]);
 
   useEffect(() => {
+    let ignore = false; // respuesta de una búsqueda anterior que llega tarde
     const load = async () => {
       try {
         setError("");
-        const resp = await fetch(`${store.backendUrl}/api/products`);
+        const resp = await fetch(productsUrl(store.backendUrl, query));
         const data = await resp.json();
-        dispatch({ type: "set_products", payload: data });
+        if (!ignore) dispatch({ type: "set_products", payload: resp.ok ? data : [] });
       } catch {
-        setError("No se pudieron cargar productos.");
+        if (!ignore) setError("No se pudieron cargar productos.");
       }
     };
     load();
+    return () => {
+      ignore = true;
+    };
+  }, [store.backendUrl, query]);
 
-  }, [store.backendUrl]);
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      const resp = await fetch(productsUrl(store.backendUrl, query, store.productsCursor));
+      const data = await resp.json();
+      dispatch({ type: "append_products", payload: data });
+    } catch {
+      setError("No se pudieron cargar más productos.");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
-  const filtered = useMemo(() => {
-    const list = Array.isArray(store.products) ? store.products : [];
-    const query = q.trim().toLowerCase();
-    if (!query) return list;
-    return list.filter((p) => (p.title || "").toLowerCase().includes(query));
-  }, [store.products, q]);
+  const products = Array.isArray(store.products) ? store.products : [];
 
   const add = async (productId) => {
     if (!store.token) return alert("Debes hacer login para añadir al carrito");
@@ -59,7 +88,7 @@ export default function Products() {
         <div style={{ width: 320 }}>
           <input
             className="form-control"
-            placeholder="Buscar por título..."
+            placeholder="Buscar productos..."
             value={q}
             onChange={(e) => setQ(e.target.value)}
           />
@@ -77,7 +106,7 @@ export default function Products() {
           </tr>
         </thead>
         <tbody>
-          {filtered.map((p) => (
+          {products.map((p) => (
             <tr key={p.id}>
               <td>
                 <div className="d-flex align-items-center gap-2">
@@ -112,7 +141,7 @@ export default function Products() {
             </tr>
           ))}
 
-          {filtered.length === 0 && (
+          {products.length === 0 && (
             <tr>
               <td colSpan="3" className="text-muted">
                 No hay productos
@@ -121,6 +150,14 @@ export default function Products() {
           )}
         </tbody>
       </table>
+
+      {store.productsCursor && (
+        <div className="text-center mb-4">
+          <button className="btn btn-outline-primary" onClick={loadMore} disabled={loadingMore}>
+            {loadingMore ? "Cargando..." : "Cargar más"}
+          </button>
+        </div>
+      )}
     </div>
   );
 }
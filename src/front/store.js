@@ -3,7 +3,10 @@ export const initialStore = () => ({
   user: null,
   token: localStorage.getItem("token") || null,
   products: [],
+  productsCursor: null, // next_cursor de la última página cargada (null = no hay más)
   cartItems: [], // items del backend: [{id, product, quantity, ...}]
+  cartLines: [], // líneas compactas (?view=compact): [{id, product_id, title, price_cents, image_url, quantity}]
+  cartSummary: { lines: 0, item_count: 0, total_cents: 0 }, // GET /api/cart/summary
 });
 
 async function apiFetch(url, options = {}) {
@@ -24,8 +27,20 @@ async function apiFetch(url, options = {}) {
 
 export default function storeReducer(store, action = {}) {
   switch (action.type) {
-    case "set_products":
-      return { ...store, products: action.payload };
+    case "set_products": {
+      // /api/products devuelve { items, next_cursor } (o lista con ?all=true)
+      const payload = action.payload;
+      const products = Array.isArray(payload) ? payload : (payload?.items ?? []);
+      return { ...store, products, productsCursor: payload?.next_cursor ?? null };
+    }
+
+    case "append_products": {
+      // página siguiente (cursor): se añade a lo ya cargado sin repetir ids
+      const payload = action.payload;
+      const seen = new Set(store.products.map((p) => p.id));
+      const more = (payload?.items ?? []).filter((p) => !seen.has(p.id));
+      return { ...store, products: [...store.products, ...more], productsCursor: payload?.next_cursor ?? null };
+    }
 
     case "login_success":
       localStorage.setItem("token", action.payload.token);
@@ -37,7 +52,14 @@ export default function storeReducer(store, action = {}) {
 
     case "logout":
       localStorage.removeItem("token");
-      return { ...store, token: null, user: null, cartItems: [] };
+      return {
+        ...store,
+        token: null,
+        user: null,
+        cartItems: [],
+        cartLines: [],
+        cartSummary: initialStore().cartSummary,
+      };
 
     // Alias/Nombre
     case "set_me":
@@ -56,6 +78,12 @@ export default function storeReducer(store, action = {}) {
       return { ...store, cartItems: items };
     }
 
+    case "set_cart_lines":
+      return { ...store, cartLines: Array.isArray(action.payload) ? action.payload : [] };
+
+    case "set_cart_summary":
+      return { ...store, cartSummary: action.payload || initialStore().cartSummary };
+
     // si no reconoce la acción, devuelve el store actual
     default:
       return store;
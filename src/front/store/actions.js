@@ -4,11 +4,20 @@ const authHeaders = (token) => ({
 });
 
 export const fetchProducts = async (store, dispatch) => {
-  const resp = await fetch(`${store.backendUrl}/api/products`);
+  const resp = await fetch(`${store.backendUrl}/api/products?limit=100`);
   const data = await resp.json();
   dispatch({ type: "set_products", payload: data });
 };
 
+// siguiente página del catálogo (store.productsCursor); no hace nada si ya no hay más
+export const fetchMoreProducts = async (store, dispatch) => {
+  if (!store.productsCursor) return;
+  const cursor = encodeURIComponent(store.productsCursor);
+  const resp = await fetch(`${store.backendUrl}/api/products?limit=100&cursor=${cursor}`);
+  const data = await resp.json();
+  dispatch({ type: "append_products", payload: data });
+};
+
 export const fetchMe = async (store, dispatch) => {
   if (!store.token) return;
 